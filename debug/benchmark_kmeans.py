@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Compare the run times and stop/trip labels of the K-Means implementations used to split CANUE
+# preprocessed coordinates on the users of the configured survey.
+
+# run from parent directory
+import os
+import sys
+import time
+sys.path[0] = sys.path[0].replace('/debug', '')
+os.chdir(sys.path[0])
+# begin
+from tripkit import TripKit
+import tripkit_config
+
+# the pure-Python K-Means++ takes minutes for larger users
+KMEANSPP_MAX_POINTS = 100000
+
+
+def timed_labels(func, coordinates):
+    start = time.time()
+    func(coordinates)
+    return time.time() - start, [c.kmeans.label for c in coordinates]
+
+
+# Edit ./tripkit_config.py first!
+tripkit = TripKit(config=tripkit_config)
+tripkit.setup(force=False)
+users = tripkit.load_users(load_trips=False)
+if not isinstance(users, list):
+    users = [users]
+
+implementations = {
+    'kmeans1d': tripkit.process.clustering.kmeans1d.run,
+    'kmeans': tripkit.process.clustering.kmeans.run,
+    'kmeanspp': tripkit.process.clustering.kmeanspp.run,
+}
+totals = {name: 0.0 for name in implementations}
+for idx, user in enumerate(users, start=1):
+    coordinates = tripkit.process.canue.preprocess.run(user.uuid, user.coordinates)
+    if len(coordinates) < 2:
+        continue
+
+    print(f"User {user.uuid} ({idx}/{len(users)}): {len(coordinates)} points")
+    base_time, base_labels = timed_labels(implementations['kmeans1d'], coordinates)
+    totals['kmeans1d'] += base_time
+    print(f"    kmeans1d: {base_time:.3f}s")
+    for name, func in implementations.items():
+        if name == 'kmeans1d' or (name == 'kmeanspp' and len(coordinates) > KMEANSPP_MAX_POINTS):
+            continue
+        try:
+            run_time, labels = timed_labels(func, coordinates)
+        except ImportError:
+            print(f"    {name}: not installed")
+            continue
+        totals[name] += run_time
+        num_different = sum(1 for l1, l2 in zip(base_labels, labels) if l1 != l2)
+        print(f"    {name}: {run_time:.3f}s ({base_time and run_time / base_time:.1f}x), {num_different} labels differ")
+
+print("Total run times:")
+for name, total in totals.items():
+    print(f"    {name}: {total:.3f}s")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Measure the memory used by the library models for a large synthetic survey held in memory at once,
+# comparing trips with points stored as columns against trips built from individual TripPoint objects.
+
+# run from parent directory
+import os
+import sys
+import tracemalloc
+from datetime import date, datetime, timedelta
+sys.path[0] = sys.path[0].replace('/debug', '')
+os.chdir(sys.path[0])
+# begin
+from tripkit.models import ActivityLocation, DaySummary, Trip, TripPoint, TripPoints
+
+# survey size to measure, the totals are extrapolated to the full survey
+NUM_USERS = 20
+FULL_SURVEY_USERS = 5000
+DAYS_PER_USER = 30
+TRIPS_PER_DAY = 4
+POINTS_PER_TRIP = 250
+ACTIVITY_LOCATIONS_PER_USER = 3
+WORKER_MEMORY_GB = 16
+
+
+def synthetic_columns(start, num_points):
+    timestamps = [start + timedelta(seconds=5 * idx) for idx in range(num_points)]
+    return {
+        'database_id': range(num_points),
+        'latitude': [45.5 + idx * 1e-5 for idx in range(num_points)],
+        'longitude': [-73.6 + idx * 1e-5 for idx in range(num_points)],
+        'h_accuracy': [10.0] * num_points,
+        'distance_before': [5.0] * num_points,
+        'trip_distance': [5.0 * idx for idx in range(num_points)],
+        'period_before': [5] * num_points,
+        'timestamp_UTC': timestamps,
+    }
+
+
+def columnar_trip(num, start):
+    return Trip(num=num, trip_code=1, points=TripPoints(**synthetic_columns(start, POINTS_PER_TRIP)))
+
+
+def object_trip(num, start):
+    columns = synthetic_columns(start, POINTS_PER_TRIP)
+    points = [TripPoint(*values) for values in zip(*columns.values())]
+    trip = Trip(num=num, trip_code=1)
+    # keep the TripPoint objects as a list, as trips were stored before columns
+    trip._points = points
+    return trip
+
+
+def synthetic_user_models(build_trip):
+    trips, day_summaries = [], []
+    for day in range(DAYS_PER_USER):
+        day_start = datetime(2019, 1, 1) + timedelta(days=day)
+        for num in range(TRIPS_PER_DAY):
+            trips.append(build_trip(len(trips) + 1, day_start + timedelta(hours=3 * num)))
+        day_summaries.append(
+            DaySummary(
+                timezone='America/Montreal',
+                date=date(2019, 1, 1) + timedelta(days=day),
+                has_trips=True,
+                is_complete=True,
+                start_point=trips[-TRIPS_PER_DAY].start,
+                end_point=trips[-1].end,
+                consecutive_inactive_days=0,
+                inactivity_streak=0,
+            )
+        )
+    locations = [ActivityLocation(f'location_{idx}', 45.5, -73.6) for idx in range(ACTIVITY_LOCATIONS_PER_USER)]
+    return trips, day_summaries, locations
+
+
+def measure(build_trip):
+    tracemalloc.start()
+    survey = [synthetic_user_models(build_trip) for _ in range(NUM_USERS)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del survey
+    return size
+
+
+num_points = NUM_USERS * DAYS_PER_USER * TRIPS_PER_DAY * POINTS_PER_TRIP
+print(f"Synthetic survey: {NUM_USERS} users, {num_points} trip points")
+for name, build_trip in [('columns', columnar_trip), ('TripPoint objects', object_trip)]:
+    size = measure(build_trip)
+    full_survey_gb = size * FULL_SURVEY_USERS / NUM_USERS / 1e9
+    print(
+        f"    {name}: {size / 1e6:.1f} MB, {size / num_points:.0f} bytes per point, "
+        f"{full_survey_gb:.1f} GB for {FULL_SURVEY_USERS} users ({WORKER_MEMORY_GB} GB workers)"
+    )
@@ -32,7 +32,7 @@ users = tripkit.load_users(limit=5, load_trips=False)
 # run trip detection days algorithms
 all_summaries = []
 parameters = {
-    'subway_entrances': tripkit.database.load_subway_entrances(),
+    'subway_entrances': tripkit.database.load_subway_entrances(spatial_index=True),
     'break_interval_seconds': cfg.TRIP_DETECTION_BREAK_INTERVAL_SECONDS,
     'subway_buffer_meters': cfg.TRIP_DETECTION_SUBWAY_BUFFER_METERS,
     'cold_start_distance': cfg.TRIP_DETECTION_COLD_START_DISTANCE_METERS,
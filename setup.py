@@ -12,7 +12,6 @@ setuptools.setup(
     install_requires=[
         'fiona>=1.8.6',
         'geopy>=1.20.0',
-        'networkx>=2.4',
         'numpy>=1.17.3',
         'peewee>=3.10.0',
         'polyline>=1.4.0',
@@ -58,13 +58,15 @@ def _load_subway_stations(subway_stations_csv_fp):
             SubwayStationEntrance.create(latitude=float(row['latitude']), longitude=float(row['longitude']))
 
 
-def _load_user_locations(locations_csv_fp, uuid_lookup=None):
+def _load_user_locations(locations_csv_fp, uuid_lookup=None, user_ids=None):
     '''
     Loads user location labels and centroids from file.
 
     :param locations_csv_fp: The full filepath of an user locations csv.
+    :param user_ids:         Supply a set of the file's user ids to only load these users' locations.
 
     :param type locations_csv_fp: str
+    :param type user_ids:         set, optional
     '''
     logger.info("Loading user locations .csv to db...")
     with open(locations_csv_fp, 'r') as csv_f:
@@ -76,7 +78,7 @@ def _load_user_locations(locations_csv_fp, uuid_lookup=None):
         reader.fieldnames = [name.lower() for name in reader.fieldnames]
         for row in reader:
             user_id = row.get('user').strip()
-            if not user_id:
+            if not user_id or (user_ids is not None and user_id not in user_ids):
                 continue
             if uuid_lookup:
                 user_id = uuid_lookup[user_id]
@@ -105,11 +107,15 @@ def _generate_null_survey(input_dir, coordinates_csv_fn, id_column='uuid', uuid_
             orig_id_idx = headers.index(id_column)
             orig_ids = {r[orig_id_idx] for r in reader}
 
+    # skip users already in the survey responses table
+    existing_uuids = {r.uuid.hex for r in UserSurveyResponse.select(UserSurveyResponse.uuid)}
     for uuid in orig_ids:
         orig_id = None
         if uuid_lookup:
             orig_id = uuid
             uuid = uuid_lookup[orig_id]
+        if uuid.replace('-', '').lower() in existing_uuids:
+            continue
 
         UserSurveyResponse.create(
             uuid=uuid,
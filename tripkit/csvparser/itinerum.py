@@ -4,8 +4,8 @@ import csv
 from datetime import datetime
 import logging
 import os
-from playhouse.migrate import migrate, SqliteMigrator
 
+from . import parallel
 from .common import _generate_null_survey, _load_subway_stations
 from ..database import (
     UserSurveyResponse,
@@ -15,6 +15,7 @@ from ..database import (
     DetectedTripCoordinate,
     SubwayStationEntrance,
 )
+from ..utils.misc import uuid_hex
 
 logger = logging.getLogger('itinerum-tripkit.csvparser.itinerum')
 
@@ -41,18 +42,6 @@ def _survey_response_row_filter(row):
     return row
 
 
-def _coordinates_row_filter(row):
-    # reject invalid rows
-    if not row['timestamp_UTC']:
-        return None
-
-    row['user'] = row.pop('uuid')
-    for key, value in row.items():
-        if value == '':
-            row[key] = None
-    return row
-
-
 def _prompts_row_filter(row):
     row['user'] = row.pop('uuid')
     trim_columns = ['displayed_at_epoch', 'recorded_at_epoch', 'edited_at_epoch']
@@ -86,7 +75,6 @@ class ItinerumCSVParser(object):
 
     def __init__(self, database):
         self.db = database
-        self._migrator = SqliteMigrator(database.db)
         self.cancelled_prompt_responses_csv = 'cancelled_prompts.csv'
         self.coordinates_csv = 'coordinates.csv'
         self.prompt_responses_csv = 'prompt_responses.csv'
@@ -122,56 +110,113 @@ class ItinerumCSVParser(object):
         '''
         _generate_null_survey(input_dir, self.coordinates_csv)
 
-    def load_export_survey_responses(self, input_dir):
+    @staticmethod
+    def _new_survey_responses(rows, changed_users):
+        existing_uuids = {r.uuid.hex for r in UserSurveyResponse.select(UserSurveyResponse.uuid)}
+        for row in rows:
+            if not row:
+                continue
+            user = uuid_hex(row['uuid'])
+            if user not in existing_uuids:
+                changed_users.add(user)
+                yield row
+
+    def load_export_survey_responses(self, input_dir, changed_users=None):
         '''
         Loads Itinerum survey responses data to the cache database.
 
-        :param input_dir: The directory containing the `self.survey_responses_csv` data file.
+        :param input_dir:     The directory containing the `self.survey_responses_csv` data file.
+        :param changed_users: Supply a set to only load survey responses of new users to an existing
+                              cache database, the UUIDs (hex) of new users are added to the set.
+
+        :type changed_users:  set, optional
         '''
         survey_responses_fp = os.path.join(input_dir, self.survey_responses_csv)
         survey_responses_rows = self._row_generator(survey_responses_fp, _survey_response_row_filter)
+        if changed_users is not None:
+            survey_responses_rows = self._new_survey_responses(survey_responses_rows, changed_users)
         self.db.bulk_insert(UserSurveyResponse, survey_responses_rows)
 
-    def load_export_coordinates(self, input_dir):
+    def load_export_coordinates(self, input_dir, workers=1, changed_users=None):
         '''
         Loads Itinerum coordinates data to the cache database.
 
-        :param input_dir: The directory containing the `self.coordinates_csv` data file.
+        :param input_dir:     The directory containing the `self.coordinates_csv` data file.
+        :param workers:       Number of processes to parse the .csv file with in parallel.
+        :param changed_users: Supply a set to only load coordinates newer than each user's latest cached
+                              coordinate, the UUIDs (hex) of users with new coordinates are added to the set.
+
+        :type workers:        int, optional
+        :type changed_users:  set, optional
         '''
         logger.info("Loading coordinates .csv to db...")
-        migrate(self._migrator.drop_index(Coordinate, 'coordinate_user_id'))
+        if changed_users is None:
+            self.db.drop_indexes(Coordinate)
+        else:
+            # caches created before the unique (user, timestamp_epoch) index are deduplicated once
+            self.db.create_indexes(Coordinate)
         coordinates_fp = os.path.join(input_dir, self.coordinates_csv)
-        coordinates_rows = self._row_generator(coordinates_fp, _coordinates_row_filter)
-        self.db.bulk_insert(Coordinate, coordinates_rows)
-        migrate(self._migrator.add_index('coordinates', ('user_id',), False))
-
-    def load_export_prompt_responses(self, input_dir):
+        headers = parallel.read_headers(coordinates_fp)
+        # text timestamps are not stored when coordinates are read by epoch timestamps
+        omit = [] if self.db.text_timestamps_required() else ['timestamp_UTC']
+        context = parallel.user_row_context(Coordinate, headers, required=['timestamp_UTC'], omit=omit)
+        coordinates_rows = parallel.row_generator(coordinates_fp, parallel.user_row_tuple, context, workers)
+        if changed_users is None:
+            self.db.bulk_insert(Coordinate, coordinates_rows)
+        else:
+            # new rows repeating a (user, timestamp_epoch) key are skipped by the unique index
+            coordinates_rows = self.db.increment_rows(Coordinate, coordinates_rows, 'timestamp_epoch', changed_users)
+            self.db.bulk_insert(Coordinate, coordinates_rows, ignore_conflicts=True)
+        self.db.create_indexes(Coordinate)
+
+    def load_export_prompt_responses(self, input_dir, changed_users=None):
         '''
         Loads Itinerum prompt responses data to the cache database. For each .csv row, the data 
         is fetched by column name if it exists and cast to appropriate types as set in the database.
 
-        :param input_dir: The directory containing the `self.prompt_responses.csv` data file.
+        :param input_dir:     The directory containing the `self.prompt_responses.csv` data file.
+        :param changed_users: Supply a set to only load prompts displayed after each user's latest cached
+                              prompt, the UUIDs (hex) of users with new prompts are added to the set.
+
+        :type changed_users:  set, optional
         '''
         logger.info("Loading prompt responses .csv to db...")
-        migrate(self._migrator.drop_index(PromptResponse, 'promptresponse_user_id'))
+        if changed_users is None:
+            self.db.drop_indexes(PromptResponse)
         prompt_responses_fp = os.path.join(input_dir, self.prompt_responses_csv)
         prompt_responses_rows = self._row_generator(prompt_responses_fp, _prompts_row_filter)
+        if changed_users is not None:
+            prompt_responses_rows = self.db.increment_rows(
+                PromptResponse, prompt_responses_rows, 'displayed_at_UTC', changed_users
+            )
         self.db.bulk_insert(PromptResponse, prompt_responses_rows)
-        migrate(self._migrator.add_index('prompt_responses', ('user_id',), False))
+        self.db.create_indexes(PromptResponse)
 
-    def load_export_cancelled_prompt_responses(self, input_dir):
+    def load_export_cancelled_prompt_responses(self, input_dir, changed_users=None):
         '''
         Loads Itinerum cancelled prompt responses data to the cache database. For each .csv row, the data
         is fetched by column name if it exists and cast to appropriate types as set in the database.
 
-        :param input_dir: The directory containing the `self.cancelled_prompt_responses.csv` data file.
+        :param input_dir:     The directory containing the `self.cancelled_prompt_responses.csv` data file.
+        :param changed_users: Supply a set to only load cancelled prompts displayed after each user's latest
+                              cached cancelled prompt, the UUIDs (hex) of users with new cancelled prompts
+                              are added to the set.
+
+        :type changed_users:  set, optional
         '''
         logger.info("Loading cancelled prompt responses .csv to db...")
+        if changed_users is None:
+            self.db.drop_indexes(CancelledPromptResponse)
         cancelled_prompt_responses_fp = os.path.join(input_dir, self.cancelled_prompt_responses_csv)
         cancelled_prompt_responses_rows = self._row_generator(
             cancelled_prompt_responses_fp, _cancelled_prompts_row_filter
         )
+        if changed_users is not None:
+            cancelled_prompt_responses_rows = self.db.increment_rows(
+                CancelledPromptResponse, cancelled_prompt_responses_rows, 'displayed_at_UTC', changed_users
+            )
         self.db.bulk_insert(CancelledPromptResponse, cancelled_prompt_responses_rows)
+        self.db.create_indexes(CancelledPromptResponse)
 
     def load_trips(self, trips_csv_fp):
         '''
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Parallel parsing of large .csv files. The file is split into byte ranges on newline
+# boundaries and each range is parsed to row tuples within a worker process, the rows
+# are returned in file order to a single writer for the cache database. With a single
+# worker, the file is parsed to the same row tuples within the current process.
+import csv
+import io
+import logging
+import mmap
+import multiprocessing
+
+from ..utils.misc import uuid_hex
+
+
+logger = logging.getLogger('itinerum-tripkit.csvparser.parallel')
+
+# size of the byte ranges read by workers, ranges end on the first newline after this length
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# per-process state initialized once for each worker
+_worker = {}
+
+
+def read_headers(csv_fp):
+    '''
+    Returns the header row of a .csv file.
+    '''
+    with open(csv_fp, 'r', encoding='utf-8-sig') as csv_f:
+        return next(csv.reader(csv_f))
+
+
+def byte_ranges(csv_fp, chunk_bytes=CHUNK_BYTES):
+    '''
+    Splits the rows of a .csv file into byte ranges that begin and end on line boundaries. Rows
+    with quoted newlines are not supported since a range could begin within a row.
+
+    :param csv_fp:      The full filepath of the .csv file.
+    :param chunk_bytes: The minimum length of each byte range.
+
+    :type csv_fp:       str
+    :type chunk_bytes:  int, optional
+
+    :rtype: list of (start, end) tuples
+    '''
+    ranges = []
+    with open(csv_fp, 'rb') as csv_f:
+        csv_f.seek(0, 2)
+        if csv_f.tell() == 0:
+            return ranges
+        with mmap.mmap(csv_f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            # skip the header row
+            start = mm.find(b'\n') + 1
+            if start == 0:
+                return ranges
+            while start < size:
+                end = mm.find(b'\n', min(start + chunk_bytes, size) - 1)
+                end = size if end == -1 else end + 1
+                ranges.append((start, end))
+                start = end
+    return ranges
+
+
+def user_row_tuple(row, context):
+    '''
+    Returns a .csv row as a tuple of values in the order of a table's columns for
+    `Database.bulk_insert`. Empty cells are inserted as nulls and text values are cast by the
+    column types within SQLite as for rows inserted from dictionaries.
+
+    :param row:     The .csv row's cells.
+    :param context: The `required` cell indexes of values that must exist for the row to be inserted,
+                    the `user` cell index with the row's UUID and the cell `indexes` of the remaining
+                    columns, which are `None` for columns inserted as nulls.
+
+    :type row:      list
+    :type context:  dict
+    '''
+    for idx in context['required']:
+        if not row[idx]:
+            return None
+    values = [uuid_hex(row[context['user']])]
+    values.extend((row[idx] or None) if idx is not None else None for idx in context['indexes'])
+    return tuple(values)
+
+
+def user_row_context(Model, headers, required=None, omit=None):
+    '''
+    Maps a table's columns to the cells of a .csv row for `user_row_tuple`. The table's `user`
+    foreign key is read from the `uuid` column and all other column names must match the headers.
+
+    :param Model:    Peewee database model of target table for inserts.
+    :param headers:  The .csv header row.
+    :param required: Column names of values that must exist for a row to be inserted.
+    :param omit:     Column names to insert as nulls instead of reading from the .csv rows.
+
+    :type headers:   list
+    :type required:  list, optional
+    :type omit:      list, optional
+    '''
+    columns = list(Model._meta.columns.keys())
+    if 'id' in columns:
+        columns.remove('id')
+    if columns[0] != 'user_id':
+        raise Exception(f"Parallel .csv parsing requires the user column first: {Model._meta.table_name}")
+    return {
+        'required': [headers.index(c) for c in required or []],
+        'user': headers.index('uuid'),
+        'indexes': [None if c in (omit or []) else headers.index(c) for c in columns[1:]],
+    }
+
+
+def _init_worker(csv_fp, row_func, context):
+    # the mapping holds its own duplicate of the file descriptor, so the file can be closed once mapped
+    with open(csv_fp, 'rb') as csv_f:
+        _worker['mm'] = mmap.mmap(csv_f.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker['row_func'] = row_func
+    _worker['context'] = context
+
+
+def _parse_range(byte_range):
+    start, end = byte_range
+    text = _worker['mm'][start:end].decode('utf-8')
+    row_func, context = _worker['row_func'], _worker['context']
+    rows = []
+    for row in csv.reader(io.StringIO(text, newline='')):
+        if not row:
+            continue
+        db_row = row_func(row, context)
+        if db_row:
+            rows.append(db_row)
+    return rows
+
+
+def _serial_row_generator(csv_fp, row_func, context):
+    with open(csv_fp, 'r', encoding='utf-8-sig') as csv_f:
+        reader = csv.reader(csv_f)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            db_row = row_func(row, context)
+            if db_row:
+                yield db_row
+
+
+def row_generator(csv_fp, row_func, context, workers=None, chunk_bytes=CHUNK_BYTES):
+    '''
+    Parses a .csv file across a pool of worker processes and yields the rows returned by
+    ``row_func`` in file order. A single worker parses the file within the current process.
+
+    :param csv_fp:      The full filepath of the .csv file.
+    :param row_func:    Module-level function to parse a row's cells with ``context``, returning
+                        `None` for rows to skip.
+    :param context:     Picklable data passed to ``row_func`` with each row.
+    :param workers:     Number of worker processes, defaults to the number of CPUs.
+    :param chunk_bytes: The minimum length of the byte range parsed by a worker at a time.
+
+    :type csv_fp:       str
+    :type workers:      int, optional
+    :type chunk_bytes:  int, optional
+    '''
+    if workers == 1:
+        yield from _serial_row_generator(csv_fp, row_func, context)
+        return
+
+    ranges = byte_ranges(csv_fp, chunk_bytes)
+    if not ranges:
+        return
+    workers = min(workers or multiprocessing.cpu_count(), len(ranges))
+    logger.info(f"Parsing {csv_fp} as {len(ranges)} chunks with {workers} workers...")
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(csv_fp, row_func, context)) as pool:
+        for rows in pool.imap(_parse_range, ranges):
+            yield from rows
@@ -1,20 +1,112 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2019
 import csv
-from datetime import datetime
+from datetime import date
+import functools
 import json
 import logging
 import os
-from playhouse.migrate import migrate, SqliteMigrator
 import pytz
 import uuid
 
+from . import parallel
 from .common import _generate_null_survey, _load_subway_stations, _load_user_locations
-from ..database import Coordinate
+from ..database import Coordinate, UserSurveyResponse
 from ..utils.misc import temp_path
 
 logger = logging.getLogger('itinerum-tripkit.csvparser.qstarz')
 
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# .csv row filters for parsing QStarz exports to database models
+def _cell(row, idx):
+    '''
+    Helper function to return a .csv row's cell value or `None` for a cell missing from the row
+    or the headers.
+    '''
+    if idx is not None and idx < len(row):
+        return row[idx]
+
+
+def _cell_or_none(row, idx):
+    '''
+    Helper function to return the cell value stripped of whitespace or `None` for a 0-length string
+    from a .csv cell value.
+    '''
+    v = _cell(row, idx)
+    if v:
+        return v.strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date(utc_date):
+    # NOTE: QStarz data returns a 2-digit year
+    year, month, day = utc_date.split('/')
+    if len(year) == 2:
+        year = '20' + year
+    year, month, day = int(year), int(month), int(day)
+    epoch_days = date(year, month, day).toordinal() - EPOCH_ORDINAL
+    return f'{year:04d}-{month:02d}-{day:02d}', epoch_days * 86400
+
+
+def _parse_timestamp(utc_date, utc_time):
+    '''
+    Returns the UTC timestamp text (as stored for timezone-aware datetimes) and epoch seconds from
+    the QStarz date and time columns. Dates are parsed once and the time is added as integers.
+    '''
+    date_str, date_epoch = _parse_date(utc_date)
+    hour, minute, second = utc_time.split(':')
+    hour, minute, second = int(hour), int(minute), int(second)
+    timestamp_UTC = f'{date_str} {hour:02d}:{minute:02d}:{second:02d}+00:00'
+    return timestamp_UTC, date_epoch + hour * 3600 + minute * 60 + second
+
+
+def _coordinates_row_tuple(row, context):
+    '''
+    Returns a QStarz .csv row as a tuple of values in the order of the `Coordinate` table's columns
+    (excluding `id`) with the row's QStarz user id in place of the user's UUID, or `None` for rows
+    without a position.
+
+    :param row:     The .csv row's cells.
+    :param context: The `cells` indexes of the QStarz .csv headers and whether `text_timestamps`
+                    are stored.
+
+    :type row:      list
+    :type context:  dict
+    '''
+    cells = context['cells']
+    lat, lon = _cell_or_none(row, cells.get('LATITUDE')), _cell_or_none(row, cells.get('LONGITUDE'))
+    if not lat or not lon:
+        return
+    lat, lon = float(lat), float(lon)
+    if int(lat) == 0 and int(lon) == 0:
+        return
+    # add sign to negative lat/lons depending on hemisphere
+    if _cell(row, cells.get('N/S')) == 'S' and lat > 0:
+        lat *= -1
+    if _cell(row, cells.get('E/W')) == 'W' and lon > 0:
+        lon *= -1
+
+    timestamp_UTC, timestamp_epoch = _parse_timestamp(row[cells['UTC_DATE']], row[cells['UTC_TIME']])
+    return (
+        row[cells['USER']],
+        lat,
+        lon,
+        _cell_or_none(row, cells.get('ALTITUDE')),
+        _cell_or_none(row, cells.get('SPEED')),
+        _cell_or_none(row, cells.get('HEADING')),
+        None,
+        None,
+        _cell_or_none(row, cells.get('G-X')),
+        _cell_or_none(row, cells.get('G-Y')),
+        _cell_or_none(row, cells.get('G-Z')),
+        None,
+        None,
+        timestamp_UTC if context['text_timestamps'] else None,
+        timestamp_epoch,
+    )
+
 
 # .csv parsing
 class QstarzCSVParser(object):
@@ -29,7 +121,6 @@ class QstarzCSVParser(object):
     def __init__(self, config, database):
         self.config = config
         self.db = database
-        self._migrator = SqliteMigrator(database.db)
         self.coordinates_csv = 'coordinates.csv'
         self.locations_csv = 'locations.csv'
         self.headers = [
@@ -47,84 +138,30 @@ class QstarzCSVParser(object):
             'USER',
         ]
         self.uuid_lookup = None
+        # QStarz user ids of the users created by the latest coordinates load
+        self.new_user_ids = set()
 
         # attach common functions
         self.load_subway_stations = _load_subway_stations
         # intialize survey timezone offset
         self.tz = pytz.timezone(self.config.TIMEZONE)
 
-    @staticmethod
-    def _value_or_none(row, key):
-        '''
-        Helper function to return the value stripped of whitespace or `None` for a 0-length string
-        from a .csv cell value.
-        '''
-        v = row.get(key)
-        if v and isinstance(v, str):
-            return v.strip()
-
-    def _coordinates_row_filter(self, row):
-        lat, lon = self._value_or_none(row, 'LATITUDE'), self._value_or_none(row, 'LONGITUDE')
-        if not lat or not lon:
-            return
-        lat, lon = float(lat), float(lon)
-        if int(lat) == 0 and int(lon) == 0:
-            return
-        # add sign to negative lat/lons depending on hemisphere
-        if row.get('N/S') == 'S' and lat > 0:
-            lat *= -1
-        if row.get('E/W') == 'W' and lon > 0:
-            lon *= -1
-
-        # format date and time columns into Python datetime (NOTE: QStarz data returns a 2-digit year)
-        year, month, day = row['UTC_DATE'].split('/')
-        if len(year) == 2:
-            year = int('20' + year)
-        year, month, day = int(year), int(month), int(day)
-        hour, minute, second = [int(i) for i in row['UTC_TIME'].split(':')]
-        timestamp_UTC = datetime(year, month, day, hour, minute, second, tzinfo=pytz.utc)
-        timestamp_epoch = int(timestamp_UTC.timestamp())
-        db_row = {
-            'user': self.uuid_lookup[row['USER']],
-            'latitude': lat,
-            'longitude': lon,
-            'altitude': self._value_or_none(row, 'ALTITUDE'),
-            'speed': self._value_or_none(row, 'SPEED'),
-            'direction': self._value_or_none(row, 'HEADING'),
-            'h_accuracy': None,
-            'v_accuracy': None,
-            'acceleration_x': self._value_or_none(row, 'G-X'),
-            'acceleration_y': self._value_or_none(row, 'G-Y'),
-            'acceleration_z': self._value_or_none(row, 'G-Z'),
-            'point_type': None,
-            'mode_detected': None,
-            'timestamp_UTC': timestamp_UTC,
-            'timestamp_epoch': timestamp_epoch,
-        }
-        return db_row
-
-    # read .csv file, apply filter and yield row
-    def _row_generator(self, csv_fp, filter_func=None):
-        with open(csv_fp, 'r', encoding='utf-8-sig') as csv_f:
-            reader = csv.reader(csv_f)  # use zip() below instead of DictReader for speed
-            if not self.headers:
-                self.headers = next(reader)
-            else:
-                next(reader)
-
-            # generate dictionaries to insert and apply row filter if exists
-            for row in reader:
-                dict_row = dict(zip(self.headers, row))
-                yield filter_func(dict_row) if filter_func else dict_row
-
-    def _generate_uuids(self, input_dir):
-        self.uuid_lookup = {}
-        logger.info("Generating UUIDs for non-standard user ids...")
+    def _load_uuid_lookup(self):
         lookup_fp = temp_path(f'{self.config.SURVEY_NAME}.json')
         if os.path.exists(lookup_fp):
             with open(lookup_fp, 'r') as json_f:
-                self.uuid_lookup = json.load(json_f)
-        else:
+                return json.load(json_f)
+        return {}
+
+    def _save_uuid_lookup(self):
+        lookup_fp = temp_path(f'{self.config.SURVEY_NAME}.json')
+        with open(lookup_fp, 'w') as json_f:
+            json.dump(self.uuid_lookup, json_f)
+
+    def _generate_uuids(self, input_dir):
+        logger.info("Generating UUIDs for non-standard user ids...")
+        self.uuid_lookup = self._load_uuid_lookup()
+        if not self.uuid_lookup:
             coordinates_fp = os.path.join(input_dir, self.coordinates_csv)
             with open(coordinates_fp, 'r', encoding='utf-8-sig') as csv_f:
                 reader = csv.reader(csv_f)
@@ -137,12 +174,26 @@ class QstarzCSVParser(object):
                     user_id = r[user_id_idx]
                     if not user_id in self.uuid_lookup:
                         self.uuid_lookup[user_id] = str(uuid.uuid4())
-            with open(lookup_fp, 'w') as json_f:
-                json.dump(self.uuid_lookup, json_f)
+            self._save_uuid_lookup()
+
+    def _user_rows(self, rows, users):
+        '''
+        Replaces the QStarz user ids of coordinates row tuples with UUIDs as rows are read, generating
+        UUIDs for users not yet in the lookup. Each user's UUID is resolved once and added to ``users``.
+        '''
+        for row in rows:
+            user_id = row[0]
+            user_uuid = users.get(user_id)
+            if not user_uuid:
+                if user_id not in self.uuid_lookup:
+                    self.uuid_lookup[user_id] = str(uuid.uuid4())
+                user_uuid = users[user_id] = uuid.UUID(self.uuid_lookup[user_id]).hex
+            yield (user_uuid,) + row[1:]
 
     def generate_null_survey(self, input_dir):
         '''
-        Wrapper function to generate null survey responses for each user in coordinates.
+        Wrapper function to generate null survey responses for each user in coordinates. This is
+        not required before `load_export_coordinates`, which creates survey responses for new users.
 
         :param input_dir: Directory containing input .csv data
         '''
@@ -151,28 +202,63 @@ class QstarzCSVParser(object):
             input_dir, self.coordinates_csv, id_column='user', uuid_lookup=self.uuid_lookup, headers=self.headers
         )
 
-    def load_export_coordinates(self, input_dir):
+    def load_export_coordinates(self, input_dir, workers=1, changed_users=None):
         '''
-        Loads QStarz coordinates data to the cache database.
+        Loads QStarz coordinates data to the cache database in a single pass of the .csv file. UUIDs
+        are generated for users as they are found and null survey responses are created for users
+        without one.
 
-        :param input_dir: The directory containing the `self.coordinates_csv` data file.
+        :param input_dir:     The directory containing the `self.coordinates_csv` data file.
+        :param workers:       Number of processes to parse the .csv file with in parallel.
+        :param changed_users: Supply a set to only load coordinates newer than each user's latest cached
+                              coordinate, the UUIDs (hex) of users with new coordinates are added to the set.
+
+        :type workers:        int, optional
+        :type changed_users:  set, optional
         '''
         logger.info("Loading coordinates .csv to db...")
-        migrate(self._migrator.drop_index(Coordinate, 'coordinate_user_id'))
+        if self.uuid_lookup is None:
+            self.uuid_lookup = self._load_uuid_lookup()
+        if changed_users is None:
+            self.db.drop_indexes(Coordinate)
+        else:
+            # caches created before the unique (user, timestamp_epoch) index are deduplicated once
+            self.db.create_indexes(Coordinate)
         coordinates_fp = os.path.join(input_dir, self.coordinates_csv)
-        coordinates_rows = self._row_generator(coordinates_fp, self._coordinates_row_filter)
-        self.db.bulk_insert(Coordinate, coordinates_rows)
-        migrate(self._migrator.add_index('coordinates', ('user_id',), False))
+        context = {
+            'cells': {header: idx for idx, header in enumerate(self.headers)},
+            # text timestamps are not stored when coordinates are read by epoch timestamps
+            'text_timestamps': self.db.text_timestamps_required(),
+        }
+        coordinates_rows = parallel.row_generator(coordinates_fp, _coordinates_row_tuple, context, workers)
+        users = {}
+        coordinates_rows = self._user_rows(coordinates_rows, users)
+        if changed_users is None:
+            self.db.bulk_insert(Coordinate, coordinates_rows)
+        else:
+            # new rows repeating a (user, timestamp_epoch) key are skipped by the unique index
+            coordinates_rows = self.db.increment_rows(Coordinate, coordinates_rows, 'timestamp_epoch', changed_users)
+            self.db.bulk_insert(Coordinate, coordinates_rows, ignore_conflicts=True)
+        self.db.create_indexes(Coordinate)
+        self._save_uuid_lookup()
 
+        existing_user_ids = {r.orig_id for r in UserSurveyResponse.select(UserSurveyResponse.orig_id)}
+        new_users = {user_id: self.uuid_lookup[user_id] for user_id in users if user_id not in existing_user_ids}
+        self.new_user_ids = set(new_users)
+        if new_users:
+            _generate_null_survey(input_dir, self.coordinates_csv, uuid_lookup=new_users)
 
-    def load_user_locations(self, input_dir):
+    def load_user_locations(self, input_dir, user_ids=None):
         '''
         Loads QStarz user locations data to the cache database.
 
-        :param input_dir: The directory containing the `self.locations_csv` data file.        
+        :param input_dir: The directory containing the `self.locations_csv` data file.
+        :param user_ids:  Supply a set of QStarz user ids to only load these users' locations.
+
+        :type user_ids:   set, optional
         '''
         if not self.uuid_lookup:
             raise Exception('QStarz cannot load user locations before null survey has been initialized.')
         locations_fp = os.path.join(input_dir, self.locations_csv)
         if os.path.exists(locations_fp):
-            _load_user_locations(locations_fp, uuid_lookup=self.uuid_lookup)
+            _load_user_locations(locations_fp, uuid_lookup=self.uuid_lookup, user_ids=user_ids)
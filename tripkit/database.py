@@ -1,9 +1,12 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2018-2019
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import itertools
 import logging
+import numpy as np
 from peewee import (
+    FieldAccessor,
     Model,
     SqliteDatabase,
     BooleanField,
@@ -15,23 +18,46 @@ from peewee import (
     IntegerField,
     TextField,
     UUIDField,
+    fn,
 )
-import utm
 import uuid
 
 from .models.DaySummary import DaySummary
 from .models.ActivityLocation import ActivityLocation
 from .models.Trip import Trip
-from .models.TripPoint import TripPoint
+from .models.TripPoints import TripPoints
 from .models.User import User
 from .utils import geo
-from .utils.misc import UserNotFoundError, temp_path
+from .utils.arrays import COORDINATE_DTYPE, EPOCH
+from .utils.misc import UserNotFoundError, temp_path, uuid_hex
+
+# trip point columns in the order they are read from detected trip coordinate rows
+TRIP_POINT_ROW_COLUMNS = (
+    'database_id',
+    'latitude',
+    'longitude',
+    'h_accuracy',
+    'distance_before',
+    'trip_distance',
+    'period_before',
+    'timestamp_UTC',
+)
 
 logger = logging.getLogger('itinerum-tripkit.database')
 
 # globally create a single database connection for SQLite
 deferred_db = SqliteDatabase(None)
 
+# connection pragmas applied to the cache database unless overridden by `DATABASE_PRAGMAS` in config;
+# WAL journaling allows worker processes to read while the parent process writes results
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -256000,  # negative sizes are in KiB
+    'mmap_size': 1024 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
 
 class Database(object):
     '''
@@ -42,8 +68,18 @@ class Database(object):
         self.config = config
         database_fp = temp_path(f'{self.config.SURVEY_NAME}.sqlite')
 
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(getattr(self.config, 'DATABASE_PRAGMAS', None) or {})
         self.db = deferred_db
-        self.db.init(database_fp)
+        self.db.init(database_fp, pragmas=self.pragmas)
+
+        # order and filter coordinates by integer epoch instead of text timestamps when opted-in
+        self.epoch_timestamps = getattr(self.config, 'CACHE_EPOCH_TIMESTAMPS', False)
+        if self.epoch_timestamps and Coordinate.table_exists():
+            indexes = {tuple(index.columns) for index in self.db.get_indexes(Coordinate._meta.table_name)}
+            if ('user_id', 'timestamp_epoch') not in indexes:
+                logger.info("Creating the coordinates epoch timestamp index...")
+                self.create_indexes(Coordinate)
 
     def create(self):
         '''
@@ -62,6 +98,16 @@ class Database(object):
             ]
         )
 
+    def text_timestamps_required(self):
+        '''
+        Returns whether coordinates must be stored with text timestamps, which are omitted with epoch
+        timestamps unless the cache was created before the text timestamps column allowed nulls.
+        '''
+        if not self.epoch_timestamps:
+            return True
+        columns = {column.name: column for column in self.db.get_columns(Coordinate._meta.table_name)}
+        return not columns['timestamp_UTC'].null
+
     def drop(self):
         '''
         Drops all cache database tables.
@@ -78,22 +124,112 @@ class Database(object):
             ]
         )
 
+    @contextmanager
+    def bulk_load(self):
+        '''
+        Disables syncing writes to disk while loading the cache database. Since the cache can always
+        be rebuilt from the input data, a crash during setup only requires running setup again.
+        '''
+        synchronous = self.db.pragma('synchronous')
+        self.db.pragma('synchronous', 'off')
+        try:
+            yield
+        finally:
+            self.db.pragma('synchronous', synchronous)
+            if self.db.pragma('journal_mode') == 'wal':
+                self.db.pragma('wal_checkpoint(truncate)')
+
+    def drop_indexes(self, Model):
+        '''
+        Drops a table's indexes to speed up bulk inserts.
+        '''
+        Model._schema.drop_indexes()
+
+    def create_indexes(self, Model):
+        '''
+        Creates a table's indexes after bulk inserts if they do not exist. Before a unique index is
+        created, rows repeating its key are deleted, keeping the first row inserted.
+        '''
+        table_name = Model._meta.table_name
+        indexes = {tuple(index.columns): index for index in self.db.get_indexes(table_name)}
+        for fields, unique in Model._meta.indexes:
+            columns = tuple(Model._meta.fields[name].column_name for name in fields)
+            index = indexes.get(columns)
+            if not unique or (index and index.unique):
+                continue
+
+            # replace a non-unique index on the same columns, such as from an older cache
+            if index:
+                self.db.execute_sql(f'''DROP INDEX {index.name};''')
+            columns_str = ','.join(columns)
+            cursor = self.db.execute_sql(
+                f'''DELETE FROM {table_name} WHERE id NOT IN
+                    (SELECT MIN(id) FROM {table_name} GROUP BY {columns_str});'''
+            )
+            if cursor.rowcount:
+                logger.info(f"Deleted {cursor.rowcount} rows repeating a unique ({columns_str}) key in {table_name}.")
+        Model._schema.create_indexes()
+
     def delete_user_from_table(self, Model, user):
         '''
         Deletes a given user's records from a table in preparation for overwriting.
         '''
         Model.delete().where(Model.user == user.uuid).execute()
 
-    def bulk_insert(self, Model, rows, chunk_size=50000):
+    def increment_rows(self, Model, rows, field, changed_users):
         '''
-        Bulk insert an iterable of dictionaries into a supplied Peewee model by ``chunk_size``.
+        Filters rows for `bulk_insert` to those newer than each user's latest value of ``field`` already
+        in the cache database, so a new export can be loaded on top of a previous one.
+
+        :param Model:         Peewee database model of target table for inserts.
+        :param rows:          Iterable of row dictionaries or tuples as accepted by `bulk_insert`.
+        :param field:         The column name of the values to compare.
+        :param changed_users: Set to add the UUIDs (hex) of users with new rows to.
+
+        :type field:          str
+        :type changed_users:  set
+        '''
+        table_name = Model._meta.table_name
+        query = f'''SELECT user_id, MAX({field}) FROM {table_name} GROUP BY user_id;'''
+        latest = dict(self.db.execute_sql(query).fetchall())
+        columns = [c for c in Model._meta.columns.keys() if c != 'id']
+        field_idx = columns.index(field)
+        cast = float if isinstance(Model._meta.columns[field], (FloatField, IntegerField)) else str
+
+        for row in rows:
+            if not row:
+                continue
+
+            if isinstance(row, tuple):
+                user, value = row[0], row[field_idx]
+            else:
+                if 'user_id' not in row:
+                    row['user_id'] = uuid_hex(row.pop('user'))
+                user, value = row['user_id'], row[field]
+            # rows without a value cannot be ordered against the cache
+            if value is None or value == '':
+                continue
+            value = cast(value)
+            if user in latest and value <= latest[user]:
+                continue
+            changed_users.add(user)
+            yield row
 
-        :param Model:      Peewee database model of target table for inserts.
-        :param rows:       Iterable of dictionaries matching table model for bulk insert.
-        :param chunk_size: Number of rows to insert per transaction.
+    def bulk_insert(self, Model, rows, chunk_size=50000, ignore_conflicts=False):
+        '''
+        Bulk insert an iterable of dictionaries into a supplied Peewee model by ``chunk_size``.
 
-        :type chunk_size:  int, optional
-        :type rows:        list
+        :param Model:            Peewee database model of target table for inserts.
+        :param rows:             Iterable of dictionaries matching table model for bulk insert. Rows may also be
+                                 supplied as tuples of values ordered by the table's columns (excluding `id`) with
+                                 the user's UUID as hex, which are inserted without any per-row preparation.
+        :param chunk_size:       Number of rows to insert per transaction.
+        :param ignore_conflicts: Supply `True` to skip rows repeating the key of a unique index. The ids of
+                                 the inserted rows cannot be known and `None` is returned.
+
+        :type chunk_size:        int, optional
+        :type rows:              list
+        :type ignore_conflicts:  boolean, optional
         '''
         # Note: Peewee runs into "TOO MANY SQL VARIABLES" limits across systems with similar
         # versions of Python. The alternative below is to write the bulk insert operations using
@@ -105,52 +241,46 @@ class Database(object):
         if 'id' in columns:
             columns.remove('id')
 
-        chunk = []
-        columns_str = ','.join(columns)
-        values_str = ','.join(['?'] * len(columns))
-        query = f'''INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});'''
-        rows_inserted = 0
-        inserted_row_ids = []
-        cur.execute('''BEGIN TRANSACTION;''')
-        for row in rows:
-            if not row:
-                continue
+        def _row_values(row):
+            # rows already prepared as tuples are inserted as-is
+            if isinstance(row, tuple):
+                return row
 
             # transform uuids to the hex representation used by peewee
             if table_name == 'survey_responses':
-                row['uuid'] = uuid.UUID(hex=row['uuid']).hex
+                row['uuid'] = uuid_hex(row['uuid'])
                 row.setdefault('orig_id', None)
             elif 'uuid' in row:
-                row['user_id'] = uuid.UUID(hex=row['uuid']).hex
+                row['user_id'] = uuid_hex(row['uuid'])
             elif 'user_id' not in row:
-                row['user_id'] = uuid.UUID(hex=row['user']).hex
+                row['user_id'] = uuid_hex(row['user'])
             elif isinstance(row['user_id'], uuid.UUID):
                 row['user_id'] = row['user_id'].hex
-            chunk.append([row[c] for c in columns])
+            return [row[c] for c in columns]
 
-            # write rows to database as transactions of multiple executemany statements
+        columns_str = ','.join(columns)
+        values_str = ','.join(['?'] * len(columns))
+        insert_str = 'INSERT OR IGNORE' if ignore_conflicts else 'INSERT'
+        query = f'''{insert_str} INTO {table_name} ({columns_str}) VALUES ({values_str});'''
+        rows = map(_row_values, filter(None, rows))
+        rows_inserted = 0
+        inserted_row_ids = []
+        # write rows to database as transactions of executemany statements over slices of the rows
+        for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+            rows_inserted += len(chunk)
             if len(chunk) == chunk_size:
-                rows_inserted += chunk_size
                 logger.info(
                     f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: bulk inserting {chunk_size} rows ({rows_inserted})..."
                 )
-                cur.executemany(query, chunk)
-                cur.execute('''COMMIT;''')
-                start_row_id = cur.lastrowid - chunk_size + 1
-                row_ids = range(start_row_id, cur.lastrowid + 1)
-                inserted_row_ids.extend(row_ids)
-                cur.execute('''BEGIN TRANSACTION;''')
-                # reset chunk
-                chunk = []
-        # commit all remaining transactions
-        if chunk:
+            cur.execute('''BEGIN TRANSACTION;''')
             cur.executemany(query, chunk)
             cur.execute('''COMMIT;''')
-            start_row_id = cur.lastrowid - len(chunk) + 1
-            row_ids = range(start_row_id, cur.lastrowid + 1)
-            inserted_row_ids.extend(row_ids)
+            if not ignore_conflicts:
+                start_row_id = cur.lastrowid - len(chunk) + 1
+                inserted_row_ids.extend(range(start_row_id, cur.lastrowid + 1))
         conn.commit()
-        return inserted_row_ids
+        if not ignore_conflicts:
+            return inserted_row_ids
 
     def count_users(self):
         '''
@@ -168,6 +298,23 @@ class Database(object):
         if user:
             return user.uuid
 
+    @staticmethod
+    def _filter_period(query, field, start=None, end=None, exclusive=False):
+        '''
+        Filters a query to the records with a field value between the start and end bounds
+        so that the time window is applied by the database.
+        '''
+        if start:
+            query = query.where(field > start) if exclusive else query.where(field >= start)
+        if end:
+            query = query.where(field < end) if exclusive else query.where(field <= end)
+        return query
+
+    @staticmethod
+    def _epoch(timestamp):
+        if timestamp:
+            return (timestamp - EPOCH).total_seconds()
+
     def load_user(self, uuid, start=None, end=None):
         '''
         Loads user by ``uuid`` to an itinerum-tripkit :py:class:`User` object.
@@ -183,48 +330,65 @@ class Database(object):
             raise UserNotFoundError(uuid)
 
         user = User(db_user)
-        if start and end:
-            user.coordinates = user.coordinates.where(
-                Coordinate.timestamp_UTC >= start, Coordinate.timestamp_UTC <= end
-            )
-            user.prompt_responses = user.prompt_responses.where(
-                PromptResponse.displayed_at_UTC >= start, PromptResponse.displayed_at_UTC <= end
-            )
-            user.cancelled_prompt_responses = user.cancelled_prompt_responses.where(
-                CancelledPromptResponse.displayed_at_UTC >= start, CancelledPromptResponse.displayed_at_UTC <= end
-            )
-            user.detected_trip_coordinates = user.detected_trip_coordinates.where(
-                DetectedTripCoordinate.timestamp_UTC >= start, DetectedTripCoordinate.timestamp_UTC <= end
-            )
-            user.detected_trip_day_summaries = user.detected_trip_day_summaries.where(
-                DetectedTripDaySummary.date >= start.date, DetectedTripDaySummary.date <= end.date
-            )
-        elif start:
-            user.coordinates = user.coordinates.where(Coordinate.timestamp_UTC >= start)
-            user.prompt_responses = user.prompt_responses.where(PromptResponse.displayed_at_UTC >= start)
-            user.cancelled_prompt_responses = user.cancelled_prompt_responses.where(
-                CancelledPromptResponse.displayed_at_UTC >= start
-            )
-            user.detected_trip_coordinates = user.detected_trip_coordinates.where(
-                DetectedTripCoordinate.timestamp_UTC >= start
-            )
-            user.detected_trip_day_summaries = user.detected_trip_day_summaries.where(
-                DetectedTripDaySummary.date >= start.date
-            )
-        elif end:
-            user.coordinates = user.coordinates.where(Coordinate.timestamp_UTC <= end)
-            user.prompt_responses = user.prompt_responses.where(PromptResponse.displayed_at_UTC <= end)
-            user.cancelled_prompt_responses = user.cancelled_prompt_responses.where(
-                CancelledPromptResponse.displayed_at_UTC <= end
-            )
-            user.detected_trip_coordinates = user.detected_trip_coordinates.where(
-                DetectedTripCoordinate.timestamp_UTC <= end
-            )
-            user.detected_trip_day_summaries = user.detected_trip_day_summaries.where(
-                DetectedTripDaySummary.date <= end.date
+        if self.epoch_timestamps:
+            # select coordinates without the text timestamps, which are created from epoch when accessed
+            columns = [field for field in Coordinate._meta.sorted_fields if field is not Coordinate.timestamp_UTC]
+            coordinates = db_user.coordinates_backref.select(*columns).order_by(Coordinate.timestamp_epoch)
+            user.coordinates = self._filter_period(
+                coordinates, Coordinate.timestamp_epoch, self._epoch(start), self._epoch(end)
             )
+        else:
+            user.coordinates = self._filter_period(user.coordinates, Coordinate.timestamp_UTC, start, end)
+        user.prompt_responses = self._filter_period(user.prompt_responses, PromptResponse.displayed_at_UTC, start, end)
+        user.cancelled_prompt_responses = self._filter_period(
+            user.cancelled_prompt_responses, CancelledPromptResponse.displayed_at_UTC, start, end
+        )
+        user.detected_trip_coordinates = self._filter_period(
+            user.detected_trip_coordinates, DetectedTripCoordinate.timestamp_UTC, start, end
+        )
+        user.detected_trip_day_summaries = self._filter_period(
+            user.detected_trip_day_summaries,
+            DetectedTripDaySummary.date,
+            start.date() if start else None,
+            end.date() if end else None,
+        )
         return user
 
+    def load_user_arrays(self, user, start=None, end=None, chunk_size=100000):
+        '''
+        Loads a user's time-ordered coordinates as a structured NumPy array with the columns of
+        :py:data:`tripkit.utils.arrays.COORDINATE_DTYPE` (``id``, ``latitude``, ``longitude``,
+        ``altitude``, ``speed``, ``h_accuracy`` and ``timestamp_epoch``). Rows are read from a
+        raw database cursor without creating a record object for each coordinate.
+
+        :param user:       A database user response record.
+        :param start:      `Optional.` Naive datetime object (set within UTC) for
+                           selecting a user's coordinates start period.
+        :param end:        `Optional.` Naive datetime object (set within UTC) for
+                           selecting a user's coordinates end period.
+        :param chunk_size: Number of rows to fetch from the cursor at once.
+
+        :type chunk_size: int, optional
+
+        :rtype: numpy.ndarray
+        '''
+        columns = [getattr(Coordinate, name) for name in COORDINATE_DTYPE.names]
+        query = Coordinate.select(*columns).where(Coordinate.user == user.uuid)
+        if self.epoch_timestamps:
+            query = query.order_by(Coordinate.timestamp_epoch)
+            query = self._filter_period(query, Coordinate.timestamp_epoch, self._epoch(start), self._epoch(end))
+        else:
+            query = query.order_by(Coordinate.timestamp_UTC)
+            query = self._filter_period(query, Coordinate.timestamp_UTC, start, end)
+
+        cursor = self.db.execute(query)
+        chunks = [np.empty(0, dtype=COORDINATE_DTYPE)]
+        rows = cursor.fetchmany(chunk_size)
+        while rows:
+            chunks.append(np.array(rows, dtype=COORDINATE_DTYPE))
+            rows = cursor.fetchmany(chunk_size)
+        return np.concatenate(chunks)
+
     def clear_trips(self, user=None):
         '''
         Clears the detected trip points table or for an individual user.
@@ -236,35 +400,53 @@ class Database(object):
         else:
             DetectedTripCoordinate.delete().execute()
 
-    def load_trips(self, user, start=None, end=None):
+    def load_trips(self, user, start=None, end=None, last=None, before=None):
         '''
         Load the sorted trips for a given user as list.
 
-        :param user: A database user response record with a populated
-                     `detected_trip_coordinates` relation.
-        '''
-        trips = {}
-        for c in user.detected_trip_coordinates:
-            if start and c.timestamp_UTC <= start:
-                continue
-            if end and c.timestamp_UTC >= end:
-                continue
+        :param user:   A database user response record with a populated
+                       `detected_trip_coordinates` relation.
+        :param last:   Supply a number of trips to only load the user's latest trips.
+        :param before: Supply a trip number to only load the user's trips numbered before it.
 
-            point = TripPoint(
-                database_id=c.id,
-                latitude=c.latitude,
-                longitude=c.longitude,
-                h_accuracy=c.h_accuracy,
-                distance_before=c.distance_before,
-                trip_distance=c.trip_distance,
-                period_before=c.period_before,
-                timestamp_UTC=c.timestamp_UTC,
-            )
-
-            if c.trip_num not in trips:
-                trips[c.trip_num] = Trip(num=c.trip_num, trip_code=c.trip_code)
-            trips[c.trip_num].points.append(point)
-        return [value for _, value in sorted(trips.items())]
+        :type last:    int, optional
+        :type before:  int, optional
+        '''
+        detected_trip_coordinates = self._filter_period(
+            user.detected_trip_coordinates, DetectedTripCoordinate.timestamp_UTC, start, end, exclusive=True
+        )
+        if last:
+            latest_num = user.detected_trip_coordinates.select(fn.MAX(DetectedTripCoordinate.trip_num)).scalar()
+            if latest_num is not None:
+                detected_trip_coordinates = detected_trip_coordinates.where(
+                    DetectedTripCoordinate.trip_num > latest_num - last
+                )
+        if before is not None:
+            detected_trip_coordinates = detected_trip_coordinates.where(DetectedTripCoordinate.trip_num < before)
+        # read rows as tuples grouped by trip to build each trip's point columns at once
+        detected_trip_coordinates = detected_trip_coordinates.select(
+            DetectedTripCoordinate.trip_num,
+            DetectedTripCoordinate.trip_code,
+            DetectedTripCoordinate.id,
+            DetectedTripCoordinate.latitude,
+            DetectedTripCoordinate.longitude,
+            DetectedTripCoordinate.h_accuracy,
+            DetectedTripCoordinate.distance_before,
+            DetectedTripCoordinate.trip_distance,
+            DetectedTripCoordinate.period_before,
+            DetectedTripCoordinate.timestamp_UTC,
+        )
+        trip_rows = {}
+        for trip_num, trip_code, *values in detected_trip_coordinates.tuples():
+            if trip_num not in trip_rows:
+                trip_rows[trip_num] = (trip_code, [])
+            trip_rows[trip_num][1].append(values)
+
+        trips = []
+        for trip_num, (trip_code, rows) in sorted(trip_rows.items()):
+            columns = dict(zip(TRIP_POINT_ROW_COLUMNS, zip(*rows)))
+            trips.append(Trip(num=trip_num, trip_code=trip_code, points=TripPoints(**columns)))
+        return trips
 
     def load_trip_day_summaries(self, user):
         '''
@@ -288,11 +470,19 @@ class Database(object):
             )
         return day_summaries
 
-    def load_subway_entrances(self):
+    def load_subway_entrances(self, spatial_index=False):
         '''
         Queries cache database for all available subway entrances.
+
+        :param spatial_index: Supply `True` to return the entrances within a spatial index for
+                              fast buffer lookups during trip detection.
+
+        :type spatial_index: boolean, optional
         '''
-        return SubwayStationEntrance.select()
+        entrances = SubwayStationEntrance.select()
+        if spatial_index:
+            return geo.PointIndex(entrances)
+        return entrances
 
     def load_activity_locations(self, user):
         '''
@@ -300,9 +490,14 @@ class Database(object):
 
         :param user: A database user response record
         '''
+        user_locations = list(user.user_locations)
+        eastings, northings = geo.projection.project(
+            [loc.latitude for loc in user_locations], [loc.longitude for loc in user_locations]
+        )
+        zone_num, zone_letter = geo.projection.zone_num, geo.projection.zone_letter
+
         locations = []
-        for loc in user.user_locations:
-            easting, northing, zone_num, zone_letter = utm.from_latlon(loc.latitude, loc.longitude)
+        for loc, easting, northing in zip(user_locations, eastings.tolist(), northings.tolist()):
             locations.append(
                 ActivityLocation(
                     label=loc.label,
@@ -317,50 +512,104 @@ class Database(object):
         return locations
 
 
-    def save_trips(self, user, trips, overwrite=True):
+    def _trip_rows(self, user, trips):
+        for trip in trips:
+            columns = trip.points.columns
+            values = zip(*[columns[name].tolist() for name in TRIP_POINT_ROW_COLUMNS[1:]])
+            for latitude, longitude, h_accuracy, distance_before, trip_distance, period_before, timestamp in values:
+                yield {
+                    'user_id': user.uuid,
+                    'trip_num': trip.num,
+                    'trip_code': trip.trip_code,
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'h_accuracy': h_accuracy,
+                    'distance_before': distance_before,
+                    'trip_distance': trip_distance,
+                    'period_before': period_before,
+                    'timestamp_UTC': timestamp,
+                }
+
+    def _delete_trips(self, user, overwrite, from_trip_num):
+        if from_trip_num is not None:
+            logger.info(f"replacing user trips from trip {from_trip_num}...")
+            DetectedTripCoordinate.delete().where(
+                (DetectedTripCoordinate.user == user.uuid) & (DetectedTripCoordinate.trip_num >= from_trip_num)
+            ).execute()
+        elif overwrite:
+            logger.info("overwriting user trips information...")
+            self.delete_user_from_table(DetectedTripCoordinate, user)
+
+    def _insert_trips(self, user, trips, chunk_size=50000):
+        db_row_ids = self.bulk_insert(DetectedTripCoordinate, self._trip_rows(user, trips), chunk_size=chunk_size)
+
+        # attach data to original trips' points with database id
+        idx = 0
+        for trip in trips:
+            num_points = len(trip.points)
+            trip.points.columns['database_id'][:] = db_row_ids[idx : idx + num_points]
+            idx += num_points
+
+    def save_trips(self, user, trips, overwrite=True, from_trip_num=None):
         '''
         Saves detected trips from processing algorithms to cache database. This
         table will be recreated on each save by default.
 
-        :param user:  A database user response record associated with the trip records.
-        :param trips: Iterable of detected trips from a trip processing algorithm.
+        :param user:          A database user response record associated with the trip records.
+        :param trips:         Iterable of detected trips from a trip processing algorithm.
+        :param from_trip_num: Supply a trip number to only replace the user's trips numbered from it,
+                              keeping their earlier trips.
 
         :type user: :py:class:`tripkit.models.User`
         :type trips: list of :py:class:`tripkit.models.Trip`
+        :type from_trip_num: int, optional
         '''
+        self._delete_trips(user, overwrite, from_trip_num)
+        saved_trips = trips
+        if from_trip_num is not None:
+            saved_trips = [t for t in trips if t.num >= from_trip_num]
+        self._insert_trips(user, saved_trips)
+        user.trips = trips
 
-        def _trip_row_filter(trip_rows, model_fields):
-            row = {}
-            for trip in trip_rows:
-                for point in trip.points:
-                    row = {
-                        'user_id': user.uuid,
-                        'trip_num': trip.num,
-                        'trip_code': trip.trip_code,
-                        'latitude': point.latitude,
-                        'longitude': point.longitude,
-                        'h_accuracy': point.h_accuracy,
-                        'distance_before': point.distance_before,
-                        'trip_distance': point.trip_distance,
-                        'period_before': point.period_before,
-                        'timestamp_UTC': point.timestamp_UTC,
-                    }
-                    yield row
-
-        if overwrite:
-            logger.info("overwriting user trips information...")
-            self.delete_user_from_table(DetectedTripCoordinate, user)
+    def save_trips_stream(self, user, trips, overwrite=True, from_trip_num=None, chunk_size=50000):
+        '''
+        Saves detected trips to the cache database as they are generated, such as by a trip detection
+        algorithm run with ``stream=True``. Trips are inserted once they total ``chunk_size`` points and
+        are yielded with their points' database ids as they are saved, so only a chunk of a user's saved
+        trips and their insert rows are held in memory. Trips are only saved as the returned generator is
+        consumed and, unlike :py:meth:`save_trips`, they are not kept on the ``user`` object.
+
+        :param user:          A database user response record associated with the trip records.
+        :param trips:         Iterable of detected trips from a trip processing algorithm.
+        :param from_trip_num: Supply a trip number to only replace the user's trips numbered from it,
+                              keeping their earlier trips.
+        :param chunk_size:    Minimum number of trip points to insert at once.
 
-        model_fields = set(DetectedTripCoordinate._meta.sorted_field_names)
-        db_row_ids = self.bulk_insert(DetectedTripCoordinate, _trip_row_filter(trips, model_fields))
+        :type user: :py:class:`tripkit.models.User`
+        :type trips: iterable of :py:class:`tripkit.models.Trip`
+        :type from_trip_num: int, optional
+        :type chunk_size: int, optional
 
-        # attach data to original user's object with database id
-        idx = 0
+        :returns: The trips after they have been saved.
+        :rtype: generator of :py:class:`tripkit.models.Trip`
+        '''
+        self._delete_trips(user, overwrite, from_trip_num)
+        chunk, num_points = [], 0
         for trip in trips:
-            for point in trip.points:
-                point.database_id = db_row_ids[idx]
-                idx += 1
-        user.trips = trips
+            # kept trips are passed through unchanged
+            if from_trip_num is not None and trip.num < from_trip_num:
+                yield trip
+                continue
+
+            chunk.append(trip)
+            num_points += len(trip.points)
+            if num_points >= chunk_size:
+                self._insert_trips(user, chunk, chunk_size=num_points)
+                yield from chunk
+                chunk, num_points = [], 0
+        if chunk:
+            self._insert_trips(user, chunk, chunk_size=num_points)
+            yield from chunk
 
     def save_trip_day_summaries(self, user, trip_day_summaries, timezone, overwrite=True):
         '''
@@ -382,7 +631,7 @@ class Database(object):
 
         def _row_filter(rows, model_fields):
             for row in rows:
-                dict_row = row.__dict__
+                dict_row = {name: getattr(row, name) for name in row.__slots__}
                 dict_row['user_id'] = user.uuid
                 dict_row['timezone'] = timezone
                 dict_row['start_point_id'] = row.start_point.database_id if row.start_point else None
@@ -455,11 +704,31 @@ class UserSurveyResponse(BaseModel):
         return self.user_locations_backref
 
 
+class EpochDateTimeAccessor(FieldAccessor):
+    '''
+    Creates a coordinate's datetime from its integer epoch timestamp when the text
+    timestamp column has not been selected from the database or was not stored.
+    '''
+
+    def __get__(self, instance, instance_type=None):
+        if instance is not None:
+            timestamp_epoch = instance.__data__.get('timestamp_epoch')
+            if instance.__data__.get(self.name) is None and timestamp_epoch is not None:
+                instance.__data__[self.name] = EPOCH + timedelta(seconds=timestamp_epoch)
+            return instance.__data__.get(self.name)
+        return self.field
+
+
+class EpochDateTimeField(DateTimeField):
+    accessor_class = EpochDateTimeAccessor
+
+
 class Coordinate(BaseModel):
     class Meta:
         table_name = 'coordinates'
+        indexes = ((('user', 'timestamp_UTC'), False), (('user', 'timestamp_epoch'), True))
 
-    user = ForeignKeyField(UserSurveyResponse, backref='coordinates_backref')
+    user = ForeignKeyField(UserSurveyResponse, backref='coordinates_backref', index=False)
     latitude = FloatField()
     longitude = FloatField()
     altitude = FloatField(null=True)
@@ -472,15 +741,16 @@ class Coordinate(BaseModel):
     acceleration_z = FloatField(null=True)
     point_type = TextField(null=True)
     mode_detected = TextField(null=True)
-    timestamp_UTC = DateTimeField()
+    timestamp_UTC = EpochDateTimeField(null=True)
     timestamp_epoch = IntegerField()
 
 
 class PromptResponse(BaseModel):
     class Meta:
         table_name = 'prompt_responses'
+        indexes = ((('user', 'displayed_at_UTC'), False),)
 
-    user = ForeignKeyField(UserSurveyResponse, backref='prompts_backref')
+    user = ForeignKeyField(UserSurveyResponse, backref='prompts_backref', index=False)
     prompt_uuid = UUIDField()
     prompt_num = IntegerField()
     response = TextField()
@@ -494,8 +764,9 @@ class PromptResponse(BaseModel):
 class CancelledPromptResponse(BaseModel):
     class Meta:
         table_name = 'cancelled_prompt_responses'
+        indexes = ((('user', 'displayed_at_UTC'), False),)
 
-    user = ForeignKeyField(UserSurveyResponse, backref='cancelled_prompts_backref')
+    user = ForeignKeyField(UserSurveyResponse, backref='cancelled_prompts_backref', index=False)
     prompt_uuid = UUIDField(unique=True)
     latitude = FloatField()
     longitude = FloatField()
@@ -507,8 +778,9 @@ class CancelledPromptResponse(BaseModel):
 class DetectedTripCoordinate(BaseModel):
     class Meta:
         table_name = 'detected_trip_coordinates'
+        indexes = ((('user', 'timestamp_UTC'), False),)
 
-    user = ForeignKeyField(UserSurveyResponse, backref='detected_trip_coordinates_backref')
+    user = ForeignKeyField(UserSurveyResponse, backref='detected_trip_coordinates_backref', index=False)
     trip_num = IntegerField()
     trip_code = IntegerField()
     latitude = FloatField()
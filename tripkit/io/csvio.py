@@ -71,23 +71,25 @@ class CSVIO(object):
             if not row_idx:
                 row_idx = 1
             for t in trips:
-                for p in t.points:
+                columns = {name: column.tolist() for name, column in t.points.columns.items()}
+                for idx in range(len(t.points)):
                     record = {
                         'id': row_idx,
                         'uuid': None,
                         'trip': t.num,
-                        'latitude': p.latitude,
-                        'longitude': p.longitude,
-                        'h_accuracy': p.h_accuracy,
+                        'latitude': columns['latitude'][idx],
+                        'longitude': columns['longitude'][idx],
+                        'h_accuracy': columns['h_accuracy'][idx],
                         # 'v_accuracy': p.v_accuracy,
-                        'timestamp_UTC': p.timestamp_UTC,
-                        'timestamp_epoch': p.timestamp_epoch,
-                        'trip_distance': p.trip_distance,
-                        'distance': p.distance_before,
-                        'break_period': p.period_before,
+                        'timestamp_UTC': columns['timestamp_UTC'][idx],
+                        'timestamp_epoch': columns['timestamp_epoch'][idx],
+                        'trip_distance': columns['trip_distance'][idx],
+                        'distance': columns['distance_before'][idx],
+                        'break_period': columns['period_before'][idx],
                         'trip_code': t.trip_code,
                     }
                     if extra_fields:
+                        p = t.points[idx]
                         for field in extra_fields:
                             record[field] = getattr(p, field)
                     writer.writerow(record)
@@ -309,11 +311,7 @@ class CSVIO(object):
         :type daily_summaries: list of dict
         :type append:          boolean, optional
         '''
-        def _label_point_location(locations, point, proximity_m):
-            for location in locations:
-                if utils.geo.haversine_distance_m(point, location) <= proximity_m:
-                    return location.label
-
+        index = utils.geo.ActivityLocationIndex(user.activity_locations)
         date_summaries = {cds.date: cds for cds in complete_day_summaries}
         summary_columns = [
             'uuid',
@@ -336,18 +334,22 @@ class CSVIO(object):
         ]
         headers = [['Trip Summaries'], summary_columns]
         Point = namedtuple('Point', ['latitude', 'longitude'])
+        trip_summaries = list(trip_summaries)
+        proximity_m = self.config.ACTIVITY_LOCATION_PROXIMITY_METERS
+        origins = [Point(latitude=ts['olat'], longitude=ts['olon']) for ts in trip_summaries]
+        destinations = [Point(latitude=ts['dlat'], longitude=ts['dlon']) for ts in trip_summaries]
+        olocations = index.labels(origins, proximity_m)
+        dlocations = index.labels(destinations, proximity_m)
         rows = []
-        for trip_summary in trip_summaries:
+        for trip_summary, olocation, dlocation in zip(trip_summaries, olocations, dlocations):
             trip_date_local = trip_summary['start'].date()
             trip_summary['trip_type'] = 'complete' if trip_summary['trip_code'] < 100 else 'missing'
             if trip_date_local in date_summaries:
                 trip_summary['complete_day'] = date_summaries[trip_date_local].is_complete
             else:
                 trip_summary['complete_day'] = False
-            orig = Point(latitude=trip_summary['olat'], longitude=trip_summary['olon'])
-            dest = Point(latitude=trip_summary['dlat'], longitude=trip_summary['dlon'])
-            trip_summary['olocation'] = _label_point_location(user.activity_locations, orig, self.config.ACTIVITY_LOCATION_PROXIMITY_METERS)
-            trip_summary['dlocation'] = _label_point_location(user.activity_locations, dest, self.config.ACTIVITY_LOCATION_PROXIMITY_METERS)
+            trip_summary['olocation'] = olocation
+            trip_summary['dlocation'] = dlocation
             rows.append(trip_summary)
 
         csv_fp = os.path.join(self.config.OUTPUT_DATA_DIR, f'{self.config.SURVEY_NAME}-trip_summaries_condensed.csv')
@@ -5,13 +5,18 @@
 from datetime import datetime
 import logging
 import time
+import uuid
 
 from .io import IO
 from . import models
+from . import pipeline
 from . import process
+from . import sweep
 from .csvparser import ItinerumCSVParser, QstarzCSVParser
 from .database import Database, UserSurveyResponse
 from .database import Coordinate, PromptResponse, CancelledPromptResponse, DetectedTripCoordinate, SubwayStationEntrance
+from .utils import geo
+from .utils.cache import StageCache
 
 
 logger = logging.getLogger('itinerum-tripkit.main')
@@ -45,12 +50,18 @@ class TripKit(object):
         self.config = config
 
         self._database = Database(self.config)
+        # fix the UTM zone used for projecting all of the survey's points
+        geo.projection.reset(
+            zone_num=getattr(self.config, 'UTM_ZONE_NUMBER', None),
+            zone_letter=getattr(self.config, 'UTM_ZONE_LETTER', None),
+        )
         self._csv = self._init_csv_parser()
 
         # attach I/O functions and extensions as objects
         self._io = IO(self.config)
         self._process = process
         self._process.map_match.osrm(self.config)
+        self._cache = StageCache(max_size_mb=getattr(self.config, 'STAGE_CACHE_MAX_MB', 1024))
 
     def _init_csv_parser(self):
         if self.config.INPUT_DATA_TYPE == 'itinerum':
@@ -61,6 +72,13 @@ class TripKit(object):
             f"Input data type not recognized: {self.config.INPUT_DATA_TYPE} Valid options: itinerum, qstarz"
         )
 
+    @property
+    def cache(self):
+        '''
+        Provides access to the on-disk cache of processing stage results.
+        '''
+        return self._cache
+
     @property
     def csv(self):
         '''
@@ -89,37 +107,61 @@ class TripKit(object):
         '''
         return self._process
 
-    def setup(self, force=False, generate_null_survey=False):
+    def _load_input_data(self, generate_null_survey, workers, changed_users=None):
+        input_dir = self.config.INPUT_DATA_DIR
+        if self.config.INPUT_DATA_TYPE == 'itinerum':
+            if generate_null_survey is False:
+                self.csv.load_export_survey_responses(input_dir, changed_users=changed_users)
+            else:
+                self.csv.generate_null_survey(input_dir)
+            self.csv.load_export_coordinates(input_dir, workers=workers, changed_users=changed_users)
+            self.csv.load_export_prompt_responses(input_dir, changed_users=changed_users)
+            self.csv.load_export_cancelled_prompt_responses(input_dir, changed_users=changed_users)
+        elif self.config.INPUT_DATA_TYPE == 'qstarz':
+            self.csv.load_export_coordinates(input_dir, workers=workers, changed_users=changed_users)
+            if changed_users is None:
+                self.csv.load_user_locations(input_dir)
+            elif self.csv.new_user_ids:
+                # locations are only created for new users since existing users' locations are already cached
+                self.csv.load_user_locations(input_dir, user_ids=self.csv.new_user_ids)
+
+    def setup(self, force=False, generate_null_survey=False, workers=1, incremental=False):
         '''
         Create the cache database tables if the ``UserSurveyResponse`` table does not exist.
 
         :param force:                Supply `True` to force creation of a new cache database
         :param generate_null_survey: Supply `True` to generate an empty survey responses table
                                      for coordinates-only data
+        :param workers:              Number of processes to parse the coordinates .csv with in parallel
+        :param incremental:          Supply `True` to load only data newer than each user's cached data from
+                                     the input export to an existing cache database
 
         :type force:                 boolean, optional
         :type generate_null_survey:  boolean, optional
+        :type workers:               int, optional
+        :type incremental:           boolean, optional
+
+        :rtype: list of the UUIDs of new users or users with new data when ``incremental`` is `True`
         '''
         if force:
             self.database.drop()
+            geo.projection.clear()
+            self.cache.clear()
 
         if not UserSurveyResponse.table_exists():
             self.database.create()
-            if getattr(self.config, 'SUBWAY_STATIONS_FP', None):
-                self.csv.load_subway_stations(self.config.SUBWAY_STATIONS_FP)
-
-            if self.config.INPUT_DATA_TYPE == 'itinerum':
-                if generate_null_survey is False:
-                    self.csv.load_export_survey_responses(self.config.INPUT_DATA_DIR)
-                else:
-                    self.csv.generate_null_survey(self.config.INPUT_DATA_DIR)
-                self.csv.load_export_coordinates(self.config.INPUT_DATA_DIR)
-                self.csv.load_export_prompt_responses(self.config.INPUT_DATA_DIR)
-                self.csv.load_export_cancelled_prompt_responses(self.config.INPUT_DATA_DIR)
-            elif self.config.INPUT_DATA_TYPE == 'qstarz':
-                self.csv.generate_null_survey(self.config.INPUT_DATA_DIR)
-                self.csv.load_export_coordinates(self.config.INPUT_DATA_DIR)
-                self.csv.load_user_locations(self.config.INPUT_DATA_DIR)
+            with self.database.bulk_load():
+                if getattr(self.config, 'SUBWAY_STATIONS_FP', None):
+                    self.csv.load_subway_stations(self.config.SUBWAY_STATIONS_FP)
+                self._load_input_data(generate_null_survey, workers)
+            if incremental:
+                return [str(u.uuid) for u in UserSurveyResponse.select(UserSurveyResponse.uuid)]
+        elif incremental:
+            changed_users = set()
+            with self.database.bulk_load():
+                self._load_input_data(generate_null_survey, workers, changed_users=changed_users)
+            logger.info(f"Loaded new data for {len(changed_users)} users.")
+            return sorted(str(uuid.UUID(hex=u)) for u in changed_users)
 
     def check_setup(self):
         '''
@@ -182,6 +224,114 @@ class TripKit(object):
             users.append(user)
         return users
 
+    def run_pipeline(
+        self,
+        users=None,
+        workers=None,
+        algorithm='triplab-v2',
+        engine='python',
+        complete_days=True,
+        activities=True,
+        start=None,
+        end=None,
+        incremental=False,
+        keep_results=False,
+    ):
+        '''
+        Runs trip detection, complete days counting and activity tallying for users across a pool
+        of worker processes. Each worker reads users from its own cache database connection while
+        this process saves the detected trips and complete day summaries as the only writer.
+
+        :param users:         Users to process as UUIDs or :py:class:`tripkit.models.User` objects;
+                              defaults to all users
+        :param workers:       Number of worker processes; defaults to the number of CPUs
+        :param algorithm:     Trip detection algorithm: ``triplab-v2``, ``triplab-v3`` or ``canue``, which
+                              cleans coordinates with the CANUE preprocessing and splits trips at each
+                              user's cached activity locations
+        :param engine:        Trip detection engine: ``python`` or ``numpy``
+        :param complete_days: Supply False to skip complete days counting
+        :param activities:    Supply False to skip activity location tallying
+        :param start:         Mininum timestamp bounds (inclusive) for loading user coordinates
+        :param end:           Maximum timestamp bounds (inclusive) for loading user coordinates
+        :param incremental:   Supply True to only detect trips from the last stable boundary of each
+                              user's cached trips and replace the cached trips from that boundary.
+                              Only trip detection is partial: the returned trips, complete days and
+                              activity cover each user's whole history, with the trips before the
+                              boundary loaded from the cache
+        :param keep_results:  Supply True to return each user's full results. By default, only counts
+                              are returned so memory does not grow with the number of users processed
+
+        :type users:          list, optional
+        :type workers:        integer, optional
+        :type algorithm:      string, optional
+        :type engine:         string, optional
+        :type complete_days:  boolean, optional
+        :type activities:     boolean, optional
+        :type start:          datetime, optional
+        :type end:            datetime, optional
+        :type incremental:    boolean, optional
+        :type keep_results:   boolean, optional
+
+        :returns: The ``num_trips``, ``from_trip_num`` and ``num_complete_days`` for each processed user
+                  by UUID, or their detected ``trips``, ``complete_days`` summaries and ``activity`` with
+                  ``keep_results``
+        :rtype: dict
+        '''
+        self.check_setup()
+
+        if users is None:
+            uuids = [u.uuid for u in UserSurveyResponse.select(UserSurveyResponse.uuid)]
+        else:
+            uuids = [u.uuid if isinstance(u, models.User) else u for u in users]
+        return pipeline.run(
+            self,
+            uuids,
+            workers=workers,
+            algorithm=algorithm,
+            engine=engine,
+            complete_days=complete_days,
+            activities=activities,
+            start=start,
+            end=end,
+            incremental=incremental,
+            keep_results=keep_results,
+        )
+
+    def run_sweep(self, grid, users=None, workers=None, start=None, end=None):
+        '''
+        Runs triplab v3 trip detection for every combination of a grid of trip detection settings across
+        a pool of worker processes. Each user's coordinates are loaded, projected and cleaned once for
+        all parameter sets with the same accuracy cutoff and no results are saved to the cache database.
+
+        :param grid:    Lists of values to test for the ``TRIP_DETECTION_BREAK_INTERVAL_SECONDS``,
+                        ``TRIP_DETECTION_SUBWAY_BUFFER_METERS``, ``TRIP_DETECTION_COLD_START_DISTANCE_METERS``
+                        and ``TRIP_DETECTION_ACCURACY_CUTOFF_METERS`` config settings; settings not
+                        included are held at their config values
+        :param users:   Users to process as UUIDs or :py:class:`tripkit.models.User` objects;
+                        defaults to all users
+        :param workers: Number of worker processes; defaults to the number of CPUs
+        :param start:   Mininum timestamp bounds (inclusive) for loading user coordinates
+        :param end:     Maximum timestamp bounds (inclusive) for loading user coordinates
+
+        :type grid:     dict
+        :type users:    list, optional
+        :type workers:  integer, optional
+        :type start:    datetime, optional
+        :type end:      datetime, optional
+
+        :returns: A row for each parameter set with its settings and the total number of ``users``,
+                  detected ``trips``, ``missing_trips``, ``days``, ``complete_days`` and the
+                  ``complete_day_ratio``
+        :rtype: list of dict
+        '''
+        self.check_setup()
+
+        if users is None:
+            uuids = [u.uuid for u in UserSurveyResponse.select(UserSurveyResponse.uuid)]
+        else:
+            uuids = [u.uuid if isinstance(u, models.User) else u for u in users]
+        return sweep.run(self, uuids, grid, workers=workers, start=start, end=end)
+
     def load_user_by_orig_id(self, orig_id, load_trips=True, start=None, end=None):
         '''
         Returns all available users as :py:class:`tripkit.models.User` objects from the database
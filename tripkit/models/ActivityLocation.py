@@ -23,6 +23,8 @@ class ActivityLocation(object):
     :type zone_letter: str, optional
     '''
 
+    __slots__ = ('label', 'latitude', 'longitude', 'easting', 'northing', 'zone_num', 'zone_letter')
+
     def __init__(self, label, latitude, longitude, easting=None, northing=None, zone_num=None, zone_letter=None):
         self.label = label
         self.latitude = latitude
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2018
+from .TripPoints import TripPoints
 
 
 class Trip(object):
@@ -8,15 +9,37 @@ class Trip(object):
                           trip events (completer or incomplete) as user has made
                           over the duration of their survey participation.
     :param int trip_code: The integer code representing the detected trip type.
+    :param points:        (Optional) The trip's points as columns or a list of points.
 
-    :ivar points:         The timestamp-ordered points that comprise this ``Trip``.
-    :vartype points:      list of :py:class:`tripkit.models.TripPoint`
+    :ivar points:         The timestamp-ordered points that comprise this ``Trip``. Lists of
+                          points assigned to a trip are stored as columns.
+    :vartype points:      :py:class:`tripkit.models.TripPoints`
+    :ivar start_local:    The trip's start time localized to the survey's timezone, `None` until set
+                          by complete days detection.
+    :vartype start_local: datetime
+    :ivar end_local:      The trip's end time localized to the survey's timezone, `None` until set
+                          by complete days detection.
+    :vartype end_local:   datetime
     '''
 
-    def __init__(self, num, trip_code):
+    __slots__ = ('num', 'trip_code', '_points', 'start_local', 'end_local')
+
+    def __init__(self, num, trip_code, points=None):
         self.num = int(num)
         self.trip_code = int(trip_code)
-        self.points = []
+        self.points = points if points is not None else TripPoints()
+        self.start_local = None
+        self.end_local = None
+
+    @property
+    def points(self):
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        if not isinstance(points, TripPoints):
+            points = TripPoints.from_points(points)
+        self._points = points
 
     @property
     def distance(self):
@@ -50,7 +73,8 @@ class Trip(object):
 
     @property
     def geojson_coordinates(self):
-        return [(p.longitude, p.latitude) for p in self.points]
+        columns = self.points.columns
+        return list(zip(columns['longitude'].tolist(), columns['latitude'].tolist()))
 
     def __repr__(self):
         return f"<tripkit.models.Trip num={self.num} code={self.trip_code}>"
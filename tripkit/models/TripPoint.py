@@ -2,6 +2,9 @@
 # Kyle Fitzsimmons, 2018
 from datetime import datetime
 
+# database id column value of points not saved to the cache database
+NO_DATABASE_ID = -1
+
 
 class TripPoint(object):
     '''
@@ -13,13 +16,40 @@ class TripPoint(object):
     :param float trip_distance:    The cumulative distance of the current trip so far in meters.
     :param integer period_before:  The number of seconds passed since the last recorded point.
     :param datetime timestamp_UTC: The point's naive datetime localized to UTC.
+    :param int timestamp_epoch:    (Optional) The point's stored UNIX epoch timestamp, otherwise
+                                   calculated from the datetime.
 
     :ivar timestamp_epoch:         The point's datetime within the UNIX epoch format.
     :vartype timestamp_epoch:      int
+    :ivar label:                   The activity location label of the point, `None` until labeled by
+                                   activity detection.
+    :vartype label:                str
     '''
 
+    __slots__ = (
+        'database_id',
+        'latitude',
+        'longitude',
+        'h_accuracy',
+        'distance_before',
+        'trip_distance',
+        'period_before',
+        'timestamp_UTC',
+        'timestamp_epoch',
+        'label',
+    )
+
     def __init__(
-        self, database_id, latitude, longitude, h_accuracy, distance_before, trip_distance, period_before, timestamp_UTC
+        self,
+        database_id,
+        latitude,
+        longitude,
+        h_accuracy,
+        distance_before,
+        trip_distance,
+        period_before,
+        timestamp_UTC,
+        timestamp_epoch=None,
     ):
         assert isinstance(timestamp_UTC, datetime)
 
@@ -31,7 +61,76 @@ class TripPoint(object):
         self.trip_distance = float(trip_distance)
         self.period_before = int(period_before)
         self.timestamp_UTC = timestamp_UTC
-        self.timestamp_epoch = (timestamp_UTC - datetime(1970, 1, 1)).total_seconds()
+        if timestamp_epoch is None:
+            self.timestamp_epoch = (timestamp_UTC - datetime(1970, 1, 1)).total_seconds()
+        else:
+            self.timestamp_epoch = float(timestamp_epoch)
+        self.label = None
 
     def __repr__(self):
         return f"<tripkit.models.TripPoint ({self.latitude}, {self.longitude}) {self.timestamp_UTC}>"
+
+
+def _column_property(name, cast):
+    def getter(self):
+        return cast(self._points.columns[name][self._idx])
+
+    def setter(self, value):
+        self._points.columns[name][self._idx] = value
+
+    return property(getter, setter)
+
+
+class TripPointView(TripPoint):
+    '''
+    A :py:class:`tripkit.models.TripPoint` read from the columns of a trip's points, created only when the points
+    are indexed or iterated. Attributes set on the view are written back to the columns.
+
+    :param points: The trip's points.
+    :param idx:    The index of the point within the trip.
+
+    :type points: :py:class:`tripkit.models.TripPoints`
+    :type idx:    int
+    '''
+
+    __slots__ = ('_points', '_idx')
+
+    def __init__(self, points, idx):
+        self._points = points
+        self._idx = idx
+
+    latitude = _column_property('latitude', float)
+    longitude = _column_property('longitude', float)
+    h_accuracy = _column_property('h_accuracy', float)
+    distance_before = _column_property('distance_before', float)
+    trip_distance = _column_property('trip_distance', float)
+    period_before = _column_property('period_before', int)
+    timestamp_epoch = _column_property('timestamp_epoch', float)
+
+    @property
+    def database_id(self):
+        database_id = int(self._points.columns['database_id'][self._idx])
+        return database_id if database_id != NO_DATABASE_ID else None
+
+    @database_id.setter
+    def database_id(self, value):
+        self._points.columns['database_id'][self._idx] = value if value is not None else NO_DATABASE_ID
+
+    @property
+    def timestamp_UTC(self):
+        return self._points.columns['timestamp_UTC'][self._idx].item()
+
+    @timestamp_UTC.setter
+    def timestamp_UTC(self, value):
+        self._points.columns['timestamp_UTC'][self._idx] = value
+
+    @property
+    def label(self):
+        labels = self._points.labels
+        return labels[self._idx] if labels is not None else None
+
+    @label.setter
+    def label(self, value):
+        if self._points.labels is None:
+            self._points.labels = [None] * len(self._points)
+        self._points.labels[self._idx] = value
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+import numpy as np
+
+from .TripPoint import NO_DATABASE_ID, TripPointView
+
+
+EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+
+# columns of a trip's points by :py:class:`tripkit.models.TripPoint` attribute name
+TRIP_POINT_COLUMNS = {
+    'database_id': np.int64,
+    'latitude': np.float64,
+    'longitude': np.float64,
+    'h_accuracy': np.float64,
+    'distance_before': np.float64,
+    'trip_distance': np.float64,
+    'period_before': np.int64,
+    'timestamp_UTC': 'datetime64[us]',
+    'timestamp_epoch': np.float64,
+}
+
+
+class TripPoints(object):
+    '''
+    The timestamp-ordered points of a :py:class:`tripkit.models.Trip` stored as NumPy columns. Points are only
+    created as :py:class:`tripkit.models.TripPoint` views when indexed or iterated, so existing code can use
+    the points as a list while each point is stored in a few dozen bytes. Points appended as objects are
+    added to the columns on the next access.
+
+    :param database_id:     The GPS points' original database coordinates record ids or `None`.
+    :param latitude:        The GPS points' latitudes.
+    :param longitude:       The GPS points' longitudes.
+    :param h_accuracy:      The reported horizontal accuracies of the GPS points.
+    :param distance_before: The distances between each point and the point immediately prior in meters.
+    :param trip_distance:   The cumulative distances of the trip at each point in meters.
+    :param period_before:   The number of seconds passed since the last recorded point.
+    :param timestamp_UTC:   The points' naive datetimes localized to UTC.
+    :param timestamp_epoch: (Optional) The points' stored UNIX epoch timestamps, otherwise
+                            calculated from the datetimes.
+
+    :ivar columns:          The columns of the trip's points by attribute name.
+    :vartype columns:       dict of `np.array`
+    :ivar labels:           The activity location labels of the points or `None` when the points
+                            have not been labeled.
+    :vartype labels:        list
+    '''
+
+    def __init__(
+        self,
+        database_id=(),
+        latitude=(),
+        longitude=(),
+        h_accuracy=(),
+        distance_before=(),
+        trip_distance=(),
+        period_before=(),
+        timestamp_UTC=(),
+        timestamp_epoch=None,
+    ):
+        if not isinstance(database_id, np.ndarray):
+            database_id = [NO_DATABASE_ID if i is None else i for i in database_id]
+        values = {
+            'database_id': database_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'h_accuracy': h_accuracy,
+            'distance_before': distance_before,
+            'trip_distance': trip_distance,
+            'period_before': period_before,
+            'timestamp_UTC': timestamp_UTC,
+        }
+        self._columns = {name: np.asarray(values[name], dtype=TRIP_POINT_COLUMNS[name]) for name in values}
+        if timestamp_epoch is None:
+            timestamp_epoch = (self._columns['timestamp_UTC'] - EPOCH) / np.timedelta64(1, 's')
+        self._columns['timestamp_epoch'] = np.asarray(timestamp_epoch, dtype=np.float64)
+        assert len({len(column) for column in self._columns.values()}) == 1
+
+        self.labels = None
+        self._pending = []
+
+    @classmethod
+    def from_points(cls, points):
+        '''
+        Create the columns of a trip's points from :py:class:`tripkit.models.TripPoint` objects.
+        '''
+        points = list(points)
+        trip_points = cls(**{name: [getattr(p, name) for p in points] for name in TRIP_POINT_COLUMNS})
+        labels = [getattr(p, 'label', None) for p in points]
+        if any(label is not None for label in labels):
+            trip_points.labels = labels
+        return trip_points
+
+    def _flush(self):
+        if not self._pending:
+            return
+        pending = TripPoints.from_points(self._pending)
+        self._pending = []
+        if self.labels is not None or pending.labels is not None:
+            labels = self.labels or [None] * len(self._columns['latitude'])
+            labels.extend(pending.labels or [None] * len(pending))
+            self.labels = labels
+        for name, column in pending._columns.items():
+            self._columns[name] = np.concatenate((self._columns[name], column))
+
+    @property
+    def columns(self):
+        self._flush()
+        return self._columns
+
+    def append(self, point):
+        self._pending.append(point)
+
+    def extend(self, points):
+        self._pending.extend(points)
+
+    def __len__(self):
+        return len(self._columns['latitude']) + len(self._pending)
+
+    def __getitem__(self, idx):
+        count = len(self.columns['latitude'])
+        if isinstance(idx, slice):
+            return [TripPointView(self, i) for i in range(*idx.indices(count))]
+        if idx < 0:
+            idx += count
+        if not 0 <= idx < count:
+            raise IndexError("trip point index out of range")
+        return TripPointView(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self.columns['latitude'])):
+            yield TripPointView(self, idx)
+
+    def __repr__(self):
+        return f"<tripkit.models.TripPoints count={len(self)}>"
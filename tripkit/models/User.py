@@ -11,6 +11,19 @@ class User(object):
                                    is initialized by :py:meth:`tripkit.database.Database.load_user`.
     '''
 
+    __slots__ = (
+        'uuid',
+        'coordinates',
+        'cancelled_prompt_responses',
+        'prompt_responses',
+        'survey_response',
+        'detected_trip_coordinates',
+        'detected_trip_day_summaries',
+        'user_locations',
+        'activity_locations',
+        'trips',
+    )
+
     def __init__(self, db_user):
         self.uuid = db_user.uuid
         self.coordinates = db_user.coordinates
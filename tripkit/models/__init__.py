@@ -2,4 +2,5 @@ from .ActivityLocation import ActivityLocation
 from .DaySummary import DaySummary
 from .Trip import Trip
 from .TripPoint import TripPoint
+from .TripPoints import TripPoints
 from .User import User
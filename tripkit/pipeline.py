@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# This module fans out per-user processing across a pool of worker processes that
+# each read from their own connection to the cache database. Results are returned
+# to the parent process which acts as the single writer to the cache.
+import functools
+import logging
+import multiprocessing
+import os
+import types
+
+from . import process
+from .database import Database
+from .process.trip_detection.triplab.v3 import algorithm as triplab_v3_algorithm
+from .utils import geo, itinerum
+
+
+logger = logging.getLogger('itinerum-tripkit.pipeline')
+
+TRIP_DETECTION_ALGORITHMS = {
+    'canue': process.trip_detection.canue.algorithm,
+    'triplab-v2': process.trip_detection.triplab.v2.algorithm,
+    'triplab-v3': triplab_v3_algorithm,
+}
+
+# number of a user's latest cached trips to search for a stable boundary in incremental mode
+INCREMENTAL_LOOKBACK_TRIPS = 25
+
+# per-process state initialized once for each worker
+_worker = {}
+
+
+def config_snapshot(config):
+    '''
+    Copy the uppercase settings of a config module or class to a picklable object for worker processes.
+    '''
+    settings = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    return types.SimpleNamespace(**settings)
+
+
+def init_worker(config, options, database=None):
+    '''
+    Open a read connection to the cache database within a worker process and load the
+    data shared by all users. Users processed within the parent process use its open ``database``.
+    '''
+    if database is None:
+        database = Database(config)
+        geo.projection.reset(
+            zone_num=getattr(config, 'UTM_ZONE_NUMBER', None), zone_letter=getattr(config, 'UTM_ZONE_LETTER', None)
+        )
+    _worker['config'] = config
+    _worker['database'] = database
+    _worker['options'] = options
+    _worker['parameters'] = {
+        'subway_entrances': database.load_subway_entrances(spatial_index=True),
+        'break_interval_seconds': config.TRIP_DETECTION_BREAK_INTERVAL_SECONDS,
+        'subway_buffer_meters': config.TRIP_DETECTION_SUBWAY_BUFFER_METERS,
+        'cold_start_distance': config.TRIP_DETECTION_COLD_START_DISTANCE_METERS,
+        'accuracy_cutoff_meters': config.TRIP_DETECTION_ACCURACY_CUTOFF_METERS,
+    }
+
+
+def load_coordinates(user, start=None):
+    '''
+    Load a user's coordinates within the pipeline's time bounds for the configured engine.
+    '''
+    database, options = _worker['database'], _worker['options']
+    if start is None or (options['start'] and options['start'] > start):
+        start = options['start']
+    # load columnar coordinates for the vectorized engine
+    if options['engine'] == 'numpy':
+        return database.load_user_arrays(user, start=start, end=options['end'])
+    if start != options['start']:
+        user = database.load_user(user.uuid, start=start, end=options['end'])
+    return user.coordinates
+
+
+def detect_canue_trips(coordinates, uuid, locations):
+    '''
+    Detect trips with the CANUE algorithm from a user's coordinates cleaned by the CANUE preprocessing,
+    splitting trips at the user's activity locations.
+    '''
+    prepared_coordinates = process.canue.preprocess.run(uuid, coordinates)
+    return process.trip_detection.canue.algorithm.run(_worker['config'], prepared_coordinates, locations)
+
+
+def detect_trips(user):
+    '''
+    Detect a user's trips, only re-detecting their latest cached trips in incremental mode. Only
+    the latest cached trips are searched for a stable boundary, but the returned trips always
+    cover the user's whole history: their earlier cached trips are loaded once a boundary is found.
+    '''
+    config, database, options = _worker['config'], _worker['database'], _worker['options']
+    if options['algorithm'] == 'canue':
+        locations = database.load_activity_locations(user)
+        detect = functools.partial(detect_canue_trips, uuid=user.uuid, locations=locations)
+    else:
+        algorithm = TRIP_DETECTION_ALGORITHMS[options['algorithm']]
+        detect = functools.partial(algorithm.run, parameters=_worker['parameters'], engine=options['engine'])
+    if not options['incremental']:
+        return detect(load_coordinates(user)), None
+
+    cached_trips = database.load_trips(user, last=INCREMENTAL_LOOKBACK_TRIPS)
+    trips, from_trip_num = process.trip_detection.incremental.run(
+        detect,
+        functools.partial(load_coordinates, user),
+        cached_trips,
+        config.TRIP_DETECTION_BREAK_INTERVAL_SECONDS,
+    )
+    if from_trip_num is not None:
+        # complete days counting, activity tallying and the returned results require all of the user's trips
+        earlier_trips = database.load_trips(user, before=cached_trips[0].num)
+        trips = earlier_trips + [t for t in cached_trips if t.num < from_trip_num] + trips
+    return trips, from_trip_num
+
+
+def process_user(uuid):
+    '''
+    Run trip detection, complete days counting and activity tallying for a single user. The
+    results are returned together so objects shared between them are kept when pickled.
+    '''
+    config, database, options = _worker['config'], _worker['database'], _worker['options']
+    user = database.load_user(uuid, start=options['start'], end=options['end'])
+    if user.coordinates.count() == 0:
+        return uuid, None
+
+    user.trips, from_trip_num = detect_trips(user)
+    result = {'trips': user.trips, 'from_trip_num': from_trip_num, 'complete_days': None, 'activity': None}
+
+    if options['complete_days']:
+        if options['algorithm'] == 'canue':
+            counter = process.complete_days.canue.counter
+        else:
+            counter = process.complete_days.triplab.counter
+        result['complete_days'] = counter.run(user.trips, config.TIMEZONE)
+
+    if options['activities']:
+        locations = database.load_activity_locations(user)
+        if not locations and config.INPUT_DATA_TYPE == 'itinerum':
+            locations = itinerum.create_activity_locations(user)
+        result['activity'] = process.activities.triplab.detect.run(
+            user, locations, config.ACTIVITY_LOCATION_PROXIMITY_METERS
+        )
+    return uuid, result
+
+
+def run(
+    tripkit,
+    uuids,
+    workers=None,
+    algorithm='triplab-v2',
+    engine='python',
+    complete_days=True,
+    activities=True,
+    start=None,
+    end=None,
+    incremental=False,
+    keep_results=False,
+):
+    '''
+    Process users across a pool of worker processes and save the results to the cache database
+    as they are returned.
+
+    :param tripkit: The :py:class:`tripkit.TripKit` instance with the cache database to write results to.
+    :param uuids:   The users' UUIDs to process.
+
+    See :py:meth:`tripkit.TripKit.run_pipeline` for the remaining parameters.
+
+    :rtype: dict
+    '''
+    if algorithm not in TRIP_DETECTION_ALGORITHMS:
+        valid_options = ', '.join(TRIP_DETECTION_ALGORITHMS.keys())
+        raise Exception(f"Pipeline algorithm not recognized: {algorithm} Valid options: {valid_options}")
+
+    config = config_snapshot(tripkit.config)
+    options = {
+        'algorithm': algorithm,
+        'engine': engine,
+        'complete_days': complete_days,
+        'activities': activities,
+        'start': start,
+        'end': end,
+        'incremental': incremental,
+    }
+    workers = workers or os.cpu_count()
+    workers = min(workers, len(uuids)) or 1
+
+    if workers == 1:
+        init_worker(config, options, database=tripkit.database)
+        user_results = map(process_user, uuids)
+        pool = None
+    else:
+        # close the parent's connection so it is not shared with forked workers
+        tripkit.database.db.close()
+        # results are received in input order so saved database ids match a serial run
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(config, options))
+        user_results = pool.imap(process_user, uuids)
+
+    results = {}
+    try:
+        for idx, (uuid, result) in enumerate(user_results, start=1):
+            logger.info(f"Processed user {uuid}: {idx}/{len(uuids)}...")
+            if not result:
+                logger.info(f"User {uuid} has no points, skipped.")
+                continue
+
+            # save trips first so day summaries reference the saved trip points
+            user = tripkit.database.load_user(uuid)
+            tripkit.database.save_trips(user, result['trips'], from_trip_num=result['from_trip_num'])
+            if result['complete_days']:
+                tripkit.database.save_trip_day_summaries(user, result['complete_days'], config.TIMEZONE)
+            if keep_results:
+                results[uuid] = result
+            else:
+                results[uuid] = {
+                    'num_trips': len(result['trips']),
+                    'from_trip_num': result['from_trip_num'],
+                    'num_complete_days': len(result['complete_days'] or []),
+                }
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        else:
+            _worker.clear()
+    return results
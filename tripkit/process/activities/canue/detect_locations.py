@@ -1,36 +1,85 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2019
 import math
-import networkx
 
 from tripkit.models import ActivityLocation as TripkitActivityLocation
 from tripkit.utils import geo
 
 CENTROID_OVERLAP_M = 150
+CENTROID_INTERSECTION_M = 50
+
+
+def _grid_cell(point, cell_size):
+    return (math.floor(point.easting / cell_size), math.floor(point.northing / cell_size))
+
+
+class _CentroidGrid(object):
+    '''
+    Buckets the indexes of centroids by square grid cells at least as large as a search distance, so
+    centroids within the distance of a point are found in the point's cell and its 8 surrounding cells.
+    '''
+
+    def __init__(self, centroids, distance_m):
+        self.centroids = centroids
+        self.distance_m = distance_m
+        # widened slightly so rounding cannot place points within the distance 2 cells apart
+        self.cell_size = distance_m * (1 + 1e-9)
+        self.cells = {}
+        for idx, ce in enumerate(centroids):
+            self.cells.setdefault(_grid_cell(ce, self.cell_size), []).append(idx)
+
+    def within(self, point):
+        '''
+        Return the indexes of centroids within the search distance of a point, in ascending order.
+        '''
+        col, row = _grid_cell(point, self.cell_size)
+        idxs = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for idx in self.cells.get((col + dx, row + dy), []):
+                    if geo.distance_m(point, self.centroids[idx]) <= self.distance_m:
+                        idxs.append(idx)
+        return sorted(idxs)
+
+
+def _find(parents, idx):
+    while parents[idx] != idx:
+        parents[idx] = parents[parents[idx]]
+        idx = parents[idx]
+    return idx
 
 
 def condense_overlaps(centroids):
-    G = networkx.Graph()
-    connected = set()
-    for ce1 in centroids:
-        for ce2 in centroids:
-            if ce1 == ce2:
+    # join centroids within the overlap distance of each other into connected components
+    grid = _CentroidGrid(centroids, CENTROID_OVERLAP_M)
+    parents = list(range(len(centroids)))
+    for idx1, ce1 in enumerate(centroids):
+        for idx2 in grid.within(ce1):
+            if idx2 <= idx1:
                 continue
-            if geo.distance_m(ce1, ce2) <= CENTROID_OVERLAP_M:
-                G.add_edge(ce1, ce2)
-                connected.update((ce1, ce2))
-    unconnected = set(centroids) - connected
-
-    condensed = [geo.centroid(cc) for cc in networkx.connected_components(G)]
-    for ce in unconnected:
-        condensed.append(ce)
+            root1, root2 = _find(parents, idx1), _find(parents, idx2)
+            if root1 != root2:
+                parents[max(root1, root2)] = min(root1, root2)
+
+    components = {}
+    for idx, ce in enumerate(centroids):
+        components.setdefault(_find(parents, idx), []).append(ce)
+
+    condensed = [geo.centroid(cc) for cc in components.values() if len(cc) > 1]
+    for cc in components.values():
+        if len(cc) == 1:
+            condensed.append(cc[0])
     return condensed
 
 
-def _intersects(point, iterpoints, dist_m=50):
-    for test_point in iterpoints:
-        if geo.distance_m(point, test_point) <= 50:
-            return test_point
+def _intersections(points, test_points, dist_m=CENTROID_INTERSECTION_M):
+    # match each point to the first test point within the distance or `None`
+    grid = _CentroidGrid(test_points, dist_m)
+    matches = []
+    for point in points:
+        idxs = grid.within(point)
+        matches.append(test_points[idxs[0]] if idxs else None)
+    return matches
 
 
 def wrap_for_tripkit(locations):
@@ -67,8 +116,7 @@ def run(kmeans_groups, stdev_groups):
     # possible stop locations
     locations = {}
     idx = 0
-    for kmeans_ce in kmeans_centroids:
-        match = _intersects(kmeans_ce, stdev_centroids)
+    for match in _intersections(kmeans_centroids, stdev_centroids):
         if match:
             idx += 1
             label = f'location_{idx}'
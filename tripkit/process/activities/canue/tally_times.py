@@ -21,12 +21,11 @@ def detect_activity_location_overlap(uuid, locations, activity_proximity_m):
 
 
 def label_trip_points(locations, trip, proximity_m):
-    for p in trip.points:
-        p.label = None
-        for location in locations:
-            if geo.haversine_distance_m(p, location) <= proximity_m:
-                p.label = location.label
-                continue
+    points = trip.points
+    index = geo.activity_location_index(locations)
+    # points within the proximity of multiple locations are labeled with the last location
+    for p, label in zip(points, index.labels(points, proximity_m, last=True)):
+        p.label = label
 
 
 def classify_dwell(last_trip, trip):
@@ -71,9 +70,10 @@ def run(user, locations, proximity_m=50):
     detect_activity_location_overlap(user.uuid, locations, proximity_m)
 
     activity = UserActivity(user.uuid)
+    index = geo.activity_location_index(locations)
     last_t = None
     for t in user.trips:
-        label_trip_points(locations, t, proximity_m)
+        label_trip_points(index, t, proximity_m)
 
         # classify commute times for trips occuring between activity locations
         commute_label = classify_commute(t)
@@ -47,20 +47,20 @@ def label_trip_points(locations, trip, proximity_m):
     '''
     Labels each trip point with its closest semantic location.
 
-    :param locations:   List of activity locations with semantic labels.
+    :param locations:   List or spatial index of activity locations with semantic labels.
     :param trip:        Detected trip from user coordinates.
     :param proximity_m: The buffer distance (meters) from the activity location centroid to label trip points.
 
-    :type locations:   list of :py:class:`tripkit.models.ActivityLocation`
+    :type locations:   list of :py:class:`tripkit.models.ActivityLocation` or
+                       :py:class:`tripkit.utils.geo.ActivityLocationIndex`
     :type trip:        :py:class:`tripkit.models.Trip`
     :type proximity_m: int
     '''
-    for p in trip.points:
-        p.label = None
-        for location in locations:
-            if geo.haversine_distance_m(p, location) <= proximity_m:
-                p.label = location.label
-                continue
+    points = trip.points
+    index = geo.activity_location_index(locations)
+    # points within the proximity of multiple locations are labeled with the last location
+    for p, label in zip(points, index.labels(points, proximity_m, last=True)):
+        p.label = label
 
 
 def classify_commute(trip):
@@ -116,9 +116,10 @@ def run(user, locations, proximity_m=50):
 
     # tally distances and durations for semantic locations by date and as aggregate totals for all trips
     activity = UserActivity(user.uuid)
+    index = geo.activity_location_index(locations)
     last_t = None
     for t in user.trips:
-        label_trip_points(locations, t, proximity_m)
+        label_trip_points(index, t, proximity_m)
 
         # classify commute times for trips occuring between semantic locations
         commute_label = classify_commute(t)
@@ -38,7 +38,11 @@ class Coordinate(object):
         self.uuid = c.uuid
         self.latitude = c.latitude
         self.longitude = c.longitude
-        self.timestamp_UTC = datetime.fromisoformat(c.timestamp_UTC).replace(tzinfo=None)
+        # text timestamps are returned as strings while timestamps created from epoch are already datetimes
+        timestamp_UTC = c.timestamp_UTC
+        if isinstance(timestamp_UTC, str):
+            timestamp_UTC = datetime.fromisoformat(timestamp_UTC)
+        self.timestamp_UTC = timestamp_UTC.replace(tzinfo=None)
         # attributes to be later calculated based upon previous point
         self.duration_s = 0
         self.distance_m = 0.0
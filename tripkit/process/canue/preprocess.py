@@ -23,32 +23,55 @@ Wolf, J. (2000). Using GPS Data Loggers to Replace Travel Diaries in the Collect
     Travel Data. Ph.D. Thesis, Georgia Institute of Technology, Atlanta.
 '''
 import logging
-import utm
+import numpy as np
 
 from .models import Coordinate
 from tripkit.utils import calc, geo
+from tripkit.utils.arrays import ArrayRows, is_coordinate_array
 
 logger = logging.getLogger('itinerum-tripkit.process.canue.preprocess')
 
 
-def rolling_window_avg(values, idx, size=20):
+def rolling_window_avg(values, size=20):
+    '''
+    Returns the average of the window of values around each index, from the `size / 2` values before
+    it to the `size / 2 - 1` values after it, or `None` where the window does not have enough preceding
+    or trailing values. The window sums are divided by `size + 1` as in GERT.
+    '''
     half_size = int(size / 2)
-    # do not calculate when not enough preceding values in window
-    if (idx - 1) < half_size:
-        return
-    # do not calculate when not enough trailing values in window
-    if (len(values) - (idx + 1)) < half_size:
-        return
-    lower_idx = idx - half_size
-    upper_idx = idx + half_size
-    return sum(values[lower_idx:upper_idx]) / (size + 1)
+    num_averaged = len(values) - 2 * half_size - 1
+    if num_averaged <= 0:
+        return [None] * len(values)
+    window_sums = calc.rolling_sum(values, 2 * half_size)
+    averages = (window_sums[1:-1] / (size + 1)).tolist()
+    return [None] * (half_size + 1) + averages + [None] * half_size
+
 
 def run(uuid, coordinates):
-    total_coordinates = coordinates.count()
+    # project all coordinates at once within the survey's UTM zone
+    if is_coordinate_array(coordinates):
+        eastings, northings = geo.projection.project_ids(
+            coordinates['id'], coordinates['latitude'], coordinates['longitude']
+        )
+        latitudes, longitudes = coordinates['latitude'], coordinates['longitude']
+        coordinates = ArrayRows(coordinates)
+    else:
+        coordinates = list(coordinates)
+        latitudes = np.array([c.latitude for c in coordinates], dtype=np.float64)
+        longitudes = np.array([c.longitude for c in coordinates], dtype=np.float64)
+        eastings, northings = geo.projection.project_ids([c.id for c in coordinates], latitudes, longitudes)
+    eastings, northings = eastings.tolist(), northings.tolist()
+    # distances between consecutive coordinates, recalculated after skipped coordinates
+    step_distances = geo.haversine_distance_array(
+        latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:]
+    ).tolist()
+    zone_num, zone_letter = geo.projection.zone_num, geo.projection.zone_letter
+
+    total_coordinates = len(coordinates)
     logger.info(f"Uncleaned input coordinates: {total_coordinates}")
 
     processed = []
-    last_gc = None
+    last_gc, last_idx = None, None
     last_pct = 0
     logger.info(f"Processing...{last_pct}%")
     for idx, c in enumerate(coordinates):
@@ -62,14 +85,15 @@ def run(uuid, coordinates):
 
         # calculate coordinate attributes compared to previous coordinate
         if not last_gc:
-            gc.easting, gc.northing, gc.zone_num, gc.zone_letter = utm.from_latlon(gc.latitude, gc.longitude)
+            gc.easting, gc.northing, gc.zone_num, gc.zone_letter = eastings[idx], northings[idx], zone_num, zone_letter
             processed.append(gc)
-            last_gc = gc
+            last_gc, last_idx = gc, idx
             continue
         gc.duration_s = geo.duration_s(last_gc, gc)
-        gc.distance_m = geo.haversine_distance_m(last_gc, gc)
-        gc.bearing = geo.bearing(last_gc, gc)
-        gc.delta_heading = geo.delta_heading(last_gc, gc)
+        if last_idx == idx - 1:
+            gc.distance_m = step_distances[last_idx]
+        else:
+            gc.distance_m = geo.haversine_distance_m(last_gc, gc)
 
         # skip points with speed of 0
         if not gc.speed_ms:
@@ -84,18 +108,27 @@ def run(uuid, coordinates):
         #     processed.append(gc)
 
         # augment with projected coordinates
-        gc.easting, gc.northing, gc.zone_num, gc.zone_letter = utm.from_latlon(gc.latitude, gc.longitude)
+        gc.easting, gc.northing, gc.zone_num, gc.zone_letter = eastings[idx], northings[idx], zone_num, zone_letter
         processed.append(gc)
-        last_gc = gc
+        last_gc, last_idx = gc, idx
     logger.info(f"Processing...100%")
 
+    # calculate bearings and heading changes from each kept coordinate to the next
+    if len(processed) > 1:
+        kept_latitudes = np.array([gc.latitude for gc in processed], dtype=np.float64)
+        kept_longitudes = np.array([gc.longitude for gc in processed], dtype=np.float64)
+        bearings = geo.bearing_array(kept_latitudes[:-1], kept_longitudes[:-1], kept_latitudes[1:], kept_longitudes[1:])
+        prev_bearings = np.concatenate(([processed[0].bearing], bearings[:-1]))
+        delta_headings = geo.delta_heading_array(prev_bearings, bearings)
+        for gc, gc_bearing, gc_delta_heading in zip(processed[1:], bearings.tolist(), delta_headings.tolist()):
+            gc.bearing = gc_bearing
+            gc.delta_heading = gc_delta_heading
+
     # update rolling averages
-    distance_values, delta_heading_values = [], []
-    for c in processed:
-        distance_values.append(c.distance_m)
-        delta_heading_values.append(c.delta_heading)
-    for idx, gc in enumerate(processed):
-        gc.avg_distance_m = rolling_window_avg(distance_values, idx)
-        gc.avg_delta_heading = rolling_window_avg(delta_heading_values, idx)
+    avg_distances = rolling_window_avg([c.distance_m for c in processed])
+    avg_delta_headings = rolling_window_avg([c.delta_heading for c in processed])
+    for gc, avg_distance_m, avg_delta_heading in zip(processed, avg_distances, avg_delta_headings):
+        gc.avg_distance_m = avg_distance_m
+        gc.avg_delta_heading = avg_delta_heading
     logger.info(f"Cleaned input coordinates: {len(processed)}")
     return processed
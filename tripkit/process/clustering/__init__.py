@@ -1,5 +1,7 @@
+from . import dbscan
 from . import dbscan_ref
 from . import delta_heading_stdev
 from . import hdbscan_ts
 from . import kmeans
+from . import kmeans1d
 from . import kmeanspp
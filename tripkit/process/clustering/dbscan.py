@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Grid-indexed DBSCAN clustering to detect stops. Points are projected to meters once and
+# grouped into square grid cells small enough that all points within a cell are neighbors,
+# so only cells with few points need distances tested against the points of nearby cells.
+# Projected distances are scaled by the projection's scale factor at the points and pairs
+# whose scaled distance is too close to the threshold distance to be certain are tested with
+# the geodesic distance of the reference implementation (`dbscan_ref`), which gives the same
+# labels. A time-ordered variant for streams of points is also included.
+import itertools
+import logging
+import math
+import numpy as np
+
+from tripkit.utils import geo
+from tripkit.utils.arrays import ArrayRows, is_coordinate_array
+from tripkit.utils.misc import LazyLoader
+from .dbscan_ref import EPS, MIN_PTS
+
+geopy_distance = LazyLoader('geopy_distance', globals(), 'geopy.distance')
+csgraph = LazyLoader('csgraph', globals(), 'scipy.sparse.csgraph')
+sparse = LazyLoader('sparse', globals(), 'scipy.sparse')
+spatial = LazyLoader('spatial', globals(), 'scipy.spatial')
+
+logger = logging.getLogger('itinerum-tripkit.process.clustering.dbscan')
+
+# maximum relative difference between geodesic distances and projected distances divided by the
+# projection's scale factors at a pair's points, pairs with a projected distance within this margin
+# of the threshold distance scaled to the pair are tested by their geodesic distance
+PROJECTION_TOLERANCE = 0.005
+
+# maximum number of pairs to test as a single distance matrix
+MAX_MATRIX_PAIRS = 250000
+
+
+class _ProjectedPoints(object):
+    '''
+    Projected positions of points with their original latitudes and longitudes for testing neighbors.
+    The inner and outer threshold distances bound the projected distances of neighbors for all points.
+    '''
+
+    def __init__(self, latitudes, longitudes, eps, tolerance=PROJECTION_TOLERANCE):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.eastings, self.northings = geo.projection.project(self.latitudes, self.longitudes)
+        self.scales = geo.projection.scale_factors(self.latitudes, self.longitudes)
+        self.eps = eps
+        self.tolerance = tolerance
+        self.inner_eps = eps * self.scales.min() * (1 - tolerance)
+        self.outer_eps = eps * self.scales.max() * (1 + tolerance)
+
+    def is_neighbor(self, idxs1, idxs2):
+        '''
+        Returns the matrix of whether each point of `idxs1` (rows) is within the threshold
+        distance of each point of `idxs2` (columns).
+        '''
+        rows, cols = idxs1[:, None], idxs2[None, :]
+        a = self.eastings[cols] - self.eastings[rows]
+        b = self.northings[cols] - self.northings[rows]
+        distances = np.sqrt(a ** 2 + b ** 2)
+        scales1, scales2 = self.scales[rows], self.scales[cols]
+        within = distances < self.eps * np.minimum(scales1, scales2) * (1 - self.tolerance)
+        is_uncertain = ~within & (distances < self.eps * np.maximum(scales1, scales2) * (1 + self.tolerance))
+        for row, col in np.argwhere(is_uncertain):
+            within[row, col] = self.is_geodesic_neighbor(idxs1[row], idxs2[col])
+        return within
+
+    def is_geodesic_neighbor(self, idx1, idx2):
+        p1 = (self.latitudes[idx1], self.longitudes[idx1])
+        p2 = (self.latitudes[idx2], self.longitudes[idx2])
+        return geopy_distance.distance(p1, p2).meters < self.eps
+
+    def is_any_neighbor(self, idxs1, idxs2):
+        '''
+        Returns whether any point of `idxs1` is within the threshold distance of any point of `idxs2`.
+        '''
+        if len(idxs1) * len(idxs2) <= MAX_MATRIX_PAIRS:
+            return bool(self.is_neighbor(idxs1, idxs2).any())
+
+        # test large groups by the nearest projected points before any uncertain pairs
+        tree = spatial.cKDTree(np.column_stack((self.eastings[idxs2], self.northings[idxs2])))
+        test_points = np.column_stack((self.eastings[idxs1], self.northings[idxs1]))
+        distances, _ = tree.query(test_points, distance_upper_bound=self.outer_eps)
+        if (distances < self.inner_eps).any():
+            return True
+        uncertain = np.flatnonzero(distances < self.outer_eps)
+        for row, cols in zip(uncertain, tree.query_ball_point(test_points[uncertain], r=self.outer_eps)):
+            if self.is_neighbor(idxs1[row : row + 1], idxs2[np.asarray(cols, dtype=np.int64)]).any():
+                return True
+        return False
+
+
+def _grid_cells(points, cell_size):
+    '''
+    Groups the indexes of points by grid cell, with the indexes of each cell in ascending order.
+    '''
+    cols = np.floor(points.eastings / cell_size).astype(np.int64)
+    rows = np.floor(points.northings / cell_size).astype(np.int64)
+    order = np.lexsort((np.arange(len(cols)), rows, cols))
+    cols, rows = cols[order], rows[order]
+    starts = np.flatnonzero(np.diff(cols, prepend=cols[0] - 1) | np.diff(rows, prepend=rows[0] - 1))
+    ends = np.append(starts[1:], len(order))
+    cells = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        cells[(int(cols[start]), int(rows[start]))] = order[start:end]
+    return cells
+
+
+def _neighbor_offsets(cell_size, distance):
+    '''
+    Returns the offsets of the grid cells that can contain points within a distance of a cell's points.
+    '''
+    reach = int(math.ceil(distance / cell_size))
+    offsets = []
+    for dx, dy in itertools.product(range(-reach, reach + 1), repeat=2):
+        gap_x = max(abs(dx) - 1, 0) * cell_size
+        gap_y = max(abs(dy) - 1, 0) * cell_size
+        if (dx, dy) != (0, 0) and math.sqrt(gap_x ** 2 + gap_y ** 2) < distance:
+            offsets.append((dx, dy))
+    return offsets
+
+
+def _find(parents, key):
+    while parents[key] != key:
+        parents[key] = parents[parents[key]]
+        key = parents[key]
+    return key
+
+
+def run(coordinates, eps=EPS, min_pts=MIN_PTS):
+    '''
+    Labels points by density-based clusters with the same results as `dbscan_ref.run` for points projected
+    within the survey's UTM zone or outside of it (see `PROJECTION_TOLERANCE`): points with at
+    least `min_pts` neighbors (including themselves) within `eps` meters are core points of a cluster
+    with the core points they neighbor and other points are labeled by the first cluster they neighbor
+    or as noise. Clusters are numbered by the order of their first core point.
+
+    :param coordinates: A user's coordinates as records with `latitude` and `longitude` attributes or
+                        as an array from :py:meth:`tripkit.database.Database.load_user_arrays`.
+    :param eps:         The threshold distance in meters between neighboring points.
+    :param min_pts:     The minimum number of neighboring points of a core point.
+
+    :type eps:          float, optional
+    :type min_pts:      int, optional
+
+    :returns: The cluster label of each point beginning from 1 or -1 for noise.
+    :rtype: list of int
+    '''
+    if is_coordinate_array(coordinates):
+        latitudes, longitudes = coordinates['latitude'], coordinates['longitude']
+    else:
+        coordinates = list(coordinates)
+        latitudes = [c.latitude for c in coordinates]
+        longitudes = [c.longitude for c in coordinates]
+    if not len(latitudes):
+        return []
+
+    # all points within a cell are neighbors since the cell's diagonal is shorter than the threshold distance
+    points = _ProjectedPoints(latitudes, longitudes, eps)
+    cell_size = points.inner_eps / math.sqrt(2) * (1 - 1e-9)
+    cells = _grid_cells(points, cell_size)
+    offsets = _neighbor_offsets(cell_size, points.outer_eps)
+
+    def _neighbor_cells(key):
+        for dx, dy in offsets:
+            neighbor_key = (key[0] + dx, key[1] + dy)
+            if neighbor_key in cells:
+                yield neighbor_key
+
+    # find core points, counting neighbors in nearby cells only for cells without enough points
+    is_core = np.zeros(len(points.eastings), dtype=bool)
+    for key, idxs in cells.items():
+        if len(idxs) >= min_pts:
+            is_core[idxs] = True
+            continue
+        counts = np.full(len(idxs), len(idxs))
+        for neighbor_key in _neighbor_cells(key):
+            counts += points.is_neighbor(idxs, cells[neighbor_key]).sum(axis=1)
+        is_core[idxs] = counts >= min_pts
+
+    # join the cells with core points that neighbor each other into clusters
+    core_cells = {key: idxs[is_core[idxs]] for key, idxs in cells.items()}
+    core_cells = {key: idxs for key, idxs in core_cells.items() if len(idxs)}
+    parents = {key: key for key in core_cells}
+    for key, core_idxs in core_cells.items():
+        for neighbor_key in _neighbor_cells(key):
+            if neighbor_key <= key or neighbor_key not in core_cells:
+                continue
+            root, neighbor_root = _find(parents, key), _find(parents, neighbor_key)
+            if root != neighbor_root and points.is_any_neighbor(core_idxs, core_cells[neighbor_key]):
+                parents[max(root, neighbor_root)] = min(root, neighbor_root)
+
+    # number clusters by their first core point as when points are searched in order
+    first_core_idxs = {}
+    for key, core_idxs in core_cells.items():
+        root = _find(parents, key)
+        first_core_idxs[root] = min(first_core_idxs.get(root, core_idxs[0]), core_idxs[0])
+    cluster_ids = {root: num for num, root in enumerate(sorted(first_core_idxs, key=first_core_idxs.get), start=1)}
+    cell_cluster_ids = {key: cluster_ids[_find(parents, key)] for key in core_cells}
+
+    labels = np.full(len(points.eastings), -1, dtype=np.int64)
+    for key, core_idxs in core_cells.items():
+        labels[core_idxs] = cell_cluster_ids[key]
+
+    # label border points by the first cluster they neighbor, all core points of a cell share a cluster
+    for key, idxs in cells.items():
+        border_idxs = idxs[~is_core[idxs]]
+        if not len(border_idxs):
+            continue
+        border_labels = np.full(len(border_idxs), np.iinfo(np.int64).max)
+        if key in core_cells:
+            border_labels[:] = cell_cluster_ids[key]
+        for neighbor_key in _neighbor_cells(key):
+            if neighbor_key not in core_cells:
+                continue
+            is_neighbor = points.is_neighbor(border_idxs, core_cells[neighbor_key]).any(axis=1)
+            border_labels[is_neighbor] = np.minimum(border_labels[is_neighbor], cell_cluster_ids[neighbor_key])
+        border_labels[border_labels == np.iinfo(np.int64).max] = -1
+        labels[border_idxs] = border_labels
+    return labels.tolist()
+
+
+class _StreamCluster(object):
+    def __init__(self):
+        self.members = []
+        self.last_core_epoch = None
+
+
+def _stream_pairs(eastings, northings, scales, epochs, eps, period_s):
+    '''
+    Returns the rows of the pairs of points within `eps` meters and `period_s` seconds of each other, with
+    projected distances divided by the projection's mean scale factor at each pair's points. Time is scaled
+    to the threshold distance so a KD-tree ball around each point contains its time window.
+    '''
+    max_eps = eps * scales.max()
+    scaled_epochs = (epochs - epochs[0]) * (max_eps / period_s)
+    tree = spatial.cKDTree(np.column_stack((eastings, northings, scaled_epochs)))
+    pairs = tree.query_pairs(max_eps * math.sqrt(2) * (1 + 1e-9), output_type='ndarray')
+    rows1, rows2 = pairs[:, 0], pairs[:, 1]
+    a = eastings[rows2] - eastings[rows1]
+    b = northings[rows2] - northings[rows1]
+    pair_eps = eps * (scales[rows1] + scales[rows2]) / 2
+    within = (np.sqrt(a ** 2 + b ** 2) < pair_eps) & (np.abs(epochs[rows2] - epochs[rows1]) <= period_s)
+    return rows1[within], rows2[within]
+
+
+def stream(coordinates, eps=EPS, min_pts=MIN_PTS, period_s=300, chunk_size=5000):
+    '''
+    Yields stops from timestamp-ordered coordinates as density-based clusters of points that are within
+    `eps` meters and `period_s` seconds of each other. Points are read in chunks and each cluster is
+    yielded once no later point can join it, so memory is bounded by the points within a few time windows
+    and the open clusters. Points neighboring the core points of more than one cluster belong to the
+    cluster of their earliest core neighbor.
+
+    :param coordinates: A user's timestamp-ordered coordinates as records with `latitude`, `longitude` and
+                        `timestamp_epoch` attributes or as an array from
+                        :py:meth:`tripkit.database.Database.load_user_arrays`.
+    :param eps:         The threshold distance in meters between neighboring points.
+    :param min_pts:     The minimum number of neighboring points of a core point.
+    :param period_s:    The maximum time in seconds between neighboring points, must be positive.
+    :param chunk_size:  The number of coordinates to read at once.
+
+    :type eps:          float, optional
+    :type min_pts:      int, optional
+    :type period_s:     int, optional
+    :type chunk_size:   int, optional
+
+    :returns: The coordinates of each stop as lists, yielded in order of completion.
+    :rtype: generator of lists
+    '''
+    if is_coordinate_array(coordinates):
+        coordinates = ArrayRows(coordinates)
+    coordinates = iter(coordinates)
+
+    # buffered points: a point is complete once all of its neighbors have been read and decided once the
+    # core status of all of its neighbors is known, when it can be labeled as a border point
+    buffered = []
+    eastings, northings, scales, epochs = np.empty(0), np.empty(0), np.empty(0), np.empty(0)
+    is_core = np.empty(0, dtype=bool)
+    is_complete = np.empty(0, dtype=bool)
+    is_decided = np.empty(0, dtype=bool)
+    labels = np.empty(0, dtype=np.int64)
+    clusters, parents = {}, {}
+    stream_offset = 0
+
+    def _add_members(root, rows):
+        clusters[root].members.extend(zip((rows + stream_offset).tolist(), [buffered[r] for r in rows]))
+
+    while True:
+        chunk = list(itertools.islice(coordinates, chunk_size))
+        is_final = not chunk
+        if chunk:
+            chunk_latitudes, chunk_longitudes = [c.latitude for c in chunk], [c.longitude for c in chunk]
+            chunk_eastings, chunk_northings = geo.projection.project(chunk_latitudes, chunk_longitudes)
+            buffered.extend(chunk)
+            eastings = np.concatenate((eastings, chunk_eastings))
+            northings = np.concatenate((northings, chunk_northings))
+            scales = np.concatenate((scales, geo.projection.scale_factors(chunk_latitudes, chunk_longitudes)))
+            epochs = np.concatenate((epochs, np.array([c.timestamp_epoch for c in chunk], dtype=np.float64)))
+            is_core = np.concatenate((is_core, np.zeros(len(chunk), dtype=bool)))
+            is_complete = np.concatenate((is_complete, np.zeros(len(chunk), dtype=bool)))
+            is_decided = np.concatenate((is_decided, np.zeros(len(chunk), dtype=bool)))
+            labels = np.concatenate((labels, np.full(len(chunk), -1, dtype=np.int64)))
+        if not buffered:
+            return
+
+        latest_epoch = epochs[-1]
+        rows1, rows2 = _stream_pairs(eastings, northings, scales, epochs, eps, period_s)
+
+        # count the neighbors of points that have been completed by the latest points
+        completed = ~is_complete & ((epochs < latest_epoch - period_s) | is_final)
+        counts = np.ones(len(buffered), dtype=np.int64)
+        counts += np.bincount(rows1[completed[rows1]], minlength=len(buffered))
+        counts += np.bincount(rows2[completed[rows2]], minlength=len(buffered))
+        is_core[completed] = counts[completed] >= min_pts
+        is_complete |= completed
+
+        # join completed core points to the clusters of the core points they neighbor
+        new_cores = np.flatnonzero(completed & is_core)
+        if len(new_cores):
+            is_core_pair = is_core[rows1] & is_core[rows2] & is_complete[rows1] & is_complete[rows2]
+            is_core_pair &= completed[rows1] | completed[rows2]
+            core_rows1, core_rows2 = rows1[is_core_pair], rows2[is_core_pair]
+            graph = sparse.coo_matrix(
+                (np.ones(len(core_rows1)), (core_rows1, core_rows2)), shape=(len(buffered), len(buffered))
+            )
+            _, components = csgraph.connected_components(graph, directed=False)
+            component_roots = {}
+            for row in np.unique(np.concatenate((core_rows1, core_rows2))):
+                if not completed[row]:
+                    component_roots.setdefault(components[row], set()).add(_find(parents, labels[row]))
+            new_components, new_component_idxs = np.unique(components[new_cores], return_inverse=True)
+            for component_idx, component in enumerate(new_components.tolist()):
+                rows = new_cores[new_component_idxs == component_idx]
+                roots = component_roots.get(component, set())
+                if roots:
+                    root = min(roots)
+                else:
+                    root = int(rows[0]) + stream_offset
+                    parents[root] = root
+                    clusters[root] = _StreamCluster()
+                cluster = clusters[root]
+                for other_root in roots - {root}:
+                    other = clusters.pop(other_root)
+                    parents[other_root] = root
+                    cluster.members.extend(other.members)
+                    cluster.last_core_epoch = max(cluster.last_core_epoch, other.last_core_epoch)
+                labels[rows] = root
+                _add_members(root, rows)
+                last_core_epoch = float(epochs[rows].max())
+                cluster.last_core_epoch = max(cluster.last_core_epoch or last_core_epoch, last_core_epoch)
+
+        # label border points by the cluster of their earliest core neighbor
+        deciding = is_complete & ~is_decided & ((epochs < latest_epoch - 2 * period_s) | is_final)
+        border = deciding & ~is_core
+        earliest_cores = np.full(len(buffered), len(buffered), dtype=np.int64)
+        is_border_pair = border[rows1] & is_core[rows2]
+        np.minimum.at(earliest_cores, rows1[is_border_pair], rows2[is_border_pair])
+        is_border_pair = border[rows2] & is_core[rows1]
+        np.minimum.at(earliest_cores, rows2[is_border_pair], rows1[is_border_pair])
+        for row in np.flatnonzero(border & (earliest_cores < len(buffered))).tolist():
+            root = _find(parents, labels[earliest_cores[row]])
+            labels[row] = root
+            _add_members(root, np.array([row]))
+        is_decided |= deciding
+
+        # yield clusters that no unread or undecided point can join
+        for root in sorted(clusters):
+            cluster = clusters[root]
+            if is_final or cluster.last_core_epoch < latest_epoch - 3 * period_s:
+                del clusters[root]
+                yield [c for _, c in sorted(cluster.members, key=lambda m: m[0])]
+        if is_final:
+            return
+
+        # drop points that can no longer neighbor an incomplete or undecided point
+        num_dropped = int(np.searchsorted(epochs, latest_epoch - 3 * period_s - 1))
+        if num_dropped:
+            del buffered[:num_dropped]
+            eastings, northings, epochs = eastings[num_dropped:], northings[num_dropped:], epochs[num_dropped:]
+            scales = scales[num_dropped:]
+            is_core, is_complete = is_core[num_dropped:], is_complete[num_dropped:]
+            is_decided, labels = is_decided[num_dropped:], labels[num_dropped:]
+            stream_offset += num_dropped
+
+
+def run_timeseries(coordinates, eps=EPS, min_pts=MIN_PTS, period_s=300):
+    '''
+    Labels timestamp-ordered points by the stops found by `stream`, numbered by their order of completion.
+
+    :rtype: list of int
+    '''
+    if is_coordinate_array(coordinates):
+        coordinates = ArrayRows(coordinates)
+    coordinates = list(coordinates)
+    labels = {}
+    for num, stop in enumerate(stream(coordinates, eps=eps, min_pts=min_pts, period_s=period_s), start=1):
+        for c in stop:
+            labels[id(c)] = num
+    return [labels.get(id(c), -1) for c in coordinates]
@@ -7,12 +7,17 @@ import os
 import utm
 import warnings
 
+from tripkit.utils import geo
+from tripkit.utils.arrays import ArrayRows, is_coordinate_array
 from tripkit.utils.misc import LazyLoader
 scipy = LazyLoader('scipy', globals(), 'scipy')
 hdbscan = LazyLoader('hdbscan', globals(), 'hdbscan')
 
 logger = logging.getLogger('itinerum-tripkit.process.clustering.hdbscan_ts')
 
+# maximum number of a cluster's points used to find its center of gravity
+CENTER_OF_GRAVITY_MAX_POINTS = 20000
+
 
 def distance_m(point1, point2):
     '''
@@ -96,20 +101,42 @@ def check_min_stop_time(clusters, min_s):
     return stop_clusters
 
 
-def clusters_center_of_gravity(clusters):
+def _closest_distances(points):
+    '''
+    Returns the distance from each point to its closest point at a different location, points without one are
+    given an impossibly large distance so they are not selected as weights.
+    '''
+    locations, inverse = np.unique(points, axis=0, return_inverse=True)
+    closest = np.full(len(locations), 1e16)
+    if len(locations) > 1:
+        distances, _ = scipy.spatial.cKDTree(locations).query(locations, k=2)
+        closest = distances[:, 1]
+    return closest[inverse.ravel()]
+
+
+def _stratified_sample(count, max_points, seed=0):
+    '''
+    Returns the sorted indexes of one point drawn from each of `max_points` equally-sized strata of a cluster's
+    timestamp-ordered points.
+    '''
+    edges = np.arange(max_points + 1) * count // max_points
+    offsets = np.random.default_rng(seed).random(max_points) * np.diff(edges)
+    return edges[:-1] + offsets.astype(np.int64)
+
+
+def clusters_center_of_gravity(clusters, max_points=CENTER_OF_GRAVITY_MAX_POINTS):
     '''
     Get a centroid-like attribute where center is calculated by giving higher weights
-    to points with closer neighbors.
+    to points with closer neighbors. Clusters with more than `max_points` points are sampled
+    across their duration.
     '''
     centers = []
     for cluster in clusters:
+        if len(cluster) > max_points:
+            cluster = [cluster[idx] for idx in _stratified_sample(len(cluster), max_points).tolist()]
         c_points = np.asarray([(c.easting, c.northing) for c in cluster])
-        # euclidean distance betweens all points with each other point
-        m = scipy.spatial.distance_matrix(c_points, c_points)
-        # give any points that share a location an impossibly large distance so they are not selected as weights
-        m[m == 0] = 1e16
-        # get the closest distance for each point
-        closest_points = m.min(axis=0)
+        # get the closest distance for each point with a nearest neighbor search
+        closest_points = _closest_distances(c_points)
         i_closest_points = 1 / closest_points
         avg = np.average(c_points, weights=i_closest_points, axis=0)
         centers.append(avg)
@@ -124,11 +151,17 @@ def run(min_stop_time_s, coordinates):
     if count <= 10:
         return {}
 
-    points = np.empty([count, 2])
-    utm_zone_number, utm_zone_letter = None, None
-    for idx, c in enumerate(coordinates):
-        easting, northing, utm_zone_number, utm_zone_letter = utm.from_latlon(c.latitude, c.longitude)
-        points[idx] = [easting, northing]
+    if is_coordinate_array(coordinates):
+        eastings, northings = geo.projection.project_ids(
+            coordinates['id'], coordinates['latitude'], coordinates['longitude']
+        )
+        coordinates = list(ArrayRows(coordinates))
+    else:
+        eastings, northings = geo.projection.project(
+            [c.latitude for c in coordinates], [c.longitude for c in coordinates]
+        )
+    points = np.column_stack((eastings, northings))
+    for c, easting, northing in zip(coordinates, eastings.tolist(), northings.tolist()):
         c.easting, c.northing = easting, northing
 
     jobs = -1
@@ -150,5 +183,7 @@ def run(min_stop_time_s, coordinates):
     for idx, wc in enumerate(weighted_centers_utm):
         name = f'cluster{idx}'
         easting, northing = wc
-        semantic_locations[name] = utm.to_latlon(easting, northing, utm_zone_number, utm_zone_letter)
+        semantic_locations[name] = utm.to_latlon(
+            easting, northing, geo.projection.zone_num, geo.projection.zone_letter
+        )
     return semantic_locations
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Exact two-cluster K-Means of one-dimensional values without scikit-learn. Once the values are
+# sorted, every clustering worth considering is a split of the sorted values at a threshold, so
+# the within-cluster sum of squares of all splits is found from cumulative sums and the best split
+# is the global optimum that iterative K-Means implementations converge towards.
+import numpy as np
+
+from .kmeans import MAX_AVG_DISTANCE, MIN_STOP_TIME, group_sequentially, relabel_by_stop_time
+from .models import ClusterInfo
+
+
+def format_kmeans_values(coordinates):
+    values = np.fromiter((c.avg_distance_m or 0 for c in coordinates), dtype=np.float64, count=len(coordinates))
+    return np.minimum(values, MAX_AVG_DISTANCE)
+
+
+def fit(values):
+    '''
+    Find the two clusters of one-dimensional values with the least within-cluster sum of squares.
+
+    :param values: The values to cluster.
+
+    :type values: list or `np.array`
+
+    :returns: The lower and upper cluster centers and the cluster label of each value, 0 for the lower
+              and 1 for the upper cluster. All values are labeled 0 when they are the same.
+    :rtype: tuple
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    if count == 0:
+        return None, None, np.zeros(0, dtype=np.int64)
+
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    # centered values keep the cumulative sums of squares from losing precision
+    centered = sorted_values - sorted_values.mean()
+    sums = np.cumsum(centered)
+    squared_sums = np.cumsum(centered ** 2)
+
+    # sum of squares of splitting before each sorted value, only between distinct values
+    lower_counts = np.arange(1, count)
+    lower_sse = squared_sums[:-1] - sums[:-1] ** 2 / lower_counts
+    upper_sums = sums[-1] - sums[:-1]
+    upper_sse = (squared_sums[-1] - squared_sums[:-1]) - upper_sums ** 2 / (count - lower_counts)
+    is_split = sorted_values[1:] > sorted_values[:-1]
+    labels = np.zeros(count, dtype=np.int64)
+    if not is_split.any():
+        center = float(sorted_values.mean())
+        return center, center, labels
+
+    split_counts = lower_counts[is_split]
+    split = int(split_counts[np.argmin((lower_sse + upper_sse)[is_split])])
+    labels[order[split:]] = 1
+    return float(sorted_values[:split].mean()), float(sorted_values[split:].mean()), labels
+
+
+# clusters performed on moving window of average distance between points,
+# it is assumed that trips will be the cluster with greater avg distance
+def label_coordinate_clusters(coordinates, cluster_labels):
+    labels = ['stop', 'trip']
+    for c, num in zip(coordinates, cluster_labels.tolist()):
+        c.kmeans = ClusterInfo(label=labels[num])
+
+
+def run(coordinates):
+    cluster_values = format_kmeans_values(coordinates)
+    _, _, cluster_labels = fit(cluster_values)
+
+    label_coordinate_clusters(coordinates, cluster_labels)
+    cluster_groups, stop_groups = group_sequentially(coordinates)
+    cluster_groups, stop_groups = relabel_by_stop_time(cluster_groups, stop_groups, min_time=MIN_STOP_TIME)
+
+    groups = {'clusters': cluster_groups, 'stops': stop_groups}
+    return groups
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2018
-from datetime import datetime
 import requests
 
 
@@ -20,8 +19,7 @@ class MapMatcherAPI(object):
             latlngs.append("{lon},{lat}".format(lat=c.latitude, lon=c.longitude))
             radiuses.append("{radius}".format(radius=c.h_accuracy))
             # timestamps represented as seconds integers from UNIX epoch
-            timestamp_epoch = int((c.timestamp_UTC - datetime(1970, 1, 1)).total_seconds())
-            timestamps.append(str(timestamp_epoch))
+            timestamps.append(str(int(c.timestamp_epoch)))
 
         latlngs_str = ';'.join(latlngs)
         radiuses_str = ';'.join(radiuses)
@@ -1,2 +1,3 @@
 from . import canue
+from . import incremental
 from . import triplab
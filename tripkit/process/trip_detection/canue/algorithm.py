@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2019
+import itertools
+
 from .location_split import split_by_stop_locations
-from tripkit.models import Trip as LibraryTrip, TripPoint as LibraryTripPoint
+from tripkit.models import Trip as LibraryTrip, TripPoint as LibraryTripPoint, TripPoints as LibraryTripPoints
 from tripkit.utils import geo
 
 
@@ -82,7 +84,7 @@ def make_trips_diary(valid_segments, missing_segments):
     into continuous trip diary.
     '''
     if not missing_segments:
-        return valid_segments
+        return {'trips': valid_segments, 'missing': []}
 
     trips = []
     missing_iter = iter(missing_segments)
@@ -112,9 +114,7 @@ def make_trips_diary(valid_segments, missing_segments):
     return diary
 
 
-def wrap_for_tripkit(diary):
-    tripkit_trips = []
-
+def generate_tripkit_trips(diary):
     for idx, detected_trip in enumerate(diary['trips']):
         trip_num = idx + 1
         if idx in diary['missing']:
@@ -143,26 +143,27 @@ def wrap_for_tripkit(diary):
             )
             trip.points.append(p2)
         else:
-            trip = LibraryTrip(num=trip_num, trip_code=1)
-            trip_distance = 0.0
-            for point in detected_trip:
-                p = LibraryTripPoint(
-                    database_id=None,
-                    latitude=point.latitude,
-                    longitude=point.longitude,
-                    h_accuracy=0.0,
-                    distance_before=point.distance_m,
-                    trip_distance=trip_distance,
-                    period_before=point.duration_s,
-                    timestamp_UTC=point.timestamp_UTC,
-                )
-                trip.points.append(p)
-                trip_distance += point.distance_m
-        tripkit_trips.append(trip)
-    return tripkit_trips
-
-
-def run(cfg, coordinates, locations):
+            distances = [point.distance_m for point in detected_trip]
+            trip_points = LibraryTripPoints(
+                database_id=[None] * len(distances),
+                latitude=[point.latitude for point in detected_trip],
+                longitude=[point.longitude for point in detected_trip],
+                h_accuracy=[0.0] * len(distances),
+                distance_before=distances,
+                # the trip distance of each point is cumulated before its own distance
+                trip_distance=[0.0] + list(itertools.accumulate(distances))[:-1] if distances else [],
+                period_before=[point.duration_s for point in detected_trip],
+                timestamp_UTC=[point.timestamp_UTC for point in detected_trip],
+            )
+            trip = LibraryTrip(num=trip_num, trip_code=1, points=trip_points)
+        yield trip
+
+
+def wrap_for_tripkit(diary):
+    return list(generate_tripkit_trips(diary))
+
+
+def run(cfg, coordinates, locations, stream=False):
     time_segments = split_by_time_gap(coordinates, period_s=cfg.TRIP_DETECTION_BREAK_INTERVAL_SECONDS)
     location_segments = split_by_stop_locations(
         time_segments, locations, period_s=cfg.TRIP_DETECTION_BREAK_INTERVAL_SECONDS
@@ -172,4 +173,6 @@ def run(cfg, coordinates, locations):
     valid_segments = list(filter_too_short_segments(location_segments, min_distance_m=250))
     missing_segments = detect_missing_segments(valid_segments, missing_segment_m=250)
     trips_diary = make_trips_diary(valid_segments, missing_segments)
+    if stream:
+        return generate_tripkit_trips(trips_diary)
     return wrap_for_tripkit(trips_diary)
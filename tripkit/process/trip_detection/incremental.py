@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Incremental trip detection for users with new coordinates. Instead of re-detecting a user's
+# entire history, detection resumes from the last stable boundary of their cached trips: the
+# last break longer than the break interval between two detected (not missing) trips. The trip
+# before the boundary is re-detected as context and the cached trips are only replaced from the
+# boundary onwards when the context trip's end is reproduced; otherwise, all trips are re-detected.
+import itertools
+import logging
+
+
+logger = logging.getLogger('itinerum-tripkit.process.trip_detection.incremental')
+
+
+def is_missing_trip(trip):
+    '''
+    Returns whether a trip is an inferred missing trip (codes 101-199 for the triplab and canue algorithms).
+    '''
+    return 100 < trip.trip_code < 200
+
+
+def find_boundaries(trips, break_interval_seconds):
+    '''
+    Yields the indexes of trips that begin after a break longer than ``break_interval_seconds`` from the
+    previous detected trip, beginning with the latest.
+    '''
+    for idx in range(len(trips) - 1, 0, -1):
+        prev_trip, trip = trips[idx - 1], trips[idx]
+        if is_missing_trip(prev_trip) or is_missing_trip(trip):
+            continue
+        if trip.start.timestamp_epoch - prev_trip.end.timestamp_epoch > break_interval_seconds:
+            yield idx
+
+
+def _same_points(points1, points2):
+    if len(points1) != len(points2):
+        return False
+    for p1, p2 in zip(points1, points2):
+        if (p1.timestamp_UTC, p1.latitude, p1.longitude) != (p2.timestamp_UTC, p2.latitude, p2.longitude):
+            return False
+    return True
+
+
+def align(trips, boundary, detected_trips):
+    '''
+    Returns the index of the detected trip matching the start of the cached trip at ``boundary`` when
+    the trip before it has also been reproduced, otherwise `None`. Since re-detection begins with the
+    trip before the boundary, it may be missing points prepended from the trip before it (such as a
+    cold start point) and only has to match the end of the cached trip.
+    '''
+    context_trip, boundary_trip = trips[boundary - 1], trips[boundary]
+    for idx in range(1, len(detected_trips)):
+        if not _same_points(detected_trips[idx].points[:1], boundary_trip.points[:1]):
+            continue
+        context_points = detected_trips[idx - 1].points
+        if context_points and _same_points(context_points, context_trip.points[-len(context_points) :]):
+            return idx
+
+
+def run(detect, load_coordinates, trips, break_interval_seconds, attempts=3):
+    '''
+    Detects trips over a user's coordinates from the last stable boundary of their cached trips.
+
+    :param detect:                 Function to detect trips from coordinates, such as
+                                   ``functools.partial(algorithm.run, parameters=parameters)``.
+    :param load_coordinates:       Function returning the user's coordinates from a start timestamp
+                                   (inclusive), or all of the user's coordinates for `None`.
+    :param trips:                  The user's cached trips, or their latest trips, from
+                                   :py:meth:`tripkit.database.Database.load_trips`.
+    :param break_interval_seconds: The minimum stop time used by the algorithm to break trips.
+    :param attempts:               Number of boundaries to try before re-detecting all trips.
+
+    :type trips:                   list of :py:class:`tripkit.models.Trip`
+    :type break_interval_seconds:  int
+    :type attempts:                int, optional
+
+    :returns: The detected trips and the number of the first cached trip they replace, which is `None`
+              when all of the user's trips have been detected again.
+    :rtype: tuple
+    '''
+    for boundary in itertools.islice(find_boundaries(trips, break_interval_seconds), attempts):
+        boundary_num = trips[boundary].num
+        detected_trips = detect(load_coordinates(trips[boundary - 1].start_UTC))
+        idx = align(trips, boundary, detected_trips)
+        if idx is None:
+            logger.info(f"Re-detected trips do not align with cached trip {boundary_num}.")
+            continue
+
+        detected_trips = detected_trips[idx:]
+        for num, trip in enumerate(detected_trips, start=boundary_num):
+            trip.num = num
+        logger.info(f"Detected {len(detected_trips)} trips from cached trip {boundary_num}.")
+        return detected_trips, boundary_num
+
+    logger.info("No stable trip boundary found, detecting all trips.")
+    return detect(load_coordinates(None)), None
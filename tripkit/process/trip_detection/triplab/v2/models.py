@@ -18,9 +18,10 @@ class GPSPoint:
         'easting',
         'speed',
         'h_accuracy',
-        'timestamp_UTC',
         'period_before_seconds',
         'distance_before_meters',
+        '_timestamp_UTC',
+        '_timestamp_epoch',
     ]
 
     def __init__(self, *args, **kwargs):
@@ -32,7 +33,8 @@ class GPSPoint:
         self.easting = kwargs['easting']
         self.speed = kwargs['speed']
         self.h_accuracy = kwargs['h_accuracy']
-        self.timestamp_UTC = kwargs['timestamp_UTC']
+        self._timestamp_UTC = kwargs['timestamp_UTC']
+        self._timestamp_epoch = kwargs.get('timestamp_epoch')
 
         # trip attributes
         self.period_before_seconds = kwargs.get('period_before_seconds')
@@ -45,9 +47,21 @@ class GPSPoint:
         if self.distance_before_meters is not None and self.period_before_seconds:
             return self.distance_before_meters / self.period_before_seconds
 
+    @property
+    def timestamp_UTC(self):
+        return self._timestamp_UTC
+
+    # the stored epoch timestamp is discarded when the point's time is changed
+    @timestamp_UTC.setter
+    def timestamp_UTC(self, value):
+        self._timestamp_UTC = value
+        self._timestamp_epoch = None
+
     @property
     def timestamp_epoch(self):
-        return int((self.timestamp_UTC - datetime(1970, 1, 1)).total_seconds())
+        if self._timestamp_epoch is not None:
+            return self._timestamp_epoch
+        return int((self._timestamp_UTC - datetime(1970, 1, 1)).total_seconds())
 
     def __repr__(self):
         return f"<tripkit.process.trip_detection.triplab.v2.models.GPSPoint database_id={self.database_id}>"
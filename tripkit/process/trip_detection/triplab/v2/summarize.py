@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2019
+import numpy as np
 import pytz
-import utm
 
-from .algorithm import distance_m
+from tripkit.utils import geo
 
 
 def run(user, timezone=None):
@@ -21,11 +21,13 @@ def run(user, timezone=None):
     if timezone:
         tz = pytz.timezone(timezone)
 
-    records = []
-    for t in user.trips:
-        t.start.easting, t.start.northing, _, _ = utm.from_latlon(t.start.latitude, t.start.longitude)
-        t.end.easting, t.end.northing, _, _ = utm.from_latlon(t.end.latitude, t.end.longitude)
+    # project all trip starts and ends at once
+    ends = [p for t in user.trips for p in (t.start, t.end)]
+    eastings, northings = geo.projection.project([p.latitude for p in ends], [p.longitude for p in ends])
+    direct_distances = np.sqrt((eastings[1::2] - eastings[::2]) ** 2 + (northings[1::2] - northings[::2]) ** 2)
 
+    records = []
+    for t, direct_distance in zip(user.trips, direct_distances.tolist()):
         r = {
             'uuid': user.uuid,
             'trip_id': t.num,
@@ -36,7 +38,7 @@ def run(user, timezone=None):
             'olon': t.start.longitude,
             'dlat': t.end.latitude,
             'dlon': t.end.longitude,
-            'direct_distance': distance_m(t.start, t.end),
+            'direct_distance': direct_distance,
             'cumulative_distance': t.distance,
         }
         if timezone:
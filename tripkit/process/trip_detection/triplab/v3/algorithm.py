@@ -4,10 +4,12 @@ import copy
 import itertools
 import logging
 import math
-import utm
+import numpy as np
 
-from tripkit.models import Trip as LibraryTrip, TripPoint as LibraryTripPoint
-from .models import GPSPoint, SubwayEntrance, MissingTrip, TripSegment, Trip
+from tripkit.models import Trip as LibraryTrip, TripPoint as LibraryTripPoint, TripPoints as LibraryTripPoints
+from tripkit.utils import geo
+from tripkit.utils.arrays import ArrayRows, is_coordinate_array
+from .models import GPSPoint, MissingTrip, TripSegment, Trip
 from .trip_codes import TRIP_CODES
 
 
@@ -15,23 +17,17 @@ logger = logging.getLogger('itinerum-tripkit.process.trip_detection.triplab.v2')
 
 
 # cast input data as objects
-def generate_subway_entrances(coordinates):
-    '''
-    Find UTM coordinates for subway stations entrances from lat/lon and yield objects.
-    '''
-    entrances = []
-    for c in coordinates:
-        easting, northing, _, _ = utm.from_latlon(c.latitude, c.longitude)
-        entrances.append(SubwayEntrance(latitude=c.latitude, longitude=c.longitude, northing=northing, easting=easting))
-    return entrances
-
-
 def generate_gps_points(coordinates):
     '''
     Find UTM coordinates for user GPS points from lat/lon and yield objects.
     '''
-    for c in coordinates:
-        easting, northing, _, _ = utm.from_latlon(c.latitude, c.longitude)
+    if is_coordinate_array(coordinates):
+        coordinates = ArrayRows(coordinates)
+    coordinates = list(coordinates)
+    eastings, northings = geo.projection.project_ids(
+        [c.id for c in coordinates], [c.latitude for c in coordinates], [c.longitude for c in coordinates]
+    )
+    for c, easting, northing in zip(coordinates, eastings.tolist(), northings.tolist()):
         yield GPSPoint(
             database_id=c.id,
             latitude=c.latitude,
@@ -41,6 +37,7 @@ def generate_gps_points(coordinates):
             speed=c.speed,
             h_accuracy=c.h_accuracy,
             timestamp_UTC=c.timestamp_UTC,
+            timestamp_epoch=c.timestamp_epoch,
         )
 
 
@@ -130,6 +127,149 @@ def break_points_by_collection_pause(points, max_break_period=360):
         return []
 
 
+# vectorized engine: perform casting, cleaning and segmenting of points as array operations
+def generate_point_arrays(coordinates):
+    '''
+    Cast user coordinates to columnar arrays with UTM positions and float epoch timestamps. The
+    original coordinate rows are returned alongside to build objects for the points that are kept.
+    '''
+    if is_coordinate_array(coordinates):
+        eastings, northings = geo.projection.project_ids(
+            coordinates['id'], coordinates['latitude'], coordinates['longitude']
+        )
+        point_arrays = {
+            'easting': eastings,
+            'northing': northings,
+            'h_accuracy': coordinates['h_accuracy'],
+            'epoch': coordinates['timestamp_epoch'].astype(np.float64),
+        }
+        return ArrayRows(coordinates), point_arrays
+
+    rows = list(coordinates)
+    eastings, northings = geo.projection.project_ids(
+        [c.id for c in rows], [c.latitude for c in rows], [c.longitude for c in rows]
+    )
+    timestamps = np.array([c.timestamp_UTC for c in rows], dtype='datetime64[us]')
+    point_arrays = {
+        'easting': eastings,
+        'northing': northings,
+        'h_accuracy': np.array([c.h_accuracy for c in rows], dtype=np.float64),
+        'epoch': timestamps.astype(np.int64) / 1e6,
+    }
+    return rows, point_arrays
+
+
+def filter_by_accuracy_array(arrays, cutoff=30):
+    '''
+    Return the indexes of points that have a reported accuracy within the cutoff value in meters.
+    '''
+    return np.flatnonzero(arrays['h_accuracy'] <= cutoff)
+
+
+def filter_erroneous_distance_array(arrays, idxs, check_speed_kph=60):
+    '''
+    Array version of `filter_erroneous_distance` returning the indexes of the points kept. Each point is
+    tested against the last kept point, so the points are tested in windows that restart from the first
+    dropped point. The window grows while no points are dropped to keep clean data in few array operations.
+    '''
+    if len(idxs) < 3:
+        return idxs
+
+    eastings = arrays['easting'][idxs]
+    northings = arrays['northing'][idxs]
+    epochs = arrays['epoch'][idxs]
+    keep = np.ones(len(idxs), dtype=bool)
+
+    # the first and last points are always kept without filtering
+    last_test_idx = len(idxs) - 1
+    last_kept = 0
+    start = 1
+    window = 64
+    while start < last_test_idx:
+        end = min(start + window, last_test_idx)
+        test = np.arange(start, end)
+        prev = test - 1
+        prev[0] = last_kept
+
+        # find the distance and time passed since previous point was collected
+        a = eastings[test] - eastings[prev]
+        b = northings[test] - northings[prev]
+        distance_from_last_point = np.sqrt(a ** 2 + b ** 2)
+        seconds_since_last_point = epochs[test] - epochs[prev]
+        a = eastings[test + 1] - eastings[prev]
+        b = northings[test + 1] - northings[prev]
+        distance_between_neighbor_points = np.sqrt(a ** 2 + b ** 2)
+
+        # drop point if both speed and distance conditions are met
+        is_moving = (distance_from_last_point != 0) & (seconds_since_last_point != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kph_since_last_point = (distance_from_last_point / seconds_since_last_point) * 3.6
+        drop = (
+            is_moving
+            & (kph_since_last_point >= check_speed_kph)
+            & (distance_between_neighbor_points < distance_from_last_point)
+        )
+        if not drop.any():
+            last_kept = end - 1
+            start = end
+            window = min(window * 2, 65536)
+            continue
+
+        # points before the first dropped point are valid, retest from the following point
+        first_drop = int(np.argmax(drop))
+        drop_idx = test[first_drop]
+        keep[drop_idx] = False
+        if first_drop > 0:
+            last_kept = drop_idx - 1
+        start = drop_idx + 1
+        window = 64
+    return idxs[keep]
+
+
+def break_points_by_collection_pause_array(rows, arrays, idxs, max_break_period=360):
+    '''
+    Array version of `break_points_by_collection_pause` which creates the trip segments from the
+    indexes of the cleaned points with the period and distance before each point pre-calculated.
+    '''
+    if len(idxs) == 0:
+        return []
+
+    eastings = arrays['easting'][idxs]
+    northings = arrays['northing'][idxs]
+    break_periods = np.zeros(len(idxs), dtype=np.float64)
+    break_periods[1:] = np.diff(arrays['epoch'][idxs])
+    break_distances = np.zeros(len(idxs), dtype=np.float64)
+    break_distances[1:] = np.sqrt(np.diff(eastings) ** 2 + np.diff(northings) ** 2)
+    groups = np.cumsum(break_periods > max_break_period)
+
+    segments = []
+    segment_starts = np.flatnonzero(np.diff(groups, prepend=-1))
+    segment_ends = np.append(segment_starts[1:], len(idxs))
+    for start, end in zip(segment_starts.tolist(), segment_ends.tolist()):
+        points = []
+        for i in range(start, end):
+            c = rows[idxs[i]]
+            points.append(
+                GPSPoint(
+                    database_id=c.id,
+                    latitude=c.latitude,
+                    longitude=c.longitude,
+                    northing=float(northings[i]),
+                    easting=float(eastings[i]),
+                    speed=c.speed,
+                    h_accuracy=c.h_accuracy,
+                    timestamp_UTC=c.timestamp_UTC,
+                    timestamp_epoch=c.timestamp_epoch,
+                    period_before_seconds=float(break_periods[i]),
+                    distance_before_meters=float(break_distances[i]),
+                )
+            )
+        segments.append(
+            TripSegment(group=int(groups[start]), period_before_seconds=float(break_periods[start]), points=points)
+        )
+    return segments
+
+
 def initialize_trips(segments):
     '''
     Begin trip contruction by creating a new trip for each segment.
@@ -145,9 +285,15 @@ def find_subway_connections(trips, subway_entrances, buffer_m=200):
     '''
     Look for segments that can be connected by an explained subway trip update the related trip objects.
     '''
+    # find the subway entrances nearest the trip ends and starts between consecutive trips at once
+    trips = list(trips)
+    subway_entrances = subway_entrances_index(subway_entrances)
+    end_entrances = subway_entrances.first_within([t.last_segment.end for t in trips], buffer_m)
+    start_entrances = subway_entrances.first_within([t.first_segment.start for t in trips], buffer_m)
+
     connected_trips = []
     last_trip = None
-    for trip in trips:
+    for idx, trip in enumerate(trips):
         if not last_trip:
             connected_trips.append(trip)
             last_trip = trip
@@ -157,8 +303,8 @@ def find_subway_connections(trips, subway_entrances, buffer_m=200):
         # of the current segment intersect two different subway station entrances.
         end_point = last_trip.last_segment.end
         start_point = trip.first_segment.start
-        end_entrance = points_intersect(subway_entrances, end_point, buffer_m)
-        start_entrance = points_intersect(subway_entrances, start_point, buffer_m)
+        end_entrance = end_entrances[idx - 1]
+        start_entrance = start_entrances[idx]
 
         if end_entrance and start_entrance:
             interval = start_point.timestamp_UTC - end_point.timestamp_UTC
@@ -264,11 +410,17 @@ def infer_missing_trips(trips, subway_entrances, min_trip_m=250, subway_buffer_m
     Determines where the gap between known trips is unexplained and missing trip information
     in the source data can be assumed.
     '''
+    # find the subway entrances nearest the trip ends and starts between consecutive trips at once
+    trips = list(trips)
+    subway_entrances = subway_entrances_index(subway_entrances)
+    end_entrances = subway_entrances.first_within([t.last_segment.end for t in trips], subway_buffer_m)
+    start_entrances = subway_entrances.first_within([t.first_segment.start for t in trips], subway_buffer_m)
+
     missing_trips = []
-    last_trip = None
-    for trip in trips:
+    last_trip, last_idx = None, None
+    for idx, trip in enumerate(trips):
         if not last_trip:
-            last_trip = trip
+            last_trip, last_idx = trip, idx
             continue
 
         last_end_point = last_trip.last_segment.end
@@ -291,8 +443,8 @@ def infer_missing_trips(trips, subway_entrances, min_trip_m=250, subway_buffer_m
             missing_trips.append(m)
         else:
             # 2. check for missing trips that can be explained by a subway trip with loss of signal
-            end_entrance = points_intersect(subway_entrances, last_end_point, subway_buffer_m)
-            start_entrance = points_intersect(subway_entrances, start_point, subway_buffer_m)
+            end_entrance = end_entrances[last_idx]
+            start_entrance = start_entrances[idx]
             if end_entrance and start_entrance and end_entrance != start_entrance:
                 m = MissingTrip(
                     category='subway',
@@ -320,7 +472,7 @@ def infer_missing_trips(trips, subway_entrances, min_trip_m=250, subway_buffer_m
                     duration=interval_prev_trip,
                 )
                 missing_trips.append(m)
-        last_trip = trip
+        last_trip, last_idx = trip, idx
     return missing_trips
 
 
@@ -427,39 +579,35 @@ def distance_m(point1, point2):
     return math.sqrt(a ** 2 + b ** 2)
 
 
-def points_intersect(points, test_point, buffer_m=200):
+def subway_entrances_index(subway_entrances):
     '''
-    Returns the first point that intersects with buffer (m) of a test point.
+    Returns a spatial index of subway entrances, building one when the entrances are not already indexed.
     '''
-    for point in points:
-        if distance_m(point, test_point) <= buffer_m:
-            return point
+    if isinstance(subway_entrances, geo.PointIndex):
+        return subway_entrances
+    return geo.PointIndex(subway_entrances)
 
 
-def wrap_for_tripkit(detected_trips):
+def generate_tripkit_trips(detected_trips):
     '''
-    Return result as the same type of object (list of TripPoints) as returned by `tripkit.database`.
+    Yield results as the same type of object (Trips with columnar points) as returned by `tripkit.database`.
     '''
-    tripkit_trips = []
     for trip_num, detected_trip in enumerate(detected_trips, start=1):
         if isinstance(detected_trip, Trip):
-            trip = LibraryTrip(num=trip_num, trip_code=detected_trip.code)
-            trip_distance = 0.0
-            for segment in detected_trip.segments:
-                for point in segment.points:
-                    trip_distance += point.distance_before_meters
-                    p = LibraryTripPoint(
-                        database_id=point.database_id,
-                        latitude=point.latitude,
-                        longitude=point.longitude,
-                        h_accuracy=point.h_accuracy,
-                        distance_before=point.distance_before_meters,
-                        trip_distance=trip_distance,
-                        period_before=point.period_before_seconds,
-                        timestamp_UTC=point.timestamp_UTC,
-                    )
-                    trip.points.append(p)
-            tripkit_trips.append(trip)
+            points = [point for segment in detected_trip.segments for point in segment.points]
+            distances = [point.distance_before_meters for point in points]
+            trip_points = LibraryTripPoints(
+                database_id=[point.database_id for point in points],
+                latitude=[point.latitude for point in points],
+                longitude=[point.longitude for point in points],
+                h_accuracy=[point.h_accuracy for point in points],
+                distance_before=distances,
+                trip_distance=list(itertools.accumulate(distances)),
+                period_before=[point.period_before_seconds for point in points],
+                timestamp_UTC=[point.timestamp_UTC for point in points],
+                timestamp_epoch=[point.timestamp_epoch for point in points],
+            )
+            yield LibraryTrip(num=trip_num, trip_code=detected_trip.code, points=trip_points)
         elif isinstance(detected_trip, MissingTrip):
             trip = LibraryTrip(num=trip_num, trip_code=detected_trip.code)
             p1 = LibraryTripPoint(
@@ -483,26 +631,123 @@ def wrap_for_tripkit(detected_trips):
                 timestamp_UTC=detected_trip.end.timestamp_UTC,
             )
             trip.points = [p1, p2]
-            tripkit_trips.append(trip)
-    return tripkit_trips
+            yield trip
+
+
+def wrap_for_tripkit(detected_trips):
+    '''
+    Return result as the same type of object (list of Trips with columnar points) as returned by `tripkit.database`.
+    '''
+    return list(generate_tripkit_trips(detected_trips))
 
 
 # main
-def run(coordinates, parameters):
-    if not coordinates or len(coordinates) < 2:
-        return []
+def run(coordinates, parameters, engine='python', stream=False):
+    '''
+    Detect trips from a user's timestamp-ordered coordinates.
+
+    :param coordinates: A user's timestamp-ordered coordinates from the cache database as records
+                        or as an array from :py:meth:`tripkit.database.Database.load_user_arrays`.
+    :param parameters:  Dictionary of trip detection parameters (see README).
+    :param engine:      Supply `numpy` to clean and segment points as array operations
+                        or `python` to process points individually.
+    :param stream:      Supply `True` to return a generator creating each trip as it is consumed, such as
+                        by :py:meth:`tripkit.database.Database.save_trips_stream`.
+
+    :type engine: str, optional
+    :type stream: bool, optional
 
-    # process points as structs and cast position from lat/lng to UTM
-    subway_entrances = generate_subway_entrances(parameters['subway_entrances'])
-    gps_points = generate_gps_points(coordinates)
+    :rtype: list or generator of :py:class:`tripkit.models.Trip`
+    '''
+    if coordinates is None or len(coordinates) < 2:
+        return iter([]) if stream else []
+
+    # index subway entrances once for all trip boundary lookups
+    subway_entrances = subway_entrances_index(parameters['subway_entrances'])
+
+    if engine == 'python':
+        gps_points = generate_gps_points(coordinates)
 
-    # clean noisy and duplicate points
-    high_accuracy_points = filter_by_accuracy(gps_points, cutoff=parameters['accuracy_cutoff_meters'])
-    cleaned_points = filter_erroneous_distance(high_accuracy_points, check_speed_kph=100)
+        # clean noisy and duplicate points
+        high_accuracy_points = filter_by_accuracy(gps_points, cutoff=parameters['accuracy_cutoff_meters'])
+        cleaned_points = filter_erroneous_distance(high_accuracy_points, check_speed_kph=100)
+
+        # break trips into atomic trip segments
+        segments = break_points_by_collection_pause(
+            cleaned_points, max_break_period=parameters['break_interval_seconds']
+        )
+    elif engine == 'numpy':
+        rows, point_arrays = generate_point_arrays(coordinates)
 
-    # break trips into atomic trip segments
-    segments = break_points_by_collection_pause(cleaned_points, max_break_period=parameters['break_interval_seconds'])
+        # clean noisy and duplicate points
+        high_accuracy_idxs = filter_by_accuracy_array(point_arrays, cutoff=parameters['accuracy_cutoff_meters'])
+        cleaned_idxs = filter_erroneous_distance_array(point_arrays, high_accuracy_idxs, check_speed_kph=100)
 
+        # break trips into atomic trip segments
+        segments = break_points_by_collection_pause_array(
+            rows, point_arrays, cleaned_idxs, max_break_period=parameters['break_interval_seconds']
+        )
+    else:
+        raise Exception(f"Trip detection engine not recognized: {engine} Valid options: python, numpy")
+    return detect_trips(segments, subway_entrances, parameters, stream=stream)
+
+
+def run_sweep(coordinates, parameter_sets):
+    '''
+    Detect trips from a user's timestamp-ordered coordinates with each of a list of parameter sets
+    using the `numpy` engine. The coordinates are projected and sorted by accuracy once and the points
+    cleaned for an accuracy cutoff are shared by all parameter sets with that cutoff.
+
+    :param coordinates:    A user's timestamp-ordered coordinates from the cache database as records
+                           or as an array from :py:meth:`tripkit.database.Database.load_user_arrays`.
+    :param parameter_sets: Dictionaries of trip detection parameters (see README).
+
+    :type parameter_sets: list of dict
+
+    :returns: The detected trips for each parameter set in order.
+    :rtype: list
+    '''
+    if coordinates is None or len(coordinates) < 2:
+        return [[] for _ in parameter_sets]
+
+    rows, point_arrays = generate_point_arrays(coordinates)
+    # create the row objects once so they are shared by the points of every parameter set
+    rows = list(rows)
+    accuracy_order = np.argsort(point_arrays['h_accuracy'], kind='stable')
+    sorted_accuracy = point_arrays['h_accuracy'][accuracy_order]
+
+    cleaned_idxs, subway_entrances, results = {}, {}, []
+    for parameters in parameter_sets:
+        cutoff = parameters['accuracy_cutoff_meters']
+        if cutoff not in cleaned_idxs:
+            num_kept = np.searchsorted(sorted_accuracy, cutoff, side='right')
+            high_accuracy_idxs = np.sort(accuracy_order[:num_kept])
+            cleaned_idxs[cutoff] = filter_erroneous_distance_array(
+                point_arrays, high_accuracy_idxs, check_speed_kph=100
+            )
+        entrances_key = id(parameters['subway_entrances'])
+        if entrances_key not in subway_entrances:
+            subway_entrances[entrances_key] = subway_entrances_index(parameters['subway_entrances'])
+
+        # segments are built for each parameter set since trips are modified as they are stitched
+        segments = break_points_by_collection_pause_array(
+            rows, point_arrays, cleaned_idxs[cutoff], max_break_period=parameters['break_interval_seconds']
+        )
+        results.append(detect_trips(segments, subway_entrances[entrances_key], parameters))
+    return results
+
+
+def detect_trips(segments, subway_entrances, parameters, stream=False):
+    '''
+    Detect trips from the atomic trip segments of a user's cleaned points.
+
+    :param segments:         The user's trip segments.
+    :param subway_entrances: Spatial index of subway entrances from `subway_entrances_index`.
+    :param parameters:       Dictionary of trip detection parameters (see README).
+    :param stream:           Supply `True` to return a generator creating each trip as it is consumed.
+
+    :rtype: list or generator of :py:class:`tripkit.models.Trip`
+    '''
     # start by considering every segment a trip
     initial_trips = initialize_trips(segments)
 
@@ -523,7 +768,6 @@ def run(coordinates, parameters):
     )
 
     trips = merge_trips(full_length_trips, missing_trips)
-    tripkit_trips = wrap_for_tripkit(annotate_trips(trips))
 
     logger.info("-------------------------------")
     logger.info("Num. segments: %d", len(segments))
@@ -531,5 +775,9 @@ def run(coordinates, parameters):
     logger.info("Num. trips (w/ velocity links): %d", len(velocity_linked_trips))
     logger.info("Num. full-length trips: %d", len(full_length_trips))
     logger.info("Num. missing trips: %d", len(missing_trips))
+    if stream:
+        return generate_tripkit_trips(annotate_trips(trips))
+
+    tripkit_trips = wrap_for_tripkit(annotate_trips(trips))
     logger.info("Num. point rows: %d", sum([len(t.points) for t in tripkit_trips]))
     return tripkit_trips
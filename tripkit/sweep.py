@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# This module runs trip detection for a grid of parameter sets across a pool of worker
+# processes. Each user's coordinates are loaded and projected once for all parameter sets
+# and the per-set trip and complete day counts are tallied into a table by the parent.
+import itertools
+import logging
+import multiprocessing
+import os
+
+from . import process
+from .database import Database
+from .pipeline import config_snapshot
+from .process.trip_detection.triplab.v3 import algorithm as triplab_v3_algorithm
+from .utils import geo
+
+
+logger = logging.getLogger('itinerum-tripkit.sweep')
+
+# config settings that can be swept mapped to their trip detection parameter names
+SWEEP_PARAMETERS = {
+    'TRIP_DETECTION_BREAK_INTERVAL_SECONDS': 'break_interval_seconds',
+    'TRIP_DETECTION_SUBWAY_BUFFER_METERS': 'subway_buffer_meters',
+    'TRIP_DETECTION_COLD_START_DISTANCE_METERS': 'cold_start_distance',
+    'TRIP_DETECTION_ACCURACY_CUTOFF_METERS': 'accuracy_cutoff_meters',
+}
+
+# per-process state initialized once for each worker
+_worker = {}
+
+
+def parameter_grid(config, grid):
+    '''
+    Expand a grid of config setting values to a list of parameter sets of every combination. Settings
+    missing from the grid are held at their config values.
+
+    :param config: The tripkit config module or class.
+    :param grid:   Dictionary of lists of values by config setting name.
+
+    :type grid: dict
+
+    :rtype: list of dict
+    '''
+    for key in grid:
+        if key not in SWEEP_PARAMETERS:
+            valid_options = ', '.join(SWEEP_PARAMETERS.keys())
+            raise Exception(f"Sweep parameter not recognized: {key} Valid options: {valid_options}")
+
+    keys = list(SWEEP_PARAMETERS.keys())
+    values = [list(grid.get(key, [getattr(config, key)])) for key in keys]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def init_worker(config, options):
+    '''
+    Open a read connection to the cache database within a worker process and build the trip
+    detection parameters of each parameter set.
+    '''
+    database = Database(config)
+    geo.projection.reset(
+        zone_num=getattr(config, 'UTM_ZONE_NUMBER', None), zone_letter=getattr(config, 'UTM_ZONE_LETTER', None)
+    )
+    subway_entrances = database.load_subway_entrances(spatial_index=True)
+    _worker['config'] = config
+    _worker['database'] = database
+    _worker['options'] = options
+    _worker['parameters'] = []
+    for parameter_set in options['parameter_sets']:
+        parameters = {SWEEP_PARAMETERS[key]: value for key, value in parameter_set.items()}
+        parameters['subway_entrances'] = subway_entrances
+        _worker['parameters'].append(parameters)
+
+
+def sweep_user(task):
+    '''
+    Detect a user's trips with each of the task's parameter sets and count their trips,
+    missing trips and complete days.
+    '''
+    uuid, set_idxs = task
+    config, database, options = _worker['config'], _worker['database'], _worker['options']
+    user = database.load_user(uuid, start=options['start'], end=options['end'])
+    coordinates = database.load_user_arrays(user, start=options['start'], end=options['end'])
+    if len(coordinates) == 0:
+        return uuid, None
+
+    parameter_sets = [_worker['parameters'][idx] for idx in set_idxs]
+    counts = []
+    for idx, trips in zip(set_idxs, triplab_v3_algorithm.run_sweep(coordinates, parameter_sets)):
+        num_missing = sum(1 for t in trips if process.trip_detection.incremental.is_missing_trip(t))
+        days = process.complete_days.triplab.counter.run(trips, config.TIMEZONE) or []
+        num_complete = sum(1 for d in days if d.is_complete)
+        counts.append((idx, len(trips) - num_missing, num_missing, len(days), num_complete))
+    return uuid, counts
+
+
+def tasks(uuids, parameter_sets, workers):
+    '''
+    Split the sweep into tasks of a user and parameter set indexes. When there are fewer users
+    than workers, each user's parameter sets are split by accuracy cutoff to use the idle workers.
+    '''
+    all_idxs = list(range(len(parameter_sets)))
+    if len(uuids) >= workers:
+        return [(uuid, all_idxs) for uuid in uuids]
+
+    cutoff_key = 'TRIP_DETECTION_ACCURACY_CUTOFF_METERS'
+    by_cutoff = {}
+    for idx in all_idxs:
+        by_cutoff.setdefault(parameter_sets[idx][cutoff_key], []).append(idx)
+    return [(uuid, set_idxs) for uuid in uuids for set_idxs in by_cutoff.values()]
+
+
+def run(tripkit, uuids, grid, workers=None, start=None, end=None):
+    '''
+    Detect trips for users with every combination of a grid of parameters across a pool of worker
+    processes and tally the results for each parameter set.
+
+    :param tripkit: The :py:class:`tripkit.TripKit` instance with the cache database to read users from.
+    :param uuids:   The users' UUIDs to process.
+
+    See :py:meth:`tripkit.TripKit.run_sweep` for the remaining parameters.
+
+    :rtype: list of dict
+    '''
+    config = config_snapshot(tripkit.config)
+    parameter_sets = parameter_grid(config, grid)
+    options = {'parameter_sets': parameter_sets, 'start': start, 'end': end}
+
+    table = []
+    for parameter_set in parameter_sets:
+        row = dict(parameter_set)
+        row.update({'users': 0, 'trips': 0, 'missing_trips': 0, 'days': 0, 'complete_days': 0})
+        table.append(row)
+
+    workers = workers or os.cpu_count()
+    sweep_tasks = tasks(uuids, parameter_sets, workers)
+    workers = min(workers, len(sweep_tasks)) or 1
+    logger.info(f"Sweeping {len(parameter_sets)} parameter sets for {len(uuids)} users with {workers} workers...")
+
+    # close the parent's connection so it is not shared with forked workers
+    tripkit.database.db.close()
+    if workers == 1:
+        init_worker(config, options)
+        task_results = map(sweep_user, sweep_tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(config, options))
+        task_results = pool.imap_unordered(sweep_user, sweep_tasks)
+
+    swept_users = [set() for _ in parameter_sets]
+    try:
+        for uuid, counts in task_results:
+            if not counts:
+                continue
+            for idx, num_trips, num_missing, num_days, num_complete in counts:
+                row = table[idx]
+                swept_users[idx].add(uuid)
+                row['trips'] += num_trips
+                row['missing_trips'] += num_missing
+                row['days'] += num_days
+                row['complete_days'] += num_complete
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    for row, users in zip(table, swept_users):
+        row['users'] = len(users)
+        row['complete_day_ratio'] = row['complete_days'] / row['days'] if row['days'] else None
+    return table
@@ -1,3 +1,5 @@
+from . import arrays
+from . import cache
 from . import calc
 from . import datetime
 from . import geo
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# Helpers for the columnar coordinates arrays returned by `Database.load_user_arrays`
+from datetime import datetime, timedelta
+import math
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1)
+
+# columns of a user's coordinates array in the order selected from the cache database
+COORDINATE_DTYPE = np.dtype(
+    [
+        ('id', np.int64),
+        ('latitude', np.float64),
+        ('longitude', np.float64),
+        ('altitude', np.float64),
+        ('speed', np.float64),
+        ('h_accuracy', np.float64),
+        ('timestamp_epoch', np.int64),
+    ]
+)
+
+
+def is_coordinate_array(coordinates):
+    '''
+    Returns whether coordinates have been loaded as a structured array instead of database records.
+    '''
+    return isinstance(coordinates, np.ndarray)
+
+
+def _none_if_nan(value):
+    if math.isnan(value):
+        return None
+    return value
+
+
+class ArrayCoordinate(object):
+    '''
+    A row of a coordinates array with attribute access like a cache database coordinate record.
+    The datetime is only created from the epoch timestamp when first accessed.
+    '''
+
+    __slots__ = [
+        'id',
+        'uuid',
+        'latitude',
+        'longitude',
+        'altitude',
+        'speed',
+        'h_accuracy',
+        'timestamp_epoch',
+        'easting',
+        'northing',
+        '_timestamp_UTC',
+    ]
+
+    def __init__(self, id, latitude, longitude, altitude, speed, h_accuracy, timestamp_epoch):
+        self.id = id
+        self.uuid = None
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = _none_if_nan(altitude)
+        self.speed = _none_if_nan(speed)
+        self.h_accuracy = _none_if_nan(h_accuracy)
+        self.timestamp_epoch = timestamp_epoch
+        self.easting = None
+        self.northing = None
+        self._timestamp_UTC = None
+
+    @property
+    def timestamp_UTC(self):
+        if self._timestamp_UTC is None:
+            self._timestamp_UTC = EPOCH + timedelta(seconds=self.timestamp_epoch)
+        return self._timestamp_UTC
+
+    def __repr__(self):
+        return f"<tripkit.utils.arrays.ArrayCoordinate id={self.id}>"
+
+
+class ArrayRows(object):
+    '''
+    Sequence of a coordinates array's rows that are only created as objects when accessed.
+
+    :param coordinates: A user's coordinates array.
+
+    :type coordinates: numpy.ndarray
+    '''
+
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __getitem__(self, idx):
+        return ArrayCoordinate(*self.coordinates[idx].item())
+
+    def __iter__(self):
+        for values in self.coordinates.tolist():
+            yield ArrayCoordinate(*values)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2019
+#
+# On-disk cache of processing stage results. Results are addressed by a key made from the
+# package and stage versions, the stage's name, the user, a fingerprint of the stage's input
+# data and its parameters so stages are only run again when one of these has changed. Chained
+# stages use the key of the stage before them as their input fingerprint.
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import zlib
+
+from peewee import SQL, fn
+
+from .arrays import is_coordinate_array
+from .misc import temp_path
+
+
+logger = logging.getLogger('itinerum-tripkit.utils.cache')
+
+# marks a key missing from the cache, since stages may return `None` as results
+MISSING = object()
+
+
+def package_version():
+    '''
+    Returns the installed version of itinerum-tripkit or `None` when running from an uninstalled source tree.
+    '''
+    try:
+        from importlib import metadata
+
+        return metadata.version('itinerum-tripkit')
+    except ImportError:
+        return None
+
+
+PACKAGE_VERSION = package_version()
+
+
+def fingerprint(coordinates):
+    '''
+    Returns the count, maximum id and maximum epoch timestamp of a user's coordinates to identify
+    the input data of a processing stage. Queries of the cache database are fingerprinted within SQL.
+
+    :param coordinates: A user's coordinates as a database query, an array from
+                        :py:meth:`tripkit.database.Database.load_user_arrays` or an iterable of points.
+
+    :rtype: tuple
+    '''
+    if is_coordinate_array(coordinates):
+        if not len(coordinates):
+            return (0, None, None)
+        return (len(coordinates), int(coordinates['id'].max()), int(coordinates['timestamp_epoch'].max()))
+    if hasattr(coordinates, 'select_from'):
+        query = coordinates.select_from(
+            fn.COUNT(SQL('*')), fn.MAX(coordinates.c.id), fn.MAX(coordinates.c.timestamp_epoch)
+        )
+        return tuple(query.tuples()[0])
+
+    count, max_id, max_epoch = 0, None, None
+    for c in coordinates:
+        count += 1
+        c_id, c_epoch = getattr(c, 'id', None), getattr(c, 'timestamp_epoch', None)
+        if c_id is not None and (max_id is None or c_id > max_id):
+            max_id = c_id
+        if c_epoch is not None and (max_epoch is None or c_epoch > max_epoch):
+            max_epoch = c_epoch
+    return (count, max_id, max_epoch)
+
+
+class StageCache(object):
+    '''
+    Stores the results of processing stages as compressed pickles in the temporary directory and
+    removes the least recently used results when the cache grows larger than ``max_size_mb``.
+
+    Stage results are looked up by key::
+
+        fp = tripkit.cache.fingerprint(user.coordinates)
+        key = tripkit.cache.key('canue.preprocess', user.uuid, fp)
+        prepared_coordinates = tripkit.cache.fetch(key, tripkit.process.canue.preprocess.run,
+                                                   user.uuid, user.coordinates)
+        kmeans_key = tripkit.cache.key('clustering.kmeanspp', user.uuid, key)
+        kmeans_groups = tripkit.cache.fetch(kmeans_key, tripkit.process.clustering.kmeanspp.run,
+                                            prepared_coordinates)
+
+    :param max_size_mb: The maximum total size of the cached results in megabytes.
+    :param dirname:     The name of the cache directory within the temporary directory.
+
+    :type max_size_mb:  int, optional
+    :type dirname:      str, optional
+    '''
+
+    def __init__(self, max_size_mb=1024, dirname='stage_cache'):
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.dirname = dirname
+
+    fingerprint = staticmethod(fingerprint)
+
+    @property
+    def directory(self):
+        cache_dir = temp_path(self.dirname)
+        if not os.path.exists(cache_dir):
+            os.mkdir(cache_dir)
+        return cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl.z')
+
+    def key(self, stage, uuid, inputs, params=None, version=None):
+        '''
+        Returns the cache key of a stage's results. Keys include the installed package version so
+        results are not reused after upgrading the library.
+
+        :param stage:   The name of the processing stage.
+        :param uuid:    The user's UUID.
+        :param inputs:  The input data fingerprint or the key of the stage the input data was returned from.
+        :param params:  The stage's parameters.
+        :param version: The stage's version, change to invalidate results of stages not versioned with the library.
+
+        :type stage:    str
+        :type params:   dict, optional
+        :type version:  str, optional
+
+        :rtype: str
+        '''
+        params = sorted((params or {}).items())
+        content = repr((PACKAGE_VERSION, stage, version, str(uuid), inputs, params))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, key, default=None):
+        '''
+        Returns the cached stage results for a key or ``default`` if not found.
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_f:
+                data = cache_f.read()
+        except FileNotFoundError:
+            return default
+        # mark as recently used for eviction
+        os.utime(path)
+        return pickle.loads(zlib.decompress(data))
+
+    def set(self, key, value):
+        '''
+        Stores stage results for a key and evicts the least recently used results when over the size limit.
+        '''
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as cache_f:
+            cache_f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 3))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def fetch(self, key, func, *args, **kwargs):
+        '''
+        Returns the cached stage results for a key, otherwise runs the stage function with the supplied
+        arguments and caches its results.
+        '''
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = func(*args, **kwargs)
+            self.set(key, value)
+        else:
+            logger.info(f"Loaded cached results for {getattr(func, '__module__', func)}.")
+        return value
+
+    def evict(self):
+        '''
+        Removes the least recently used results until the cache is within its size limit.
+        '''
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.pkl.z'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        '''
+        Removes all cached stage results.
+        '''
+        shutil.rmtree(self.directory)
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2019
+from collections import deque
+
+import numpy as np
 
 
 def average(nums):
@@ -10,16 +13,77 @@ def average(nums):
             raise TypeError(f"all elements of input list must be numeric: {nums}")
 
 
+def rolling_sum(values, size):
+    '''
+    Returns the sum of every window of consecutive values from a cumulative sum, where the sum at
+    index `i` is of the values from `i` to `i + size - 1`.
+
+    :param values: Numeric values.
+    :param size:   The number of values in each window.
+
+    :type values:  list or numpy.ndarray
+    :type size:    int
+
+    :returns: The ``len(values) - size + 1`` window sums, which is empty when there are fewer values
+              than the window size.
+    :rtype: numpy.ndarray
+    '''
+    if size < 0:
+        raise ValueError(f"rolling window size must not be negative: {size}")
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < size:
+        return np.empty(0, dtype=np.float64)
+    if not len(values):
+        return np.zeros(1, dtype=np.float64)
+    # sum the differences from the mean so rounding errors do not grow with the cumulative total
+    mean = values.mean()
+    cumsum = np.empty(len(values) + 1, dtype=np.float64)
+    cumsum[0] = 0.0
+    np.cumsum(values - mean, out=cumsum[1:])
+    return cumsum[size:] - cumsum[: len(cumsum) - size] + size * mean
+
+
+def rolling_mean(values, size):
+    '''
+    Returns the mean of every window of consecutive values, indexed as for `rolling_sum`.
+
+    :rtype: numpy.ndarray
+    '''
+    return rolling_sum(values, size) / size
+
+
+def rolling_std(values, size, ddof=0):
+    '''
+    Returns the standard deviation of every window of consecutive values, indexed as for `rolling_sum`.
+
+    :param values: Numeric values.
+    :param size:   The number of values in each window.
+    :param ddof:   Delta degrees of freedom of the divisor ``size - ddof``, as for `numpy.std`.
+
+    :type values:  list or numpy.ndarray
+    :type size:    int
+    :type ddof:    int, optional
+
+    :rtype: numpy.ndarray
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < size:
+        return np.empty(0, dtype=np.float64)
+    # center the values to limit precision lost between the sums of values and of squares
+    centered = values - values.mean()
+    sums = rolling_sum(centered, size)
+    squares = rolling_sum(centered ** 2, size)
+    variance = (squares - sums ** 2 / size) / (size - ddof)
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
 class RollingWindow(object):
     def __init__(self, size=5):
-        self.values = []
+        self.values = deque(maxlen=size)
         self.size = size
 
     def add(self, v):
-        if len(self.values) < self.size:
-            self.values.append(v)
-        else:
-            self.values = self.values[1:] + [v]
+        self.values.append(v)
 
     def average(self):
         if len(self.values) >= self.size:
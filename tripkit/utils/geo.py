@@ -1,8 +1,14 @@
 #!/usr/bin/env python
 # Based upon GERT 1.2 (2016-06-03): GIS-based Episode Reconstruction Toolkit
 # Ported to itinerum-tripkit by Kyle Fitzsimmons, 2019
+import itertools
 import math
+import numpy as np
 import utm
+from collections import OrderedDict
+
+from .misc import LazyLoader
+spatial = LazyLoader('spatial', globals(), 'scipy.spatial')
 
 
 class Centroid(object):
@@ -29,6 +35,290 @@ class Centroid(object):
         return self._latlon[1]
 
 
+class UTMProjection(object):
+    '''
+    Projects latitudes and longitudes to UTM eastings and northings as whole arrays within a single
+    UTM zone fixed for the survey. The zone is taken from the first point projected when it is not
+    provided. Projected positions of database coordinates are cached by coordinate id so that later
+    processing stages can reuse them instead of reprojecting. The coordinates of each call, usually a
+    single user's, are cached together and the least recently used are evicted when the cache is full.
+
+    :param zone_num:    (Optional) The UTM zone number to project all points within.
+    :param zone_letter: (Optional) The UTM zone letter to project all points within.
+    :param cache_size:  (Optional) The maximum number of projected coordinates to keep cached.
+
+    :type zone_num:    int, optional
+    :type zone_letter: str, optional
+    :type cache_size:  int, optional
+    '''
+
+    def __init__(self, zone_num=None, zone_letter=None, cache_size=5000000):
+        self.cache_size = cache_size
+        self.reset(zone_num, zone_letter)
+
+    def reset(self, zone_num=None, zone_letter=None):
+        '''
+        Set the UTM zone for a new survey and empty the cache of projected coordinates.
+        '''
+        self.zone_num = zone_num
+        self.zone_letter = zone_letter
+        self.clear()
+
+    def clear(self):
+        '''
+        Empty the cache of projected coordinates.
+        '''
+        # blocks of (sorted ids, eastings, northings) in least recently used order
+        self._blocks = OrderedDict()
+        self._block_num = 0
+        self._size = 0
+
+    def project(self, latitudes, longitudes):
+        '''
+        Return arrays of UTM eastings and northings for arrays of latitudes and longitudes.
+        '''
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if not latitudes.size:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        if self.zone_num is None:
+            self.zone_num = utm.latlon_to_zone_number(latitudes[0], longitudes[0])
+        if self.zone_letter is None:
+            self.zone_letter = utm.latitude_to_zone_letter(latitudes[0])
+        eastings, northings, _, _ = utm.from_latlon(latitudes, longitudes, force_zone_number=self.zone_num)
+        return np.asarray(eastings, dtype=np.float64), np.asarray(northings, dtype=np.float64)
+
+    def scale_factors(self, latitudes, longitudes):
+        '''
+        Return an array of the projection's point scale factors, the ratio of projected to true distances
+        near each point. Scale factors are 0.9996 at the central meridian of the projection's zone and grow
+        with the distance of points from it, exceeding 1.01 at 45 degrees latitude and 10 degrees longitude
+        from the central meridian of a zone as points are forced into the survey's zone.
+        '''
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if not latitudes.size:
+            return np.empty(0, dtype=np.float64)
+        if self.zone_num is None:
+            self.zone_num = utm.latlon_to_zone_number(latitudes[0], longitudes[0])
+
+        # series for the transverse Mercator point scale factor (Snyder, 1987, eq. 8-11)
+        central_longitude = utm.zone_number_to_central_longitude(self.zone_num)
+        delta_longitudes = np.radians((longitudes - central_longitude + 180) % 360 - 180)
+        latitudes = np.radians(latitudes)
+        ep2 = utm.conversion.E_P2
+        c = ep2 * np.cos(latitudes) ** 2
+        t = np.tan(latitudes) ** 2
+        a = np.cos(latitudes) * delta_longitudes
+        return utm.conversion.K0 * (
+            1
+            + (1 + c) * a ** 2 / 2
+            + (5 - 4 * t + 42 * c + 13 * c ** 2 - 28 * ep2) * a ** 4 / 24
+            + (61 - 148 * t + 16 * t ** 2) * a ** 6 / 720
+        )
+
+    def project_point(self, latitude, longitude):
+        '''
+        Return the UTM easting and northing for a single latitude and longitude.
+        '''
+        eastings, northings = self.project([latitude], [longitude])
+        return float(eastings[0]), float(northings[0])
+
+    def project_ids(self, ids, latitudes, longitudes):
+        '''
+        Return arrays of UTM eastings and northings for database coordinates, projecting only
+        the coordinates that have not already been cached by id.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        eastings = np.empty(ids.size, dtype=np.float64)
+        northings = np.empty(ids.size, dtype=np.float64)
+        if not ids.size:
+            return eastings, northings
+
+        # look up previously projected coordinates in the cached blocks overlapping the ids
+        min_id, max_id = ids.min(), ids.max()
+        block_nums = [
+            num for num, (block_ids, _, _) in self._blocks.items() if block_ids[0] <= max_id and block_ids[-1] >= min_id
+        ]
+        is_cached = np.zeros(ids.size, dtype=bool)
+        for num in block_nums:
+            block_ids, block_eastings, block_northings = self._blocks[num]
+            positions = np.searchsorted(block_ids, ids)
+            positions[positions == block_ids.size] = 0
+            in_block = block_ids[positions] == ids
+            eastings[in_block] = block_eastings[positions[in_block]]
+            northings[in_block] = block_northings[positions[in_block]]
+            is_cached |= in_block
+            self._blocks.move_to_end(num)
+
+        # project remaining coordinates and merge them into the cache with the overlapping blocks
+        is_missing = ~is_cached
+        if is_missing.any():
+            latitudes = np.asarray(latitudes, dtype=np.float64)[is_missing]
+            longitudes = np.asarray(longitudes, dtype=np.float64)[is_missing]
+            eastings[is_missing], northings[is_missing] = self.project(latitudes, longitudes)
+            self._add(block_nums, ids[is_missing], eastings[is_missing], northings[is_missing])
+        return eastings, northings
+
+    def _add(self, block_nums, ids, eastings, northings):
+        ids, unique_idxs = np.unique(ids, return_index=True)
+        eastings, northings = eastings[unique_idxs], northings[unique_idxs]
+        for num in block_nums:
+            block_ids, block_eastings, block_northings = self._blocks.pop(num)
+            self._size -= block_ids.size
+            # merge the new sorted ids into the block's sorted ids
+            positions = np.searchsorted(block_ids, ids)
+            ids = np.insert(block_ids, positions, ids)
+            eastings = np.insert(block_eastings, positions, eastings)
+            northings = np.insert(block_northings, positions, northings)
+        if ids.size > self.cache_size:
+            return
+
+        self._block_num += 1
+        self._blocks[self._block_num] = (ids, eastings, northings)
+        self._size += ids.size
+        while self._size > self.cache_size:
+            _, (evicted_ids, _, _) = self._blocks.popitem(last=False)
+            self._size -= evicted_ids.size
+
+
+# shared projection for the survey currently loaded by TripKit
+projection = UTMProjection()
+
+
+class PointIndex(object):
+    '''
+    KD-tree index of points with latitude and longitude attributes for finding the points within a
+    buffer distance of many test points at once. Points are projected with the survey's shared
+    projection and returned as the original objects.
+
+    :param points: Iterable of objects with `latitude` and `longitude` attributes to index.
+    '''
+
+    def __init__(self, points):
+        self.points = list(points)
+        self.eastings, self.northings = projection.project(
+            [p.latitude for p in self.points], [p.longitude for p in self.points]
+        )
+        self._tree = None
+        if self.points:
+            self._tree = spatial.cKDTree(np.column_stack((self.eastings, self.northings)))
+
+    def __len__(self):
+        return len(self.points)
+
+    def first_within(self, test_points, buffer_m):
+        '''
+        Return the first indexed point, in the original input order, that is within the buffer
+        distance in meters of each test point with `easting` and `northing` attributes. Test points
+        without an indexed point within the buffer are matched to `None`.
+        '''
+        test_points = list(test_points)
+        if not self._tree or not test_points:
+            return [None] * len(test_points)
+        eastings = np.array([p.easting for p in test_points], dtype=np.float64)
+        northings = np.array([p.northing for p in test_points], dtype=np.float64)
+
+        # widen the tree search slightly and confirm candidates with the exact cartesian distance
+        candidates = self._tree.query_ball_point(np.column_stack((eastings, northings)), r=buffer_m * (1 + 1e-9) + 1e-6)
+        matches = []
+        for easting, northing, idxs in zip(eastings, northings, candidates):
+            match = None
+            if idxs:
+                idxs = np.sort(idxs)
+                a = easting - self.eastings[idxs]
+                b = northing - self.northings[idxs]
+                within = np.flatnonzero(np.sqrt(a ** 2 + b ** 2) <= buffer_m)
+                if within.size:
+                    match = self.points[idxs[within[0]]]
+            matches.append(match)
+        return matches
+
+
+class ActivityLocationIndex(PointIndex):
+    '''
+    KD-tree index of activity locations for labeling many points with the locations within a buffer
+    distance of them. Candidate locations are found around the projected points with a widened search
+    and confirmed by their Haversine distance, so labels match testing each point against every location.
+
+    :param locations: Iterable of activity locations with `latitude`, `longitude` and `label` attributes.
+    '''
+
+    # relative tolerance for scale factors varying between a point and the locations within its buffer
+    SEARCH_TOLERANCE = 0.005
+
+    def __init__(self, locations):
+        super().__init__(locations)
+        self.latitudes = np.array([loc.latitude for loc in self.points], dtype=np.float64)
+        self.longitudes = np.array([loc.longitude for loc in self.points], dtype=np.float64)
+
+    def match_idxs(self, latitudes, longitudes, buffer_m, last=False):
+        '''
+        Return the index of the first location, or the last when `last` is set, in the original input order
+        that is within the buffer distance in meters of each test coordinate or -1 when none are.
+
+        :rtype: numpy.ndarray
+        '''
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        matches = np.full(len(latitudes), -1, dtype=np.int64)
+        if not self._tree or not len(latitudes):
+            return matches
+
+        # projected distances are longer than true distances by up to the largest point scale factor, which
+        # exceeds 1 for points forced into the survey's zone from far outside of it, and
+        # `haversine_distance_array` scales north-south distances by the cosine of latitude, so projected
+        # distances can be longer than Haversine distances by up to the inverse of the cosine
+        max_scale = max(
+            projection.scale_factors(latitudes, longitudes).max(),
+            projection.scale_factors(self.latitudes, self.longitudes).max(),
+        )
+        max_latitude = max(np.abs(latitudes).max(), np.abs(self.latitudes).max())
+        cosine = max(math.cos(math.radians(max_latitude)), 1e-6)
+        radius = buffer_m * max_scale * (1 + self.SEARCH_TOLERANCE) / cosine + 1
+        eastings, northings = projection.project(latitudes, longitudes)
+        candidates = self._tree.query_ball_point(np.column_stack((eastings, northings)), r=radius)
+        num_candidates = np.fromiter((len(idxs) for idxs in candidates), dtype=np.int64, count=len(candidates))
+        rows = np.repeat(np.arange(len(latitudes)), num_candidates)
+        cols = np.fromiter(itertools.chain.from_iterable(candidates), dtype=np.int64, count=num_candidates.sum())
+        distances = haversine_distance_array(
+            latitudes[rows], longitudes[rows], self.latitudes[cols], self.longitudes[cols]
+        )
+        within = distances <= buffer_m
+        rows, cols = rows[within], cols[within]
+        if last:
+            np.maximum.at(matches, rows, cols)
+        else:
+            matches[:] = len(self.points)
+            np.minimum.at(matches, rows, cols)
+            matches[matches == len(self.points)] = -1
+        return matches
+
+    def labels(self, points, buffer_m, last=False):
+        '''
+        Return the label of the first location, or the last when `last` is set, within the buffer distance
+        in meters of each point with `latitude` and `longitude` attributes or `None` when none are.
+
+        :rtype: list
+        '''
+        points = list(points)
+        latitudes = [p.latitude for p in points]
+        longitudes = [p.longitude for p in points]
+        return [
+            self.points[idx].label if idx != -1 else None
+            for idx in self.match_idxs(latitudes, longitudes, buffer_m, last=last).tolist()
+        ]
+
+
+def activity_location_index(locations):
+    '''
+    Returns a spatial index of activity locations, building one when the locations are not already indexed.
+    '''
+    if isinstance(locations, ActivityLocationIndex):
+        return locations
+    return ActivityLocationIndex(locations)
+
+
 def duration_s(coordinate1, coordinate2):
     '''
     Return the duration in seconds between two coordinate records.
@@ -36,9 +326,32 @@ def duration_s(coordinate1, coordinate2):
     return int((coordinate2.timestamp_UTC - coordinate1.timestamp_UTC).total_seconds())
 
 
+def haversine_distance_array(latitudes1, longitudes1, latitudes2, longitudes2):
+    '''
+    Return the Haversine distances in meters between two sets of coordinates. Inputs are broadcast
+    against each other, so coordinates can be compared pairwise as arrays of the same length, one-to-many
+    with a single coordinate and an array, or all-to-all with column and row arrays (e.g.,
+    ``latitudes[:, None]`` against location latitudes) returning a matrix of distances.
+
+    :rtype: numpy.ndarray
+    '''
+    latitudes1, longitudes1 = np.asarray(latitudes1, dtype=np.float64), np.asarray(longitudes1, dtype=np.float64)
+    latitudes2, longitudes2 = np.asarray(latitudes2, dtype=np.float64), np.asarray(longitudes2, dtype=np.float64)
+    dlat = np.radians(latitudes2 - latitudes1)
+    dlon = np.radians(longitudes2 - longitudes1)
+    lat1 = np.radians(latitudes1)
+    lat2 = np.radians(latitudes2)
+    a1 = np.sin(dlat / 2) * np.sin(dlat / 2) + np.sin(dlon / 2) * np.sin(dlon / 2)
+    a2 = np.cos(lat1) * np.cos(lat2)
+    a = a1 * a2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return 6371 * c * 1000
+
+
 def haversine_distance_m(coordinate1, coordinate2):
     '''
-    Return the Haversine distance between two coordinates.
+    Return the Haversine distance between two coordinates. Uses the same formula as
+    `haversine_distance_array` with scalar math for calls on single coordinate pairs.
     '''
     dlat = math.radians(coordinate2.latitude - coordinate1.latitude)
     dlon = math.radians(coordinate2.longitude - coordinate1.longitude)
@@ -60,6 +373,22 @@ def distance_m(coordinate1, coordinate2):
     return math.sqrt(a ** 2 + b ** 2)
 
 
+def bearing_array(latitudes1, longitudes1, latitudes2, longitudes2):
+    '''
+    Return the trajectory bearings in degrees from one set of coordinates to another, with inputs
+    broadcast as for `haversine_distance_array`.
+
+    :rtype: numpy.ndarray
+    '''
+    lat1 = np.radians(np.asarray(latitudes1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(latitudes2, dtype=np.float64))
+    dlon = np.radians(np.asarray(longitudes2, dtype=np.float64) - np.asarray(longitudes1, dtype=np.float64))
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    bearings = np.degrees(np.arctan2(y, x))
+    return (bearings + 360) % 360
+
+
 def bearing(coordinate1, coordinate2):
     '''
     Return the trajectory bearing between two coordinates.
@@ -73,6 +402,18 @@ def bearing(coordinate1, coordinate2):
     return (bearing + 360) % 360
 
 
+def delta_heading_array(bearings1, bearings2):
+    '''
+    Return the changes in user heading between two sets of bearings, with inputs broadcast as for
+    `haversine_distance_array`.
+
+    :rtype: numpy.ndarray
+    '''
+    delta1 = np.abs(np.asarray(bearings1, dtype=np.float64) - np.asarray(bearings2, dtype=np.float64))
+    delta2 = 360 - delta1
+    return np.minimum(delta1, delta2)
+
+
 def delta_heading(coordinate1, coordinate2):
     '''
     Return the change in user heading between two coordinate bearings.
@@ -36,6 +36,15 @@ class UserNotFoundError(Exception):
     pass
 
 
+# return the hex representation of a user's UUID as stored by peewee, cached since the same few
+# users' UUIDs are repeated across every row of a .csv file
+@functools.lru_cache(maxsize=65536)
+def uuid_hex(value):
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    return uuid.UUID(hex=value).hex
+
+
 # https://realpython.com/primer-on-python-decorators/#a-few-real-world-examples
 def timer(func):
     @functools.wraps(func)